@@ -0,0 +1,174 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import check_my_grade
+import generate_data
+
+DEFAULT_SIZES = [1000, 100000, 1000000]
+REGRESSION_THRESHOLD = 0.10  # Median slowdown reported as a regression by --compare
+
+
+def _operations(rng, num_students):
+    """Returns (name, setup, operation) triples; setup runs untimed before each operation"""
+    Student = check_my_grade.Student
+
+    def email():
+        return f"student{rng.randrange(num_students)}@university.edu"
+
+    def cold_load():
+        check_my_grade.StudentRepository._instances.clear()
+
+    deleted = []
+
+    def delete():
+        target = email()
+        deleted.append(Student.search_student(target))
+        Student.delete_student(target)
+
+    def restore():
+        while deleted:
+            row = deleted.pop()
+            if row is not None:
+                Student.bulk_upsert([row])
+
+    return [
+        ("load", cold_load, lambda: Student.repository()),
+        ("search", None, lambda: Student.search_student(email())),
+        ("update", None, lambda: Student.update_student(email(), new_marks=rng.randint(50, 100))),
+        ("delete", restore, delete),
+        ("sort_by_marks", None, lambda: Student.sort_students_by_marks()),
+        ("sort_by_email", None, lambda: Student.sort_students_by_email()),
+        ("sort_by_name", None, lambda: Student.sort_students_by_name()),
+        ("top_20_by_marks", None, lambda: Student.query("marks", ascending=False, limit=20, course_id="CS101")),
+        ("report", None, lambda: Student.generate_grade_report()),
+        ("statistics", None, lambda: Student.course_statistics()),
+    ]
+
+
+def _percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, round(fraction * (len(samples) - 1)))]
+
+
+def run_size(num_students, repeat, seed):
+    """Benchmarks every operation on a freshly generated dataset and returns the results"""
+    data_dir = tempfile.mkdtemp(prefix="checkmygrade-bench-")
+    try:
+        generate_data.generate(num_students, seed=seed, hash_passwords=False, out_dir=data_dir)
+        path = lambda name: os.path.join(data_dir, name)
+        check_my_grade.Base.set_file_paths(
+            path("students.csv"), path("courses.csv"), path("professors.csv"), path("login.csv"),
+            report_file=path("grade_reports.csv"), course_report_file=path("course_reports.csv"),
+            professor_report_file=path("professor_reports.csv"),
+        )
+        check_my_grade.StudentRepository._instances.clear()
+        rng = random.Random(seed)
+        results = {}
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name, setup, operation in _operations(rng, num_students):
+                samples = []
+                for _ in range(repeat):
+                    if setup:
+                        setup()
+                    start = time.perf_counter()
+                    operation()
+                    samples.append(time.perf_counter() - start)
+
+                # Memory is measured in a separate run so tracing does not skew the timings
+                if setup:
+                    setup()
+                tracemalloc.start()
+                operation()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                results[name] = {
+                    "runs": repeat,
+                    "median": statistics.median(samples),
+                    "p95": _percentile(samples, 0.95),
+                    "min": min(samples),
+                    "peak_memory_bytes": peak,
+                }
+        return results
+    finally:
+        check_my_grade.Base.set_file_paths("students.csv", "courses.csv", "professors.csv", "login.csv")
+        check_my_grade.StudentRepository._instances.clear()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes=DEFAULT_SIZES, repeat=5, seed=0):
+    """Runs the benchmark for every dataset size and returns a JSON-serialisable dict"""
+    return {
+        "meta": {
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": {str(size): run_size(size, repeat, seed) for size in sizes},
+    }
+
+
+def compare(old, new, threshold=REGRESSION_THRESHOLD):
+    """Returns report lines comparing two benchmark results and whether any median regressed"""
+    lines = [f"{'size':>9} {'operation':<16} {'old median':>12} {'new median':>12} {'change':>8}"]
+    regressed = False
+    for size, operations in new["results"].items():
+        for name, result in operations.items():
+            before = old["results"].get(size, {}).get(name)
+            if before is None:
+                continue
+            change = result["median"] / before["median"] - 1 if before["median"] else 0.0
+            flag = ""
+            if change > threshold:
+                flag, regressed = "  REGRESSION", True
+            lines.append(f"{size:>9} {name:<16} {before['median']:>12.6f} {result['median']:>12.6f} {change:>+8.1%}{flag}")
+    return lines, regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark CheckMyGrade operations on synthetic rosters")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="numbers of students to benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per operation")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the generated data and the chosen students")
+    parser.add_argument("--output", default="benchmark.json", help="where to write the JSON results")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        lines, regressed = compare(old, new)
+        print("\n".join(lines))
+        raise SystemExit(1 if regressed else 0)
+
+    results = run(args.sizes, args.repeat, args.seed)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    for size, operations in results["results"].items():
+        print(f"\n--- {size} students ---")
+        for name, result in operations.items():
+            print(f"{name:<16} median {result['median']:.6f}s  p95 {result['p95']:.6f}s  peak {result['peak_memory_bytes'] / 1e6:.1f} MB")
+    print(f"\nResults saved to {args.output}")
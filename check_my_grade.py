@@ -1,47 +1,1918 @@
+import contextlib
 import csv
+import gc
+import hashlib
+import io
+import itertools
+import json
+import math
 import os
+import secrets
+import sqlite3
+import stat
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+import numpy as np
 import pandas as pd
-from statistics import mean, median, mode
 from encdyc import TextSecurity  # Encryption class
 
+try:
+    import fcntl
+except ImportError:  # No advisory locks on Windows; writes are still atomic
+    fcntl = None
+
+_UMASK = os.umask(0o022)  # Read once at import: setting it is the only way to read it
+os.umask(_UMASK)
+
 # Default file paths
 STUDENT_FILE = "students.csv"
 COURSE_FILE = "courses.csv"
 PROFESSOR_FILE = "professors.csv"
 LOGIN_FILE = "login.csv"
+ENROLLMENT_FILE = "enrollments.csv"
 REPORT_FILE = "grade_reports.csv"
+COURSE_REPORT_FILE = "course_reports.csv"
+PROFESSOR_REPORT_FILE = "professor_reports.csv"
+
+DATABASE_FILE = "checkmygrade.db"  # Used by the "sqlite" storage backend
+
+REPORT_CHUNK_SIZE = 10000  # Report rows buffered before each write
+
+JOURNAL_SUFFIX = ".journal"  # Pending student mutations are appended to students.csv.journal
+JOURNAL_COMPACT_ENTRIES = 1000  # Fold the journal into the CSV after this many mutations
+LOCK_SUFFIX = ".lock"  # Readers and writers of students.csv coordinate through students.csv.lock
+AGGREGATES_SUFFIX = ".aggregates"  # Course aggregates saved next to students.csv at compaction
+SNAPSHOT_SUFFIX = ".snapshot"  # Binary copy of the loaded roster, reused while students.csv is unchanged
+SNAPSHOT_MAGIC = b"CMGSNAP3"  # Bump the digit when the snapshot layout changes
+SNAPSHOTS = True  # Set to False to always parse students.csv
+
+SESSION_TTL = 15 * 60  # Seconds a login session stays valid
+SESSION_CACHE_SIZE = 10000  # Least recently used sessions beyond this are evicted
+LOGIN_MAX_FAILURES = 5  # Failed attempts allowed per account within the window
+LOGIN_FAILURE_WINDOW = 5 * 60  # Seconds
+LOGIN_FAILURE_CACHE_SIZE = 10000  # Accounts with recent failures tracked; the least recently tried beyond this are forgotten
+
+GRADES = ["A", "B", "C", "D", "F"]
+STATISTICS_PERCENTILES = [0.25, 0.75, 0.9]
+
+STUDENT_HEADER = ["email", "first_name", "last_name", "course_id", "professor_email", "grade", "marks"]
+STUDENT_COLUMNS = {name: position for position, name in enumerate(STUDENT_HEADER)}
+MARKS_COLUMN = STUDENT_COLUMNS["marks"]
+ENROLLMENT_HEADER = ["email", "course_id", "grade", "marks"]
+COURSE_HEADER = ["course_id", "course_name", "description"]
+PROFESSOR_HEADER = ["email", "name", "rank", "course_id"]
+ON_DELETE = ["restrict", "cascade", "reassign"]  # What deleting a referenced course or professor does
 
 # Encryption handler
 cipher = TextSecurity(4)  # Using Caesar cipher with shift of 4
 
 
+class StaleDataError(Exception):
+    """Raised when data changed after it was read, so writing would lose someone else's update"""
+
+
+class IntegrityError(Exception):
+    """Raised when a change would duplicate a key or leave rows pointing at a missing course or professor"""
+
+
+class FileLock:
+    """Cross-process advisory lock on a sidecar file next to a data file.
+
+    Readers hold it shared and writers exclusive. It is re-entrant within a
+    process: nested holds reuse the lock. flock cannot turn a shared lock
+    into an exclusive one without letting go of it in between, so asking
+    for it exclusive inside a shared hold raises RuntimeError; write paths
+    take it exclusive from the start. Threads of one process take turns.
+    Code that holds several locks at once takes them in the order courses,
+    professors, students, enrollments, so two writers never each wait for
+    the other.
+    """
+
+    _locks = {}  # absolute data file path -> lock
+    _registry_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self.depth = 0
+        self.exclusive = False
+        self.mutex = threading.RLock()
+
+    @classmethod
+    def for_file(cls, file):
+        key = os.path.abspath(file)
+        with cls._registry_lock:
+            lock = cls._locks.get(key)
+            if lock is None:
+                lock = cls._locks[key] = cls(key + LOCK_SUFFIX)
+            return lock
+
+    def held_shared(self):
+        """Returns True if the calling thread holds the lock shared, so it cannot take it exclusive now"""
+        if not self.mutex.acquire(blocking=False):
+            return False  # Another thread holds it
+        try:
+            return self.depth > 0 and not self.exclusive
+        finally:
+            self.mutex.release()
+
+    @contextlib.contextmanager
+    def hold(self, exclusive=True):
+        with self.mutex:
+            if self.depth == 0:
+                self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                if fcntl:
+                    fcntl.flock(self.fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                self.exclusive = exclusive
+            elif exclusive and not self.exclusive:
+                raise RuntimeError(f"{self.path} is held shared and cannot be upgraded safely; take it exclusive from the start")
+            self.depth += 1
+            try:
+                yield
+            finally:
+                self.depth -= 1
+                if self.depth == 0:
+                    if fcntl:
+                        fcntl.flock(self.fd, fcntl.LOCK_UN)
+                    os.close(self.fd)
+                    self.fd = None
+
+
 class Base:
-    """Base class for handling CSV file operations"""
+    """Base class for handling CSV file operations.
+
+    Reads and writes go through the selected storage backend: plain CSV
+    files by default, or an SQLite database (see set_storage_backend).
+    """
+
+    __slots__ = ()
 
     @staticmethod
     def read_csv(file):
         """Reads data from a CSV file."""
-        if not os.path.exists(file):
+        return STORAGE.read(file)
+
+    @staticmethod
+    def file_signature(file):
+        """Returns (mtime, size) of a file, or None if it does not exist"""
+        try:
+            stat = os.stat(file)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def source_signature(file):
+        """Returns a value that changes whenever the data stored for a file changes"""
+        return STORAGE.signature(file)
+
+    @staticmethod
+    def iter_csv(file):
+        """Yields rows from a CSV file one at a time."""
+        return STORAGE.iter(file)
+
+    @staticmethod
+    def write_csv(file, data, atomic=True, expected_version=None):
+        """Writes data to a CSV file, preserving headers.
+
+        The rows go to a temp file that is fsynced and renamed over the target
+        under an exclusive lock, so readers never see a truncated file. Pass
+        the source_signature() taken when the data was read as
+        expected_version to raise StaleDataError instead of overwriting a
+        newer version.
+        """
+        with STORAGE.locked(file):
+            if expected_version is not None and STORAGE.signature(file) != expected_version:
+                raise StaleDataError(f"{file} changed since it was read")
+            STORAGE.write(file, data, atomic)
+
+    @staticmethod
+    def locked(file, exclusive=True):
+        """Context manager holding the lock on a file's data, e.g. around a read-modify-write"""
+        return STORAGE.locked(file, exclusive)
+
+    @staticmethod
+    def append_csv(file, rows, header=None):
+        """Appends rows to a CSV file, writing the header first if the file is new."""
+        STORAGE.append(file, rows, header)
+
+    @classmethod
+    def set_file_paths(cls, student_file, course_file, professor_file, login_file, report_file=None, course_report_file=None, professor_report_file=None, enrollment_file=None):
+        """Allows test cases to override file paths"""
+        global STUDENT_FILE, COURSE_FILE, PROFESSOR_FILE, LOGIN_FILE, ENROLLMENT_FILE, REPORT_FILE, COURSE_REPORT_FILE, PROFESSOR_REPORT_FILE
+        STUDENT_FILE, COURSE_FILE, PROFESSOR_FILE, LOGIN_FILE = student_file, course_file, professor_file, login_file
+        ENROLLMENT_FILE = enrollment_file or os.path.join(os.path.dirname(student_file), "enrollments.csv")
+        REPORT_FILE = report_file or "grade_reports.csv"
+        COURSE_REPORT_FILE = course_report_file or "course_reports.csv"
+        PROFESSOR_REPORT_FILE = professor_report_file or "professor_reports.csv"
+
+    @classmethod
+    def set_storage_backend(cls, backend="csv", database=None, import_csv=False):
+        """Selects where students, courses, professors and logins are stored.
+
+        backend is "csv" (one file per table) or "sqlite" (indexed tables in
+        database, DATABASE_FILE by default). With import_csv=True the current
+        CSV files are copied into the database first.
+        """
+        global STORAGE
+        if backend == "csv":
+            storage = CSVStorage()
+        elif backend == "sqlite":
+            storage = SQLiteStorage(database or DATABASE_FILE)
+            if import_csv:
+                storage.import_csv()
+        else:
+            raise ValueError(f"Unknown storage backend: {backend}")
+        STORAGE.close()
+        STORAGE = storage
+
+
+def course_statistics_frame(marks, course_ids=()):
+    """Computes per-course statistics from a frame of course_id, grade and marks columns.
+
+    Everything is grouped in one vectorized pass. Returns a DataFrame indexed by
+    course_id with count, mean, median, mode, std, min, max, the
+    STATISTICS_PERCENTILES (p25, p75, ...) and grade_<letter> counts. Courses
+    listed in course_ids without any marks get a row with a count of 0.
+    """
+    marks = marks.assign(
+        course_id=marks["course_id"].astype("category"),  # Small integer codes make grouping cheap
+        grade=marks["grade"].astype("category"),
+        marks=marks["marks"].astype("int64"),
+    )
+    grouped = marks.groupby("course_id", observed=True)["marks"]
+    stats = grouped.agg(["count", "mean", "median", "std", "min", "max"])
+
+    # Mode: the most frequent mark per course, ties going to the lowest mark
+    counts = marks.groupby(["course_id", "marks"], observed=True).size().reset_index(name="n")
+    counts = counts.sort_values(["course_id", "n", "marks"], ascending=[True, False, True])
+    stats["mode"] = counts.drop_duplicates("course_id").set_index("course_id")["marks"]
+
+    percentiles = grouped.quantile(STATISTICS_PERCENTILES).unstack()
+    percentiles.columns = [f"p{round(q * 100)}" for q in percentiles.columns]
+    stats = stats.join(percentiles)
+
+    grades = pd.crosstab(marks["course_id"], marks["grade"]).reindex(columns=GRADES, fill_value=0)
+    grades.columns = [f"grade_{grade}" for grade in grades.columns]
+    stats = stats.join(grades)
+    return _with_all_courses(stats, course_ids)
+
+
+def _with_all_courses(stats, course_ids):
+    """Adds empty rows for courses without marks and fixes up the index and count columns"""
+    stats.index = stats.index.astype(object)
+    stats = stats.reindex(stats.index.union(pd.Index(list(course_ids), dtype=object)))
+    count_columns = ["count"] + [f"grade_{grade}" for grade in GRADES]
+    stats[count_columns] = stats[count_columns].fillna(0).astype(int)
+    stats.index.name = "course_id"
+    return stats
+
+
+class CourseAggregates:
+    """Running per-course totals that are updated in O(1) for every added or removed mark.
+
+    Each course keeps its count, sum, sum of squares, a histogram of marks
+    (enough for an exact median, mode and percentiles) and grade counts, so
+    frame() gives the same table as course_statistics_frame without
+    looking at individual rows.
+    """
+
+    def __init__(self, courses=None):
+        self.courses = courses or {}  # course_id -> {"count", "sum", "sumsq", "marks": {mark: n}, "grades": {grade: n}}
+
+    def _entry(self, course_id):
+        entry = self.courses.get(course_id)
+        if entry is None:
+            entry = self.courses[course_id] = {"count": 0, "sum": 0, "sumsq": 0, "marks": {}, "grades": {}}
+        return entry
+
+    def add(self, course_id, grade, marks, n=1):
+        entry = self._entry(course_id)
+        entry["count"] += n
+        entry["sum"] += marks * n
+        entry["sumsq"] += marks * marks * n
+        entry["marks"][marks] = entry["marks"].get(marks, 0) + n
+        entry["grades"][grade] = entry["grades"].get(grade, 0) + n
+
+    def remove(self, course_id, grade, marks):
+        self.add(course_id, grade, marks, -1)
+        entry = self.courses[course_id]
+        if not entry["count"]:
+            del self.courses[course_id]
+            return
+        if not entry["marks"][marks]:
+            del entry["marks"][marks]
+        if not entry["grades"][grade]:
+            del entry["grades"][grade]
+
+    @classmethod
+    def merge(cls, *parts):
+        """Returns new aggregates holding the totals of several others"""
+        merged = cls()
+        for part in parts:
+            for course_id, entry in part.courses.items():
+                target = merged._entry(course_id)
+                for total in ("count", "sum", "sumsq"):
+                    target[total] += entry[total]
+                for counts in ("marks", "grades"):
+                    for key, n in entry[counts].items():
+                        target[counts][key] = target[counts].get(key, 0) + n
+        return merged
+
+    @staticmethod
+    def _summary(entry):
+        count = entry["count"]
+        histogram = sorted(entry["marks"].items())
+
+        def order_statistic(k):
+            for marks, n in histogram:
+                k -= n
+                if k < 0:
+                    return marks
+
+        def quantile(q):  # Linear interpolation, as pandas does
+            position = q * (count - 1)
+            low = int(position)
+            below, above = order_statistic(low), order_statistic(min(low + 1, count - 1))
+            return below + (above - below) * (position - low)
+
+        variance = (entry["sumsq"] - entry["sum"] ** 2 / count) / (count - 1) if count > 1 else math.nan
+        summary = {
+            "count": count,
+            "mean": entry["sum"] / count,
+            "median": quantile(0.5),
+            "std": math.sqrt(max(variance, 0.0)) if count > 1 else math.nan,
+            "min": histogram[0][0],
+            "max": histogram[-1][0],
+            "mode": max(histogram, key=lambda item: (item[1], -item[0]))[0],
+        }
+        for q in STATISTICS_PERCENTILES:
+            summary[f"p{round(q * 100)}"] = quantile(q)
+        for grade in GRADES:
+            summary[f"grade_{grade}"] = entry["grades"].get(grade, 0)
+        return summary
+
+    def frame(self, course_ids=()):
+        """Returns the statistics table in the same layout as course_statistics_frame"""
+        columns = ["count", "mean", "median", "std", "min", "max", "mode"]
+        columns += [f"p{round(q * 100)}" for q in STATISTICS_PERCENTILES] + [f"grade_{grade}" for grade in GRADES]
+        stats = pd.DataFrame.from_dict({course_id: self._summary(entry) for course_id, entry in self.courses.items()}, orient="index", columns=columns)
+        return _with_all_courses(stats, course_ids)
+
+    def write(self, file, signature):
+        """Saves the totals as JSON, tagged with the signature of the data they describe"""
+        fd, temp_file = _temp_file(file)
+        with os.fdopen(fd, mode="w") as f:
+            json.dump({"signature": signature, "courses": self.courses}, f)
+        os.replace(temp_file, file)
+
+    @classmethod
+    def read(cls, file, signature):
+        """Loads saved totals, or returns None if they are missing or describe other data"""
+        try:
+            with open(file) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if saved.get("signature") != list(signature or ()):
+            return None
+        return cls.from_json(saved["courses"])
+
+    @classmethod
+    def from_json(cls, courses):
+        """Rebuilds totals from their JSON form, whose mark keys came back as strings"""
+        for entry in courses.values():
+            entry["marks"] = {int(marks): n for marks, n in entry["marks"].items()}
+        return cls(courses)
+
+
+_HASH_MULTIPLIER = 0x100000001B3
+_HASH_MIX = 0xFF51AFD7ED558CCD
+_MASK64 = (1 << 64) - 1
+
+
+def _email_hash(key):
+    """Hashes UTF-8 bytes identically in every process (unlike hash()), so lookup tables can be saved"""
+    h = 0
+    for byte in reversed(key):
+        h = (h * _HASH_MULTIPLIER + byte) & _MASK64
+    h ^= h >> 33
+    h = (h * _HASH_MIX) & _MASK64
+    return h ^ (h >> 33)
+
+
+def _email_hashes(keys):
+    """_email_hash for a whole fixed-width bytes array; NUL padding hashes like nothing"""
+    data = keys.view(np.uint8).reshape(len(keys), keys.itemsize)
+    h = np.zeros(len(keys), dtype=np.uint64)
+    for column in range(keys.itemsize - 1, -1, -1):
+        h = h * np.uint64(_HASH_MULTIPLIER) + data[:, column]
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(_HASH_MIX)
+    return h ^ (h >> np.uint64(33))
+
+
+def _file_digest(file):
+    """Returns the SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(file, mode="rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _temp_file(file):
+    """Creates a temp file next to file for an atomic replace, returning (fd, path).
+
+    mkstemp makes it 0600; it gets the mode of the file it will replace, or
+    the umask default for a new file, so a rewrite keeps the file readable.
+    """
+    fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file)), suffix=".tmp")
+    try:
+        mode = stat.S_IMODE(os.stat(file).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    os.chmod(temp_file, mode)
+    return fd, temp_file
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """Suspends the cyclic garbage collector while many acyclic objects are created"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class ColumnDictionary:
+    """Dictionary encoding for a low-cardinality column: each distinct value is stored once, rows hold its code"""
+
+    def __init__(self, values=()):
+        self.values = []  # code -> interned value
+        self.codes = {}  # value -> code
+        self._ranks = None
+        self._objects = None
+        self._folded = None
+        for value in values:
+            self.encode(value)
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(sys.intern(value))
+        return code
+
+    def ranks(self):
+        """Returns an array mapping each code to its value's position in sorted order"""
+        if self._ranks is None or len(self._ranks) != len(self.values):
+            order = sorted(range(len(self.values)), key=self.values.__getitem__)
+            self._ranks = np.empty(len(order), dtype=np.int64)
+            self._ranks[order] = np.arange(len(order))
+        return self._ranks
+
+    def folded(self):
+        """Returns the casefolded values in sorted order and the code of each, for prefix search"""
+        if self._folded is None or len(self._folded[1]) != len(self.values):
+            pairs = sorted((value.casefold(), code) for code, value in enumerate(self.values))
+            self._folded = ([value for value, _ in pairs], [code for _, code in pairs])
+        return self._folded
+
+    def decode(self, codes):
+        """Returns the values for an array of codes as a list"""
+        if self._objects is None or len(self._objects) != len(self.values):
+            self._objects = np.array(self.values, dtype=object)
+        return self._objects[codes].tolist()
+
+
+class StudentColumns:
+    """Student rows stored column by column.
+
+    Marks are an int32 array and every other column except the email is
+    dictionary-encoded into an array of integer codes, so sorting and
+    statistics work on numbers without parsing strings. Emails are UTF-8 in
+    a fixed-width bytes array, as wide as the longest one. Rows are
+    addressed by slot in file order and found by email through an
+    open-addressing hash table of slot numbers, which costs a few bytes per
+    row where a dict would hold an entry, a str and an int object. A removed
+    row leaves a hole that is squeezed out once holes outnumber rows.
+    """
+
+    CODED = [1, 2, 3, 4, 5]  # first_name, last_name, course_id, professor_email, grade
+    CODE_TYPES = {5: np.int8}
+    EMPTY, REMOVED = -1, -2  # Hash table markers
+    MOVED_LIMIT = 4096  # Rows overwritten in place before the postings are rebuilt
+
+    def __init__(self):
+        self.table = np.full(1024, self.EMPTY, dtype=np.int32)  # Slot numbers at hash(email) positions
+        self.count = 0  # Live rows
+        self.used = 0  # Table cells that are not EMPTY
+        self.emails = np.empty(0, dtype="S1")  # slot -> UTF-8 email, empty once removed
+        self.dictionaries = {position: ColumnDictionary(GRADES if position == 5 else ()) for position in self.CODED}
+        self.codes = {position: np.empty(0, dtype=self.CODE_TYPES.get(position, np.int32)) for position in self.CODED}
+        self.marks = np.empty(0, dtype=np.int32)
+        self.alive = np.empty(0, dtype=bool)
+        self.size = 0  # Slots in use, including holes
+        self._postings = {}  # position -> (slots grouped by code, start of each code's group, size when built)
+        self.moved = []  # Slots overwritten in place since the postings were built
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, email):
+        return self.slot_of(email) is not None
+
+    def _probe(self, email):
+        """Returns (table position, slot) for an email, with slot None if it is not stored"""
+        table, emails, email = self.table, self.emails, email.encode("utf-8")
+        mask = len(table) - 1
+        position = _email_hash(email) & mask
+        while True:
+            slot = int(table[position])
+            if slot == self.EMPTY:
+                return position, None
+            if slot >= 0 and emails[slot] == email:
+                return position, slot
+            position = (position + 1) & mask
+
+    def slot_of(self, email):
+        """Returns the slot holding an email, or None"""
+        return self._probe(email)[1]
+
+    def slots_of(self, emails):
+        """slot_of for a list of emails at once, probing them together; returns an int64 array with -1 where absent"""
+        found = np.full(len(emails), -1, dtype=np.int64)
+        if not len(emails) or not self.count:
+            return found
+        keys = np.array([email.encode("utf-8") for email in emails], dtype=np.bytes_)
+        if keys.itemsize > self.emails.itemsize:  # Longer than every stored email, so never stored
+            fits = np.char.str_len(keys) <= self.emails.itemsize
+            found[fits] = self.slots_of([email for email, fit in zip(emails, fits.tolist()) if fit])
+            return found
+        mask = len(self.table) - 1
+        positions = (_email_hashes(keys) & np.uint64(mask)).astype(np.int64)
+        pending = np.arange(len(keys))
+        while len(pending):  # One probe step for every pending email per round, as in _insert
+            occupants = self.table[positions[pending]]
+            hit = (occupants >= 0) & (self.emails[np.maximum(occupants, 0)] == keys[pending])
+            found[pending[hit]] = occupants[hit]
+            pending = pending[~hit & (occupants != self.EMPTY)]
+            positions[pending] = (positions[pending] + 1) & mask
+        return found
+
+    def _place(self, slots):
+        """Adds new live slots to the table, rebuilding it instead when it would pass half full"""
+        if 2 * (self.used + len(slots)) > len(self.table):
+            self._rehash()
+        else:
+            self._insert(slots)
+
+    def _rehash(self):
+        """Rebuilds the table from the live slots at a quarter full"""
+        size = 1024
+        while size < 4 * self.count:
+            size *= 2
+        self.table = np.full(size, self.EMPTY, dtype=np.int32)
+        self.used = 0
+        self._insert(self.live_slots())
+
+    def _insert(self, slots):
+        """Adds live slots to the table; a slot whose email is already there is dropped as a duplicate"""
+        mask = len(self.table) - 1
+        keys = self.emails[slots]
+        positions = (_email_hashes(keys) & np.uint64(mask)).astype(np.int64)
+        pending = np.arange(len(slots))
+        while len(pending):  # Linear probing, one round per probe step for every pending slot at once
+            cells = positions[pending]
+            occupants = self.table[cells]
+            duplicate = (occupants >= 0) & (self.emails[np.maximum(occupants, 0)] == keys[pending])
+            empty = np.flatnonzero(occupants == self.EMPTY)
+            _, first = np.unique(cells[empty], return_index=True)  # The earliest slot wins a contested cell
+            winners = empty[first]
+            self.table[cells[winners]] = slots[pending[winners]]
+            self.used += len(winners)
+
+            dropped = slots[pending[duplicate]]
+            self.alive[dropped] = False
+            self.emails[dropped] = b""
+            self.count -= len(dropped)
+
+            done = duplicate
+            done[winners] = True
+            moving = ~done & (occupants != self.EMPTY)  # Losers of a contested cell retry it against the winner
+            positions[pending[moving]] = (cells[moving] + 1) & mask
+            pending = pending[~done]
+
+    def _arrays(self):
+        return [("emails", self.emails), ("marks", self.marks), ("alive", self.alive)] + [(position, codes) for position, codes in self.codes.items()]
+
+    def _reserve(self, n):
+        """Grows the arrays, doubling their capacity, so there is room for n more slots"""
+        capacity = len(self.marks)
+        if self.size + n <= capacity:
+            return
+        capacity = max(2 * capacity, self.size + n, 1024)
+        for name, array in self._arrays():
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            if name in self.codes:
+                self.codes[name] = grown
+            else:
+                setattr(self, name, grown)
+
+    @staticmethod
+    def _mark(value):
+        """Parses a marks cell, raising ValueError unless it is an integer that fits the int32 column"""
+        marks = int(value)
+        if not -2 ** 31 <= marks < 2 ** 31:
+            raise ValueError(f"marks out of range: {value!r}")
+        return marks
+
+    def _fits(self, row):
+        if len(row) != len(STUDENT_HEADER):
+            return False
+        try:
+            self._mark(row[MARKS_COLUMN])
+        except ValueError:
+            return False
+        return True
+
+    def extend(self, rows, chunk_size=REPORT_CHUNK_SIZE, malformed=None, repeated=None):
+        """Appends rows, chunk_size at a time; a row whose email is already stored goes to repeated, or is dropped.
+
+        Rows that do not fit the columns (a wrong field count, or marks that
+        are not an integer) are added to the malformed list, or raise
+        ValueError when none is given. Blank rows are skipped.
+        """
+        rows = iter(rows)
+        encoders = [(position, self.dictionaries[position].encode) for position in self.CODED]
+        while True:
+            batch = list(itertools.islice(rows, chunk_size))
+            if not batch:
+                return
+            chunk = [row for row in batch if len(row) == len(STUDENT_HEADER)]
+            try:
+                marks = [int(row[MARKS_COLUMN]) for row in chunk]
+                if marks and not -2 ** 31 <= min(marks) <= max(marks) < 2 ** 31:
+                    raise ValueError("marks out of range")
+                bad = [row for row in batch if row and len(row) != len(STUDENT_HEADER)] if len(chunk) < len(batch) else []
+            except ValueError:  # Rare, so only then is every row checked on its own
+                chunk = [row for row in batch if self._fits(row)]
+                bad = [row for row in batch if row and not self._fits(row)]
+                marks = [int(row[MARKS_COLUMN]) for row in chunk]
+            if bad:
+                if malformed is None:
+                    raise ValueError(f"Student row does not fit {', '.join(STUDENT_HEADER)}: {bad[0]}")
+                malformed.extend(bad)
+            if not chunk:
+                continue
+            emails = [row[0].encode("utf-8") for row in chunk]
+            width = max(map(len, emails))
+            if width > self.emails.itemsize:
+                self.emails = self.emails.astype(f"S{width}")
+            self._reserve(len(chunk))
+            start, end = self.size, self.size + len(chunk)
+            self.emails[start:end] = emails
+            self.marks[start:end] = marks
+            self.alive[start:end] = True
+            for position, encode in encoders:
+                self.codes[position][start:end] = [encode(row[position]) for row in chunk]
+            self.size = end
+            self.count += len(chunk)
+            self._place(np.arange(start, end))
+            if repeated is not None:
+                repeated.extend(chunk[i] for i in np.flatnonzero(~self.alive[start:end]).tolist())
+
+    def _set(self, slot, row):
+        if self._postings:
+            self.moved.append(slot)
+        self.marks[slot] = self._mark(row[MARKS_COLUMN])
+        for position in self.CODED:
+            self.codes[position][slot] = self.dictionaries[position].encode(row[position])
+
+    def row(self, slot):
+        """Materializes one row as a list of strings"""
+        row = [self.emails[slot].decode("utf-8")] + [self.dictionaries[position].values[self.codes[position][slot]] for position in self.CODED]
+        return row + [str(self.marks[slot])]
+
+    def rows(self, slots):
+        """Materializes the rows for an array of slots, decoding each column in one vectorized step"""
+        slots = np.asarray(slots, dtype=np.int64)
+        columns = [list(map(bytes.decode, self.emails[slots].tolist()))]
+        columns += [self.dictionaries[position].decode(self.codes[position][slots]) for position in self.CODED]
+        columns.append(self._mark_strings(self.marks[slots]))
+        with _gc_paused():  # Lists of strings cannot form cycles, so collecting while building them is wasted work
+            return list(map(list, zip(*columns)))
+
+    @staticmethod
+    def _mark_strings(marks):
+        if not len(marks):
             return []
-        with open(file, mode="r", newline="") as f:
-            return list(csv.reader(f))
+        low, high = int(marks.min()), int(marks.max())
+        if high - low > 10000:
+            return list(map(str, marks.tolist()))
+        table = np.array([str(mark) for mark in range(low, high + 1)], dtype=object)
+        return table[marks - low].tolist()
+
+    def iter_rows(self, chunk_size=REPORT_CHUNK_SIZE):
+        """Yields every row in file order, materializing chunk_size rows at a time"""
+        slots = self.live_slots()
+        for start in range(0, len(slots), chunk_size):
+            yield from self.rows(slots[start:start + chunk_size])
+
+    def get(self, email):
+        slot = self.slot_of(email)
+        return None if slot is None else self.row(slot)
+
+    def put(self, row):
+        """Inserts a row, or overwrites the row with the same email in place; returns the old row or None"""
+        if not self._fits(row):
+            raise ValueError(f"Student row does not fit {', '.join(STUDENT_HEADER)}: {list(row)}")
+        slot = self.slot_of(row[0])
+        if slot is None:
+            self.extend([row])
+            return None
+        old = self.row(slot)
+        self._set(slot, row)
+        return old
+
+    def put_many(self, rows):
+        """Inserts or overwrites many rows, new ones in one extend; returns how many were new. The last row for an email wins"""
+        rows = {row[0]: row for row in rows}
+        for row in rows.values():
+            if not self._fits(row):
+                raise ValueError(f"Student row does not fit {', '.join(STUDENT_HEADER)}: {list(row)}")
+        slots = self.slots_of(list(rows))
+        rows = list(rows.values())
+        existing = np.flatnonzero(slots >= 0)
+        if len(existing):  # Overwrite every existing row column by column, as _set does one at a time
+            changed = [rows[i] for i in existing.tolist()]
+            targets = slots[existing]
+            if self._postings:
+                self.moved.extend(targets.tolist())
+            self.marks[targets] = [self._mark(row[MARKS_COLUMN]) for row in changed]
+            for position in self.CODED:
+                encode = self.dictionaries[position].encode
+                self.codes[position][targets] = [encode(row[position]) for row in changed]
+        new = [rows[i] for i in np.flatnonzero(slots < 0).tolist()]
+        self.extend(new)
+        return len(new)
+
+    def remove(self, email):
+        """Removes the row for an email, returning it or None"""
+        position, slot = self._probe(email)
+        if slot is None:
+            return None
+        row = self.row(slot)
+        self.table[position] = self.REMOVED
+        self.emails[slot] = b""
+        self.alive[slot] = False
+        self.count -= 1
+        if self.size - self.count > max(1024, self.count):
+            self.take(self.live_slots())
+        return row
+
+    def take(self, slots):
+        """Keeps only the given slots, in the given order"""
+        slots = np.asarray(slots, dtype=np.int64)
+        self.marks = self.marks[slots]
+        self.alive = np.ones(len(slots), dtype=bool)
+        for position in self.CODED:
+            self.codes[position] = self.codes[position][slots]
+        self.emails = self.emails[slots]
+        self.size = self.count = len(slots)
+        self._postings, self.moved = {}, []  # Slot numbers changed
+        self._rehash()
+
+    def live_slots(self):
+        """Returns the slots holding rows, in file order"""
+        return np.flatnonzero(self.alive[:self.size])
+
+    def matching(self, slots, position, value):
+        """Narrows slots to rows whose column equals value, compared as in the CSV"""
+        value = str(value)
+        if position == 0:
+            slot = self.slot_of(value)
+            return slots[slots == (-1 if slot is None else slot)]
+        if position == MARKS_COLUMN:
+            try:
+                marks = int(value)
+            except ValueError:
+                return slots[:0]
+            return slots[self.marks[slots] == marks] if str(marks) == value else slots[:0]
+        code = self.dictionaries[position].codes.get(value)
+        return slots[:0] if code is None else slots[self.codes[position][slots] == code]
+
+    def postings(self, position):
+        """Returns (slots, starts) for a coded column: slots[starts[code]:starts[code + 1]] held code, in file order.
+
+        Built with one stable argsort and kept until slots are renumbered or
+        many rows are appended or change in place, so code_slots() rechecks
+        what it lists.
+        """
+        if len(self.moved) > self.MOVED_LIMIT:
+            self._postings, self.moved = {}, []
+        entry = self._postings.get(position)
+        if entry is None or self.size - entry[2] > self.MOVED_LIMIT:
+            codes = self.codes[position][:self.size]
+            order = np.argsort(codes, kind="stable").astype(np.int32)
+            starts = np.searchsorted(codes[order], np.arange(len(self.dictionaries[position].values) + 1))
+            entry = self._postings[position] = (order, starts, self.size)
+        return entry
+
+    def code_slots(self, position, code, chunk_size=256):
+        """Yields arrays of the live slots whose column holds code, growing from chunk_size.
+
+        Slots come in file order, except that rows appended or overwritten
+        since the postings were built come last.
+        """
+        order, starts, built = self.postings(position)
+        codes = self.codes[position]
+        moved = np.unique(np.asarray(self.moved, dtype=np.int32))
+        start, end = (starts[code], starts[code + 1]) if code + 1 < len(starts) else (0, 0)
+        while start < end:
+            listed = order[start:start + chunk_size]
+            start += chunk_size
+            chunk_size *= 2
+            keep = self.alive[listed] & (codes[listed] == code)
+            if len(moved):
+                keep &= ~np.isin(listed, moved, assume_unique=True)
+            if keep.any():
+                yield listed[keep]
+        recent = np.union1d(moved, np.arange(built, self.size, dtype=np.int32))  # A row appended and then changed is in both
+        recent = recent[self.alive[recent] & (codes[recent] == code)]
+        if len(recent):
+            yield recent
+
+    def value_slots(self, position, value):
+        """Returns the live slots whose coded column equals value, in file order, from the postings"""
+        code = self.dictionaries[position].codes.get(str(value))
+        parts = [] if code is None else list(self.code_slots(position, code, chunk_size=4096))
+        return np.sort(np.concatenate(parts)).astype(np.int64) if parts else np.empty(0, dtype=np.int64)
+
+    def filtered(self, filters):
+        """Returns the live slots matching (position, value) filters in file order.
+
+        The first filter on the email or a coded column is answered from the
+        hash table or the postings, so a lookup costs about its result size;
+        only the remaining filters look at each of those slots.
+        """
+        filters = list(filters)
+        for i, (position, value) in enumerate(filters):
+            if position == 0:
+                slot = self.slot_of(str(value))
+                slots = np.array([] if slot is None else [slot], dtype=np.int64)
+            elif position in self.CODED:
+                slots = self.value_slots(position, value)
+            else:
+                continue
+            del filters[i]
+            break
+        else:
+            slots = self.live_slots()
+        for position, value in filters:
+            slots = self.matching(slots, position, value)
+        return slots
+
+    def sort_key(self, slots, position, ascending=True):
+        """Returns an integer array that orders slots by a column"""
+        if position == MARKS_COLUMN:
+            key = self.marks[slots].astype(np.int64)
+        elif position == 0:
+            key = np.empty(len(slots), dtype=np.int64)
+            key[np.argsort(self.emails[slots], kind="stable")] = np.arange(len(slots))  # UTF-8 bytes sort in code point order
+        else:
+            key = self.dictionaries[position].ranks()[self.codes[position][slots]]
+        return key if ascending else -key
+
+    def select(self, filters=(), keys=(), offset=0, end=None):
+        """Returns rows matching (position, value) filters, ordered by (position, ascending) keys, sliced [offset:end].
+
+        Ties keep file order. With an end, rows that cannot reach the top end
+        by the first key are dropped before sorting.
+        """
+        slots = self.filtered(filters)
+        if keys:
+            sort_keys = [self.sort_key(slots, position, ascending) for position, ascending in keys]
+            if end is not None and 0 < end < len(slots):
+                cutoff = np.partition(sort_keys[0], end - 1)[end - 1]
+                keep = sort_keys[0] <= cutoff
+                slots, sort_keys = slots[keep], [key[keep] for key in sort_keys]
+            slots = slots[np.lexsort(sort_keys[::-1])]  # lexsort is stable and sorts by the last key first
+        return self.rows(slots[offset:end])
+
+    def _snapshot_arrays(self):
+        arrays = {"emails": self.emails, "marks": self.marks, "alive": self.alive}
+        arrays.update((f"codes{position}", self.codes[position]) for position in self.CODED)
+        return {name: array[:self.size] for name, array in arrays.items()}
+
+    def write_snapshot(self, file, meta):
+        """Saves the columns and hash table as a JSON header followed by the raw arrays, 64-byte aligned"""
+        arrays = self._snapshot_arrays()
+        arrays["table"] = self.table
+        layout, offset = {}, 0
+        for name, array in arrays.items():
+            layout[name] = [array.dtype.str, offset, len(array)]
+            offset += -(-array.nbytes // 64) * 64
+        header = json.dumps({
+            "meta": meta, "size": self.size, "count": self.count, "used": self.used,
+            "dictionaries": {position: self.dictionaries[position].values for position in self.CODED},
+            "arrays": layout,
+        }).encode("utf-8")
+        start = -(-(len(SNAPSHOT_MAGIC) + 8 + len(header)) // 64) * 64
+
+        fd, temp_file = _temp_file(file)
+        try:
+            with os.fdopen(fd, mode="wb") as f:
+                f.write(SNAPSHOT_MAGIC + len(header).to_bytes(8, "little") + header)
+                for name, array in arrays.items():
+                    f.seek(start + layout[name][1])
+                    f.write(np.ascontiguousarray(array).tobytes())
+                f.truncate(start + offset)
+            os.replace(temp_file, file)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+    @classmethod
+    def read_snapshot(cls, file):
+        """Returns (columns, meta) from a snapshot, or None if it is missing or unreadable.
+
+        The arrays are memory-mapped copy-on-write: pages are only read when
+        touched, and changes stay private to this process.
+        """
+        try:
+            with open(file, mode="rb") as f:
+                if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                    return None
+                length = int.from_bytes(f.read(8), "little")
+                header = json.loads(f.read(length))
+        except (OSError, ValueError):
+            return None
+        start = -(-(len(SNAPSHOT_MAGIC) + 8 + length) // 64) * 64
+
+        arrays = {}
+        for name, (dtype, offset, length) in header["arrays"].items():
+            if length:
+                arrays[name] = np.memmap(file, dtype=dtype, mode="c", offset=start + offset, shape=(length,)).view(np.ndarray)
+            else:
+                arrays[name] = np.zeros(0, dtype=dtype)
+
+        columns = cls()
+        columns.emails, columns.marks, columns.alive, columns.table = arrays["emails"], arrays["marks"], arrays["alive"], arrays["table"]
+        for position in cls.CODED:
+            columns.codes[position] = arrays[f"codes{position}"]
+            columns.dictionaries[position] = ColumnDictionary(header["dictionaries"][str(position)])
+        columns.size, columns.count, columns.used = header["size"], header["count"], header["used"]
+        return columns, header["meta"]
+
+    def marks_frame(self):
+        """Returns course_id, grade and marks for every row, built straight from the code arrays"""
+        slots = self.live_slots()
+        return pd.DataFrame({
+            "course_id": pd.Categorical.from_codes(self.codes[3][slots], categories=self.dictionaries[3].values),
+            "grade": pd.Categorical.from_codes(self.codes[5][slots], categories=self.dictionaries[5].values),
+            "marks": self.marks[slots].astype(np.int64),
+        })
+
+    def value_counts(self, position):
+        """Returns {value: rows} for a dictionary-encoded column, counted with one bincount"""
+        dictionary = self.dictionaries[position]
+        counts = np.bincount(self.codes[position][self.live_slots()], minlength=len(dictionary.values))
+        return {dictionary.values[code]: int(counts[code]) for code in np.flatnonzero(counts)}
+
+    def aggregates(self):
+        """Returns CourseAggregates for every row, counted per (course, grade, mark) in one group-by"""
+        aggregates = CourseAggregates()
+        counts = self.marks_frame().groupby(["course_id", "grade", "marks"], observed=True).size()
+        for (course_id, grade, marks), n in counts.items():
+            aggregates.add(course_id, grade, int(marks), int(n))
+        return aggregates
+
+
+class StudentRepository:
+    """Keeps a students CSV file in memory as StudentColumns.
+
+    Mutations are appended to a journal next to the CSV ("put" with the full
+    row, or "del" with the email) and replayed on load; compact() folds the
+    journal into a fresh CSV. A binary snapshot of the columns is kept next
+    to the CSV, so a later load maps it instead of parsing text. Rows that
+    do not fit the columns, and rows repeating an email already loaded, are
+    left out of every lookup but kept, and compact() writes them back
+    unchanged after the others until move_repeated() turns the repeats into
+    enrollments.
+    """
+
+    _instances = {}  # absolute path -> repository
+    REFERENCES = [3, 4]  # course_id and professor_email, counted for integrity checks
+
+    def __init__(self, file):
+        self.file = file
+        self.journal_file = file + JOURNAL_SUFFIX
+        self.journal_entries = 0
+        self.journal_offset = 0  # Bytes of the journal already replayed
+        self.header = []
+        self.columns = StudentColumns()
+        self.malformed = []  # Rows that do not fit the columns, kept as read and written back by compact()
+        self.repeated = []  # Later rows for an email already loaded, the old way of listing further courses
+        self.aggregates = CourseAggregates()
+        self.references = {position: {} for position in self.REFERENCES}  # position -> {value: rows}
+        self.aggregates_file = file + AGGREGATES_SUFFIX
+        self.snapshot_file = file + SNAPSHOT_SUFFIX
+        self.signature = None
+        self.loaded = False
+
+    @classmethod
+    def for_file(cls, file):
+        """Returns the shared repository for a file, reloading it only if the file changed"""
+        key = os.path.abspath(file)
+        repo = cls._instances.get(key)
+        if repo is None:
+            repo = cls._instances[key] = cls(file)
+        repo.refresh()
+        return repo
+
+    def current_signature(self):
+        """Returns the signatures of the CSV file and its journal"""
+        return Base.file_signature(self.file), Base.file_signature(self.journal_file)
+
+    def refresh(self):
+        """Reloads if the file changed, or replays only new journal entries if just the journal grew"""
+        if not self.loaded:
+            self.load()
+            return
+        signature = self.current_signature()
+        if signature == self.signature:
+            return
+        if signature[0] == self.signature[0] and signature[1] is not None and signature[1][1] >= self.journal_offset:
+            self._replay_journal()
+            self.signature = signature
+        else:
+            self.load()
+
+    def load(self):
+        """Loads the fresh snapshot, or parses the whole file and snapshots it, then replays the journal"""
+        with FileLock.for_file(self.file).hold(exclusive=False):
+            signature = self.current_signature()
+            if not self._read_snapshot(signature[0]):
+                rows = CSVStorage.iter(self.file)
+                self.header = next(rows, None) or list(STUDENT_HEADER)
+                self.columns, self.malformed, self.repeated = StudentColumns(), [], []
+                self.columns.extend(rows, malformed=self.malformed, repeated=self.repeated)
+                # Reuse the totals saved at the last compaction when they describe this exact file
+                self.aggregates = CourseAggregates.read(self.aggregates_file, signature[0]) or self.columns.aggregates()
+                self._write_snapshot(signature[0])
+            self.references = {position: self.columns.value_counts(position) for position in self.REFERENCES}
+        self.journal_entries = self.journal_offset = 0
+        self._replay_journal()
+        self.signature = signature
+        self.loaded = True
+
+    def _read_snapshot(self, source):
+        """Loads the snapshot if it was taken from the CSV as it is now, returning True if it was used"""
+        if not SNAPSHOTS or source is None:
+            return False
+        snapshot = StudentColumns.read_snapshot(self.snapshot_file)
+        if snapshot is None:
+            return False
+        columns, meta = snapshot
+        saved = meta["source"]
+        if saved["size"] != source[1]:
+            return False
+        if saved["mtime_ns"] != source[0] and saved["sha256"] != _file_digest(self.file):
+            return False  # Same size but a new mtime: only the content hash can tell if it really changed
+        self.header, self.columns, self.malformed, self.repeated = meta["header"], columns, meta["malformed"], meta["repeated"]
+        self.aggregates = CourseAggregates.from_json(meta["aggregates"])
+        return True
+
+    def _write_snapshot(self, source):
+        """Snapshots the columns as loaded from the CSV with the given signature"""
+        if not SNAPSHOTS or source is None:
+            return
+        self.columns.write_snapshot(self.snapshot_file, {
+            "source": {"mtime_ns": source[0], "size": source[1], "sha256": _file_digest(self.file)},
+            "header": self.header,
+            "malformed": self.malformed,
+            "repeated": self.repeated,
+            "aggregates": self.aggregates.courses,
+        })
+
+    def _replay_journal(self):
+        """Applies journal entries written since the last replay"""
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, mode="rb") as f:
+            f.seek(self.journal_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # An unterminated last line is still being written, or was torn by a crash
+        self.journal_offset += end
+
+        for entry in csv.reader(io.StringIO(data[:end].decode("utf-8"), newline="")):
+            if entry[:1] == ["put"] and len(entry) == len(self.header) + 1:
+                self.put(entry[1:])
+            elif entry[:1] == ["del"] and len(entry) == 2:
+                self.remove(entry[1])
+            else:
+                continue  # Skip torn or unknown entries
+            self.journal_entries += 1
+
+    def record(self, entries):
+        """Appends entries already applied in memory to the journal.
+
+        When the journal would grow past JOURNAL_COMPACT_ENTRIES the rows are
+        compacted instead, so a large batch costs one file write.
+        """
+        if not entries:
+            return
+        with self.writing(refresh=False):
+            self._check_fresh()
+            if self.journal_entries + len(entries) >= JOURNAL_COMPACT_ENTRIES:
+                self.compact()
+            else:
+                self._append_journal(entries)
+
+    @contextlib.contextmanager
+    def writing(self, refresh=True):
+        """Holds the exclusive lock for a read-modify-write, starting from the latest data"""
+        with FileLock.for_file(self.file).hold(exclusive=True):
+            if refresh:
+                self.refresh()
+            yield self
+
+    def _check_fresh(self):
+        """Raises StaleDataError if another process wrote since this copy was loaded"""
+        if self.current_signature() != self.signature:
+            self.loaded = False  # The in-memory rows hold a change the files never got; start over
+            raise StaleDataError(f"{self.file} changed since it was read")
+
+    def _append_journal(self, entries):
+        buffer = io.StringIO(newline="")
+        csv.writer(buffer).writerows(entries)
+        data = buffer.getvalue().encode("utf-8")
+
+        with open(self.journal_file, mode="a+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size:
+                f.seek(size - 1)
+                if f.read(1) != b"\n":
+                    data = b"\n" + data  # Never glue an entry onto a line torn by a crash
+            f.write(data)
+            self.journal_offset = f.tell()
+        self.journal_entries += len(entries)
+        self.signature = self.current_signature()
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __contains__(self, email):
+        return email in self.columns
+
+    def get(self, email):
+        """Returns the row for an email, or None"""
+        return self.columns.get(email)
+
+    def student(self, email):
+        """Returns a Student view of the row for an email, or None"""
+        row = self.columns.get(email)
+        return None if row is None else Student(*row)
+
+    def all_rows(self):
+        """Returns every row in file order"""
+        return self.columns.iter_rows()
+
+    def select(self, filters=(), keys=(), offset=0, end=None):
+        """Returns a filtered, sorted slice of rows; see StudentColumns.select"""
+        return self.columns.select(filters, keys, offset, end)
+
+    def marks_frame(self):
+        """Returns course_id, grade and marks for every row as a DataFrame"""
+        return self.columns.marks_frame()
+
+    def course_rows(self, course_id):
+        """Returns all rows enrolled in a course"""
+        return self.columns.select([(3, course_id)])
+
+    def course_aggregates(self):
+        """Returns the per-course totals kept up to date by every mutation"""
+        return self.aggregates
+
+    def professor_rows(self, professor_email):
+        """Returns all rows taught by a professor"""
+        return self.columns.select([(4, professor_email)])
+
+    def reference_count(self, position, value):
+        """Returns how many rows hold value in the course_id or professor_email column"""
+        return self.references[position].get(value, 0)
+
+    def reference_counts(self, position):
+        """Returns {value: rows} for the course_id or professor_email column"""
+        return dict(self.references[position])
+
+    def _reference(self, row, n):
+        for position in self.REFERENCES:
+            counts = self.references[position]
+            counts[row[position]] = counts.get(row[position], 0) + n
+            if not counts[row[position]]:
+                del counts[row[position]]
+
+    def put(self, row):
+        """Inserts a row, or replaces the row with the same email in place"""
+        old = self.columns.put(row)
+        if old is not None:
+            self.aggregates.remove(old[3], old[5], int(old[6]))
+            self._reference(old, -1)
+        self.aggregates.add(row[3], row[5], int(row[6]))
+        self._reference(row, 1)
+
+    def put_many(self, rows, recount=True):
+        """Inserts or replaces many rows at once, returning how many were new.
+
+        The per-course aggregates and reference counts are rebuilt from the
+        columns instead of adjusted row by row; with recount=False that is
+        left to a later recount(), e.g. after the last chunk of an import.
+        """
+        inserted = self.columns.put_many(rows)
+        if recount:
+            self.recount()
+        return inserted
+
+    def recount(self):
+        """Rebuilds the aggregates and reference counts from the columns"""
+        self.aggregates = self.columns.aggregates()
+        self.references = {position: self.columns.value_counts(position) for position in self.REFERENCES}
+
+    def remove(self, email):
+        """Removes the in-memory row for an email, returning it or None"""
+        row = self.columns.remove(email)
+        if row is not None:
+            self.aggregates.remove(row[3], row[5], int(row[6]))
+            self._reference(row, -1)
+        return row
+
+    def reorder(self, rows):
+        """Replaces the row order"""
+        self.columns.take([self.columns.slot_of(row[0]) for row in rows])
+
+    def upsert(self, row):
+        """Inserts or replaces a row and records it in the journal"""
+        self.put(row)
+        self.record([["put"] + list(row)])
+
+    def delete(self, email):
+        """Removes a row and records the deletion in the journal, returning the row or None"""
+        row = self.remove(email)
+        if row is not None:
+            self.record([["del", email]])
+        return row
+
+    def move_repeated(self, enrollments):
+        """Turns rows repeating a student's email into enrollments in their courses, returning how many moved.
+
+        A repeat of the student's primary course or of a course they are
+        already enrolled in cannot become an enrollment, so it is kept with
+        the malformed rows for check_integrity to report.
+        """
+        with self.writing():
+            if not self.repeated:
+                return 0
+            moved, kept = {}, []
+            for row in self.repeated:
+                current = self.get(row[0])
+                key = (row[0], row[3])
+                if current is None or current[3] == row[3] or key in moved or enrollments.get(*key) is not None:
+                    kept.append(row)
+                else:
+                    moved[key] = [row[0], row[3], row[5], row[6]]
+            enrollments.put_many(moved.values())
+            self.malformed.extend(kept)
+            self.repeated = []
+            self.compact()
+            return len(moved)
+
+    def compact(self):
+        """Folds the journal into a fresh CSV that is written to a temp file and renamed into place"""
+        with self.writing(refresh=False):
+            self._check_fresh()
+            CSVStorage.write(self.file, itertools.chain([self.header], self.columns.iter_rows(), self.repeated, self.malformed), atomic=True)
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+            self.journal_entries = self.journal_offset = 0
+            self.signature = self.current_signature()
+            self.aggregates.write(self.aggregates_file, self.signature[0])
+            self._write_snapshot(self.signature[0])
+
+
+class CSVStorage:
+    """Storage backend that keeps each table in its own CSV file"""
+
+    name = "csv"
 
     @staticmethod
-    def write_csv(file, data):
-        """Writes data to a CSV file, preserving headers."""
-        if data:
+    def locked(file, exclusive=True):
+        return FileLock.for_file(file).hold(exclusive)
+
+    @staticmethod
+    def read(file):
+        with FileLock.for_file(file).hold(exclusive=False):
+            if not os.path.exists(file):
+                return []
+            with open(file, mode="r", newline="") as f:
+                return list(csv.reader(f))
+
+    @staticmethod
+    def iter(file):
+        with FileLock.for_file(file).hold(exclusive=False):
+            if not os.path.exists(file):
+                return
+            with open(file, mode="r", newline="") as f:
+                yield from csv.reader(f)
+
+    @staticmethod
+    def write(file, data, atomic=True):
+        if not data:
+            return
+        with FileLock.for_file(file).hold(exclusive=True):
+            CSVStorage._write(file, data, atomic)
+
+    @staticmethod
+    def _write(file, data, atomic):
+        if not atomic:
             with open(file, mode="w", newline="") as f:
                 writer = csv.writer(f)
                 writer.writerows(data)
+            return
+
+        fd, temp_file = _temp_file(file)
+        try:
+            with os.fdopen(fd, mode="w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerows(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, file)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+    @staticmethod
+    def append(file, rows, header=None):
+        with FileLock.for_file(file).hold(exclusive=True):
+            write_header = header is not None and (not os.path.exists(file) or os.path.getsize(file) == 0)
+            with open(file, mode="a", newline="") as f:
+                writer = csv.writer(f)
+                if write_header:
+                    writer.writerow(header)
+                writer.writerows(rows)
+
+    @staticmethod
+    def signature(file):
+        return Base.file_signature(file)
+
+    @staticmethod
+    def student_repository(file):
+        return StudentRepository.for_file(file)
+
+    def close(self):
+        pass
+
+
+SQLITE_TABLES = {
+    "students": STUDENT_HEADER,
+    "courses": COURSE_HEADER,
+    "professors": PROFESSOR_HEADER,
+    "logins": ["email", "password", "role"],
+    "enrollments": ENROLLMENT_HEADER,
+}
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    email TEXT PRIMARY KEY, first_name TEXT, last_name TEXT, course_id TEXT,
+    professor_email TEXT, grade TEXT, marks INTEGER
+);
+CREATE INDEX IF NOT EXISTS students_course ON students (course_id, grade, marks);
+CREATE INDEX IF NOT EXISTS students_professor ON students (professor_email);
+CREATE TABLE IF NOT EXISTS courses (course_id TEXT, course_name TEXT, description TEXT);
+CREATE INDEX IF NOT EXISTS courses_id ON courses (course_id);
+CREATE TABLE IF NOT EXISTS professors (email TEXT, name TEXT, rank TEXT, course_id TEXT);
+CREATE INDEX IF NOT EXISTS professors_email ON professors (email);
+CREATE TABLE IF NOT EXISTS logins (email TEXT, password TEXT, role TEXT);
+CREATE INDEX IF NOT EXISTS logins_email ON logins (email);
+CREATE TABLE IF NOT EXISTS enrollments (
+    email TEXT, course_id TEXT, grade TEXT, marks INTEGER, PRIMARY KEY (email, course_id)
+);
+CREATE INDEX IF NOT EXISTS enrollments_course ON enrollments (course_id);
+"""
+
+
+class SQLiteStorage:
+    """Storage backend that keeps students, courses, professors and logins in SQLite tables.
+
+    Tables stand in for the file paths set with Base.set_file_paths; any
+    other file (such as the reports) is still read and written as CSV.
+    Rows come back as lists of strings, like csv.reader gives them.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, database):
+        self.database = database
+        self.connection = sqlite3.connect(database, check_same_thread=False)
+        self.connection.row_factory = lambda cursor, row: [str(value) for value in row]
+        self.connection.executescript(SQLITE_SCHEMA)
+        self.lock = threading.RLock()
+        self.depth = 0  # Nesting of locked() blocks; commits wait for the outermost one
+        self.students = SQLiteStudentRepository(self)
+
+    @contextlib.contextmanager
+    def locked(self, file=None, exclusive=True):
+        """Holds a write transaction (BEGIN IMMEDIATE locks out other processes) until the block ends"""
+        if self.table_for(file) is None and file is not None:
+            with CSVStorage.locked(file, exclusive):
+                yield
+            return
+        with self.lock:
+            if self.depth == 0 and exclusive:
+                if self.connection.in_transaction:
+                    self.connection.commit()
+                self.connection.execute("BEGIN IMMEDIATE")
+            self.depth += 1
+            try:
+                yield
+            except BaseException:
+                self.depth -= 1
+                if self.depth == 0 and self.connection.in_transaction:
+                    self.connection.rollback()
+                raise
+            self.depth -= 1
+            if self.depth == 0:
+                self.connection.commit()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Runs statements in a transaction that commits now, or with the enclosing locked() block"""
+        with self.lock:
+            try:
+                yield self.connection
+            except BaseException:
+                if self.depth == 0:
+                    self.connection.rollback()
+                raise
+            self.commit()
+
+    def commit(self):
+        """Commits unless a locked() block is still open"""
+        with self.lock:
+            if self.depth == 0:
+                self.connection.commit()
+
+    @staticmethod
+    def table_for(file):
+        """Returns the table that stores a file, or None"""
+        return {
+            STUDENT_FILE: "students", COURSE_FILE: "courses", PROFESSOR_FILE: "professors",
+            LOGIN_FILE: "logins", ENROLLMENT_FILE: "enrollments",
+        }.get(file)
+
+    def read(self, file):
+        table = self.table_for(file)
+        if table is None:
+            return CSVStorage.read(file)
+        with self.lock:
+            return [list(SQLITE_TABLES[table])] + self.connection.execute(f"SELECT * FROM {table} ORDER BY rowid").fetchall()
+
+    def iter(self, file):
+        table = self.table_for(file)
+        if table is None:
+            yield from CSVStorage.iter(file)
+            return
+        yield list(SQLITE_TABLES[table])
+        with self.lock:
+            cursor = self.connection.execute(f"SELECT * FROM {table} ORDER BY rowid")
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(REPORT_CHUNK_SIZE)
+            if not rows:
+                return
+            yield from rows
+
+    def write(self, file, data, atomic=True):
+        """Replaces a table's rows in one transaction; data starts with the header row"""
+        table = self.table_for(file)
+        if table is None:
+            CSVStorage.write(file, data, atomic)
+            return
+        if not data:
+            return
+        columns = SQLITE_TABLES[table]
+        with self.transaction():
+            self.connection.execute(f"DELETE FROM {table}")
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO {table} VALUES ({', '.join('?' * len(columns))})",
+                (row for row in data[1:] if len(row) == len(columns)),
+            )
+
+    def append(self, file, rows, header=None):
+        table = self.table_for(file)
+        if table is None:
+            CSVStorage.append(file, rows, header)
+            return
+        columns = SQLITE_TABLES[table]
+        with self.transaction():
+            self.connection.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({', '.join('?' * len(columns))})", rows)
+
+    def signature(self, file):
+        if self.table_for(file) is None:
+            return Base.file_signature(file)
+        return Base.file_signature(self.database)
+
+    def student_repository(self, file):
+        return self.students
+
+    def import_csv(self):
+        """Copies the current CSV files into the database, replacing what the tables held"""
+        students = StudentRepository(STUDENT_FILE)
+        students.load()  # Includes any journal entries not yet compacted
+        students.move_repeated(EnrollmentRepository.for_file(ENROLLMENT_FILE))
+        self.write(STUDENT_FILE, [students.header] + list(students.all_rows()))
+        for file in (COURSE_FILE, PROFESSOR_FILE, LOGIN_FILE, ENROLLMENT_FILE):
+            self.write(file, CSVStorage.read(file))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class SQLiteStudentRepository:
+    """Student rows in the SQLite students table, with the same interface as StudentRepository.
+
+    put() and remove() run inside the open transaction; record(), upsert()
+    and delete() commit it.
+    """
+
+    header = STUDENT_HEADER
+    loaded = True
+
+    UPSERT = (
+        "INSERT INTO students VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (email) DO UPDATE SET "
+        "first_name = excluded.first_name, last_name = excluded.last_name, course_id = excluded.course_id, "
+        "professor_email = excluded.professor_email, grade = excluded.grade, marks = excluded.marks"
+    )
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.connection = storage.connection
+        self.lock = storage.lock
+
+    def writing(self):
+        """Holds the write transaction for a read-modify-write"""
+        return self.storage.locked(STUDENT_FILE)
+
+    def _select(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def refresh(self):
+        pass
+
+    def __len__(self):
+        return int(self._select("SELECT COUNT(*) FROM students")[0][0])
+
+    def __contains__(self, email):
+        return bool(self._select("SELECT 1 FROM students WHERE email = ?", (email,)))
+
+    def get(self, email):
+        rows = self._select("SELECT * FROM students WHERE email = ?", (email,))
+        return rows[0] if rows else None
+
+    def all_rows(self):
+        return self._select("SELECT * FROM students ORDER BY rowid")
+
+    def student(self, email):
+        row = self.get(email)
+        return None if row is None else Student(*row)
+
+    def select(self, filters=(), keys=(), offset=0, end=None):
+        """Filters, sorts and slices in SQL; rowid breaks ties so equal rows keep file order"""
+        where = " AND ".join(f"{STUDENT_HEADER[position]} = ?" for position, _ in filters)
+        order = [f"{STUDENT_HEADER[position]} {'ASC' if ascending else 'DESC'}" for position, ascending in keys]
+        sql = "SELECT * FROM students" + (f" WHERE {where}" if where else "") + " ORDER BY " + ", ".join(order + ["rowid"])
+        params = [int(value) if position == MARKS_COLUMN and str(value).lstrip("-").isdigit() else str(value) for position, value in filters]
+        sql += " LIMIT ? OFFSET ?"
+        params += [-1 if end is None else max(end - offset, 0), offset]
+        return self._select(sql, params)
+
+    def course_rows(self, course_id):
+        return self._select("SELECT * FROM students WHERE course_id = ? ORDER BY rowid", (course_id,))
+
+    def professor_rows(self, professor_email):
+        return self._select("SELECT * FROM students WHERE professor_email = ? ORDER BY rowid", (professor_email,))
+
+    def reference_count(self, position, value):
+        """Counts rows holding value, from the course or professor index"""
+        return int(self._select(f"SELECT COUNT(*) FROM students WHERE {STUDENT_HEADER[position]} = ?", (value,))[0][0])
+
+    def reference_counts(self, position):
+        column = STUDENT_HEADER[position]
+        return {value: int(n) for value, n in self._select(f"SELECT {column}, COUNT(*) FROM students GROUP BY {column}")}
+
+    def marks_frame(self):
+        """Returns course_id, grade and marks for every row, read from the covering course index"""
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.row_factory = None  # Keep marks as integers
+            rows = cursor.execute("SELECT course_id, grade, marks FROM students").fetchall()
+        return pd.DataFrame(rows, columns=["course_id", "grade", "marks"])
+
+    def course_aggregates(self):
+        """Builds per-course totals with one GROUP BY over the covering course index"""
+        aggregates = CourseAggregates()
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.row_factory = None
+            rows = cursor.execute("SELECT course_id, grade, marks, COUNT(*) FROM students GROUP BY course_id, grade, marks").fetchall()
+        for course_id, grade, marks, n in rows:
+            aggregates.add(course_id, grade, marks, n)
+        return aggregates
+
+    def put(self, row):
+        with self.lock:
+            self.connection.execute(self.UPSERT, row)
+
+    def put_many(self, rows, recount=True):
+        rows = list({row[0]: row for row in rows}.values())
+        existing = 0
+        with self.lock:
+            for start in range(0, len(rows), 500):  # SQLite caps the number of bound parameters
+                emails = [row[0] for row in rows[start:start + 500]]
+                existing += len(self._select(f"SELECT 1 FROM students WHERE email IN ({', '.join('?' * len(emails))})", emails))
+            self.connection.executemany(self.UPSERT, rows)
+        return len(rows) - existing
+
+    def recount(self):
+        pass
+
+    def remove(self, email):
+        with self.lock:
+            row = self.get(email)
+            if row is not None:
+                self.connection.execute("DELETE FROM students WHERE email = ?", (email,))
+            return row
+
+    def record(self, entries):
+        self.storage.commit()
+
+    def upsert(self, row):
+        with self.storage.transaction():
+            self.put(row)
+
+    def delete(self, email):
+        with self.storage.transaction():
+            return self.remove(email)
+
+    def compact(self):
+        self.record([])
+
+    def reorder(self, rows):
+        rows = list(rows)
+        with self.storage.transaction():
+            self.connection.execute("DELETE FROM students")
+            self.connection.executemany("INSERT INTO students VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+class EnrollmentRepository:
+    """Keeps the enrollments file in memory, indexed by student and by course.
+
+    A student's primary course, grade and marks stay on their students.csv
+    row, so every existing operation keeps working. Each further course a
+    student takes is one (email, course_id, grade, marks) row here.
+    """
+
+    _instances = {}  # absolute path -> repository
+
+    def __init__(self, file):
+        self.file = file
+        self.rows = {}  # (email, course_id) -> row
+        self.by_student = {}  # email -> {course_id: row}
+        self.by_course = {}  # course_id -> {email: row}
+        self.aggregates = CourseAggregates()
+        self.signature = None
+        self.loaded = False
 
     @classmethod
-    def set_file_paths(cls, student_file, course_file, professor_file, login_file):
-        """Allows test cases to override file paths"""
-        global STUDENT_FILE, COURSE_FILE, PROFESSOR_FILE, LOGIN_FILE
-        STUDENT_FILE, COURSE_FILE, PROFESSOR_FILE, LOGIN_FILE = student_file, course_file, professor_file, login_file
+    def for_file(cls, file):
+        """Returns the shared repository for a file, reloading it only if the data changed"""
+        key = os.path.abspath(file)
+        repo = cls._instances.get(key)
+        if repo is None:
+            repo = cls._instances[key] = cls(file)
+        repo.refresh()
+        return repo
+
+    def refresh(self):
+        signature = Base.source_signature(self.file)
+        if self.loaded and signature == self.signature:
+            return
+        self.rows, self.by_student, self.by_course = {}, {}, {}
+        self.aggregates = CourseAggregates()
+        for row in Base.read_csv(self.file)[1:]:
+            if len(row) == len(ENROLLMENT_HEADER):
+                self._index(row)
+        self.signature = signature
+        self.loaded = True
+
+    def _index(self, row):
+        self.rows[row[0], row[1]] = row
+        self.by_student.setdefault(row[0], {})[row[1]] = row
+        self.by_course.setdefault(row[1], {})[row[0]] = row
+        self.aggregates.add(row[1], row[2], int(row[3]))
+
+    def _unindex(self, row):
+        self.aggregates.remove(row[1], row[2], int(row[3]))
+        del self.rows[row[0], row[1]]
+        for index, key, member in ((self.by_student, row[0], row[1]), (self.by_course, row[1], row[0])):
+            group = index[key]
+            del group[member]
+            if not group:
+                del index[key]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, email, course_id):
+        return self.rows.get((email, course_id))
+
+    def student_rows(self, email):
+        """Returns a student's enrollments"""
+        return list(self.by_student.get(email, {}).values())
+
+    def course_rows(self, course_id):
+        """Returns a course's enrollments"""
+        return list(self.by_course.get(course_id, {}).values())
+
+    def course_count(self, course_id):
+        return len(self.by_course.get(course_id, ()))
+
+    def courses(self):
+        """Returns every course_id with at least one enrollment"""
+        return list(self.by_course)
+
+    def course_aggregates(self):
+        """Returns the per-course totals kept up to date by every mutation"""
+        return self.aggregates
+
+    def marks_frame(self):
+        """Returns course_id, grade and marks for every enrollment as a DataFrame"""
+        rows = self.rows.values()
+        return pd.DataFrame({
+            "course_id": [row[1] for row in rows],
+            "grade": [row[2] for row in rows],
+            "marks": [int(row[3]) for row in rows],
+        })
+
+    @contextlib.contextmanager
+    def writing(self):
+        """Holds the exclusive lock for a read-modify-write, starting from the latest data"""
+        with Base.locked(self.file):
+            self.refresh()
+            yield self
+
+    def put(self, row):
+        """Adds an enrollment, or replaces the one for the same student and course"""
+        row = [str(value) for value in row]
+        with self.writing():
+            old = self.rows.get((row[0], row[1]))
+            if old is not None:
+                self.aggregates.remove(old[1], old[2], int(old[3]))
+                self.aggregates.add(row[1], row[2], int(row[3]))
+                self.rows[row[0], row[1]] = self.by_student[row[0]][row[1]] = self.by_course[row[1]][row[0]] = row
+                self.save()
+            else:
+                self._index(row)
+                Base.append_csv(self.file, [row], ENROLLMENT_HEADER)
+                self.signature = Base.source_signature(self.file)
+
+    def put_many(self, rows):
+        """Adds or replaces many enrollments with a single write; replaced ones keep their place in the file"""
+        rows = [[str(value) for value in row] for row in rows]
+        with self.writing():
+            for row in rows:
+                old = self.rows.get((row[0], row[1]))
+                if old is None:
+                    self._index(row)
+                    continue
+                self.aggregates.remove(old[1], old[2], int(old[3]))
+                self.aggregates.add(row[1], row[2], int(row[3]))
+                self.rows[row[0], row[1]] = self.by_student[row[0]][row[1]] = self.by_course[row[1]][row[0]] = row
+            if rows:
+                self.save()
+
+    def remove(self, email, course_id):
+        """Removes one enrollment, returning it or None"""
+        with self.writing():
+            row = self.rows.get((email, course_id))
+            if row is not None:
+                self._unindex(row)
+                self.save()
+            return row
+
+    def remove_students(self, emails):
+        """Removes every enrollment of the given students with a single write"""
+        with self.writing():
+            removed = [row for email in emails for row in self.student_rows(email)]
+            for row in removed:
+                self._unindex(row)
+            if removed:
+                self.save()
+            return removed
+
+    def move_course(self, course_id, new_course_id, keep=lambda email: True):
+        """Moves a course's enrollments to another course with a single write.
+
+        Enrollments are dropped instead when keep(email) is False or the
+        student is already enrolled in the new course. Returns the moved rows.
+        """
+        with self.writing():
+            rows, moved = self.course_rows(course_id), []
+            for row in rows:
+                self._unindex(row)
+                if keep(row[0]) and (row[0], new_course_id) not in self.rows:
+                    row = [row[0], new_course_id, row[2], row[3]]
+                    self._index(row)
+                    moved.append(row)
+            if rows:
+                self.save()
+            return moved
+
+    def remove_many(self, keys):
+        """Removes the enrollments for (email, course_id) keys with a single write, returning them"""
+        with self.writing():
+            removed = [self.rows[key] for key in dict.fromkeys(keys) if key in self.rows]
+            for row in removed:
+                self._unindex(row)
+            if removed:
+                self.save()
+            return removed
+
+    def save(self):
+        Base.write_csv(self.file, [ENROLLMENT_HEADER] + list(self.rows.values()), atomic=True)
+        self.signature = Base.source_signature(self.file)
+
+
+class TableIndex:
+    """Caches a small table grouped by one column, rebuilt only when its data changes"""
+
+    _instances = {}  # (absolute path, column) -> index
+
+    def __init__(self, file, column):
+        self.file = file
+        self.column = column
+        self.groups = {}  # column value -> rows
+        self.signature = None
+        self.loaded = False
+
+    @classmethod
+    def for_file(cls, file, column):
+        key = (os.path.abspath(file), column)
+        index = cls._instances.get(key)
+        if index is None:
+            index = cls._instances[key] = cls(file, column)
+        index.refresh()
+        return index
+
+    def refresh(self):
+        signature = Base.source_signature(self.file)
+        if self.loaded and signature == self.signature:
+            return
+        self.groups = {}
+        for row in Base.read_csv(self.file)[1:]:
+            if len(row) > self.column:
+                self.groups.setdefault(row[self.column], []).append(row)
+        self.signature = signature
+        self.loaded = True
+
+    def __contains__(self, key):
+        return key in self.groups
+
+    def get(self, key):
+        """Returns the rows whose column equals key"""
+        return self.groups.get(key, [])
+
+
+STORAGE = CSVStorage()
 
 
 class Student(Base):
+    __slots__ = ("email", "first_name", "last_name", "course_id", "professor_email", "grade", "marks")
+
     def __init__(self, email, first_name, last_name, course_id, professor_email, grade, marks):
         self.email = email
         self.first_name = first_name
@@ -51,171 +1922,787 @@ class Student(Base):
         self.grade = grade
         self.marks = int(marks)
 
+    @classmethod
+    def repository(cls):
+        """Returns the in-memory repository for the current student file, first moving any repeated rows into enrollments"""
+        repo = STORAGE.student_repository(STUDENT_FILE)
+        if getattr(repo, "repeated", None) and not FileLock.for_file(STUDENT_FILE).held_shared():  # Else on a later call
+            repo.move_repeated(cls.enrollment_repository())
+        return repo
+
+    def to_row(self):
+        """Returns the student as a students.csv row"""
+        return [self.email, self.first_name, self.last_name, self.course_id, self.professor_email, self.grade, str(self.marks)]
+
+    @classmethod
+    def enrollment_repository(cls):
+        """Returns the in-memory repository for the current enrollments file"""
+        return EnrollmentRepository.for_file(ENROLLMENT_FILE)
+
     def save(self):
-        """Saves student data to students.csv but prevents duplicates"""
-        students = self.read_csv(STUDENT_FILE)
+        """Saves student data to students.csv but prevents duplicates.
+
+        Saving a known student with a different course records that course as
+        an additional enrollment instead of dropping it.
+        """
+        repo = self.repository()
+        with repo.writing():
+            row = repo.get(self.email)
+            if row is None:
+                repo.upsert(self.to_row())
+                return
+
+            if row[3] != self.course_id:
+                enrollments = self.enrollment_repository()
+                if enrollments.get(self.email, self.course_id) is None:
+                    enrollments.put([self.email, self.course_id, self.grade, self.marks])
 
-        for row in students:
-            if row and row[0] == self.email:
-                return  # Prevent duplicate student addition
+    @classmethod
+    def enroll(cls, email, course_id, grade, marks):
+        """Adds or updates one of a student's courses, returning False if the student does not exist"""
+        repo = cls.repository()
+        with repo.writing():
+            row = repo.get(email)
+            if row is None:
+                return False
+            if row[3] == course_id:
+                cls.update_student(email, new_grade=grade, new_marks=marks)
+            else:
+                cls.enrollment_repository().put([email, course_id, grade, marks])
+            return True
+
+    @classmethod
+    def drop_enrollment(cls, email, course_id):
+        """Removes an additional enrollment; the primary course is changed with update_student"""
+        return cls.enrollment_repository().remove(email, course_id) is not None
+
+    @staticmethod
+    def _primary_enrollment(row):
+        return [row[0], row[3], row[5], row[6]]
+
+    @classmethod
+    def student_enrollments(cls, email):
+        """All (email, course_id, grade, marks) rows for a student, primary course first"""
+        row = cls.repository().get(email)
+        if row is None:
+            return []
+        return [cls._primary_enrollment(row)] + [list(row) for row in cls.enrollment_repository().student_rows(email)]
+
+    @classmethod
+    def course_enrollments(cls, course_id):
+        """All (email, course_id, grade, marks) rows for a course"""
+        rows = [cls._primary_enrollment(row) for row in cls.repository().course_rows(course_id)]
+        return rows + [list(row) for row in cls.enrollment_repository().course_rows(course_id)]
 
-        with open(STUDENT_FILE, mode="a", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow([self.email, self.first_name, self.last_name, self.course_id, self.professor_email, self.grade, str(self.marks)])
+    @classmethod
+    def professor_enrollments(cls, professor_email):
+        """All (email, course_id, grade, marks) rows for students taught by a professor"""
+        rows = [cls._primary_enrollment(row) for row in cls.repository().professor_rows(professor_email)]
+        enrollments = cls.enrollment_repository()
+        for course_id in dict.fromkeys(professor[3] for professor in TableIndex.for_file(PROFESSOR_FILE, 0).get(professor_email)):
+            rows += [list(row) for row in enrollments.course_rows(course_id)]
+        return rows
+
+    @classmethod
+    def compact(cls):
+        """Folds pending journal entries into students.csv"""
+        repo = cls.repository()
+        with repo.writing():
+            repo.compact()
 
     @classmethod
     def search_student(cls, email):
         """Search for a student by email"""
-        students = cls.read_csv(STUDENT_FILE)
-        for row in students[1:]:
-            if row and row[0] == email:
-                return row
-        return None
-
-    @classmethod
-    def update_student(cls, email, new_course=None, new_grade=None, new_marks=None):
-        """Update student record"""
-        students = cls.read_csv(STUDENT_FILE)
-        updated = False
-
-        for row in students:
-            if row and row[0] == email:
-                if new_course:
-                    row[3] = new_course
-                if new_grade:
-                    row[5] = new_grade
-                if new_marks:
-                    row[6] = str(new_marks)
-                updated = True
-
-        if updated:
-            cls.write_csv(STUDENT_FILE, students)
-
-    @classmethod
-    def delete_student(cls, email):
-        """Delete a student by email"""
-        students = cls.read_csv(STUDENT_FILE)
-        new_students = [row for row in students if row and row[0] != email]
-        cls.write_csv(STUDENT_FILE, new_students)
+        row = cls.repository().get(email)
+        return list(row) if row is not None else None
+
+    @classmethod
+    def update_student(cls, email, new_course=None, new_grade=None, new_marks=None, expected_row=None):
+        """Update student record.
+
+        Pass the row as it was read (e.g. from search_student) as expected_row
+        to raise StaleDataError instead of overwriting someone else's update.
+        """
+        repo = cls.repository()
+        with repo.writing():
+            row = repo.get(email)
+            if row is None:
+                return
+            cls._check_expected(email, row, expected_row)
+            repo.upsert(cls._apply_changes(row, new_course, new_grade, new_marks))
+
+    @staticmethod
+    def _check_expected(email, row, expected_row):
+        if expected_row is not None and list(row or []) != [str(value) for value in expected_row]:
+            raise StaleDataError(f"Student {email} changed since it was read")
+
+    @staticmethod
+    def _apply_changes(row, new_course=None, new_grade=None, new_marks=None, new_professor=None):
+        """Returns a copy of a row with the fields that are not None changed"""
+        row = list(row)
+        if new_course is not None:
+            row[3] = new_course
+        if new_professor is not None:
+            row[4] = new_professor
+        if new_grade is not None:
+            row[5] = new_grade
+        if new_marks is not None:
+            row[6] = str(new_marks)
+        return row
+
+    @classmethod
+    def bulk_upsert(cls, records):
+        """Insert or replace many students in one pass.
+
+        Records are Student objects or rows in students.csv column order.
+        Returns a list of (email, "inserted" | "updated") pairs. A record
+        that fails raises and leaves every record of the batch unapplied.
+        """
+        repo = cls.repository()
+        results, entries = [], []
+        with repo.writing():
+            try:
+                for record in records:
+                    row = record.to_row() if isinstance(record, Student) else [str(value) for value in record]
+                    results.append((row[0], "updated" if row[0] in repo else "inserted"))
+                    repo.put(row)
+                    entries.append(["put"] + row)
+                repo.record(entries)
+            except BaseException:
+                repo.loaded = False  # The in-memory rows hold changes that were never written
+                raise
+        return results
+
+    @classmethod
+    def bulk_delete(cls, emails):
+        """Delete many students in one pass, returning (email, "deleted" | "not found") pairs"""
+        repo = cls.repository()
+        results, entries = [], []
+        with repo.writing():
+            for email in emails:
+                if repo.remove(email) is None:
+                    results.append((email, "not found"))
+                else:
+                    results.append((email, "deleted"))
+                    entries.append(["del", email])
+            repo.record(entries)
+            cls.enrollment_repository().remove_students(email for email, status in results if status == "deleted")
+        return results
+
+    @classmethod
+    def bulk_update_marks(cls, changes):
+        """Update many students in one pass.
+
+        Takes (email, changes) pairs where changes is either the new marks or a
+        dict of update_student keyword arguments. Returns a list of
+        (email, "updated" | "not found") pairs. A change that fails raises and
+        leaves every change of the batch unapplied.
+        """
+        repo = cls.repository()
+        results, entries = [], []
+        with repo.writing():
+            try:
+                for email, change in changes:
+                    row = repo.get(email)
+                    if row is None:
+                        results.append((email, "not found"))
+                        continue
+                    row = cls._apply_changes(row, **change) if isinstance(change, dict) else cls._apply_changes(row, new_marks=change)
+                    repo.put(row)
+                    entries.append(["put"] + row)
+                    results.append((email, "updated"))
+                repo.record(entries)
+            except BaseException:
+                repo.loaded = False  # The in-memory rows hold changes that were never written
+                raise
+        return results
+
+    @classmethod
+    def delete_student(cls, email, expected_row=None):
+        """Delete a student by email; expected_row works as in update_student"""
+        repo = cls.repository()
+        with repo.writing():
+            cls._check_expected(email, repo.get(email), expected_row)
+            repo.delete(email)
+            cls.enrollment_repository().remove_students([email])
         return f"Student {email} deleted successfully."
 
     @classmethod
-    def sort_students_by_marks(cls, ascending=True):
-        """Sort students by marks"""
-        students = cls.read_csv(STUDENT_FILE)
-        if len(students) > 1:
-            header = students[0]
-            sorted_students = sorted(students[1:], key=lambda x: int(x[6]), reverse=not ascending)
-            cls.write_csv(STUDENT_FILE, [header] + sorted_students)
-            return [header] + sorted_students
-        return students
+    def query(cls, sort_by=None, ascending=True, limit=None, offset=0, **filters):
+        """Return a sorted, filtered page of student rows without touching disk.
+
+        sort_by is a column name or a list of column names and (name, ascending)
+        pairs; ascending applies to names given without a direction. Filters
+        match columns exactly, e.g. query("marks", False, limit=20, course_id="CS101").
+        Sorting runs on the repository's marks array and dictionary codes, and
+        with a limit only rows that can reach the top offset + limit are sorted.
+        """
+        for column in filters:
+            if column not in STUDENT_COLUMNS:
+                raise ValueError(f"Unknown student column: {column}")
+        keys = []
+        for key in [sort_by] if isinstance(sort_by, (str, tuple)) else sort_by or []:
+            column, key_ascending = key if isinstance(key, tuple) else (key, ascending)
+            if column not in STUDENT_COLUMNS:
+                raise ValueError(f"Unknown student column: {column}")
+            keys.append((STUDENT_COLUMNS[column], key_ascending))
+
+        filters = [(STUDENT_COLUMNS[column], value) for column, value in filters.items()]
+        return cls.repository().select(filters, keys, offset, None if limit is None else offset + limit)
+
+    @classmethod
+    def _sort_students(cls, column, ascending, persist):
+        """Returns the roster sorted by one column with the header, writing it back only if persist is set"""
+        repo = cls.repository()
+        if not len(repo):
+            return cls.read_csv(STUDENT_FILE)
+        if persist:
+            with repo.writing():
+                sorted_students = cls.query(column, ascending)
+                repo.reorder(sorted_students)
+                repo.compact()
+        else:
+            sorted_students = cls.query(column, ascending)
+        return [list(repo.header)] + sorted_students
+
+    @classmethod
+    def sort_students_by_marks(cls, ascending=True, persist=False):
+        """Sort students by marks, saving the new order to students.csv only if persist is True"""
+        return cls._sort_students("marks", ascending, persist)
 
     @classmethod
     def generate_grade_report(cls):
-        """Generate course-wise, professor-wise, and student-wise reports and save to file"""
-        students = cls.read_csv(STUDENT_FILE)
-        if len(students) <= 1:
-            print("\nNo student records available to generate reports.")
-            return
+        """Generate course-wise, professor-wise, and student-wise reports and save to file.
+
+        The rows come straight from the repository, pending journal entries
+        included, and are streamed into the student report, which is written
+        atomically, while per-course and per-professor totals are kept.
+        """
+        course_totals = {}  # course_id -> totals
+        professor_totals = {}  # professor_email -> totals
+
+        def report_rows(rows):
+            yield ["First Name", "Last Name", "Course", "Grade", "Marks"]
+            for row in rows:
+                yield [row[1], row[2], row[3], row[5], row[6]]
+                marks = int(row[6])
+                for totals, key in ((course_totals, row[3]), (professor_totals, row[4])):
+                    entry = totals.get(key)
+                    if entry is None:
+                        entry = totals[key] = {"count": 0, "sum": 0, "min": marks, "max": marks, "courses": set(), "grades": dict.fromkeys(GRADES, 0)}
+                    entry["count"] += 1
+                    entry["sum"] += marks
+                    entry["min"] = min(entry["min"], marks)
+                    entry["max"] = max(entry["max"], marks)
+                    entry["courses"].add(row[3])
+                    entry["grades"][row[5]] = entry["grades"].get(row[5], 0) + 1
+
+        repo = cls.repository()
+        with cls.locked(STUDENT_FILE, exclusive=False):  # Released before courses and professors are read, keeping the lock order
+            repo.refresh()
+            if not len(repo):
+                print("\nNo student records available to generate reports.")
+                return
+            cls.write_csv(REPORT_FILE, report_rows(repo.all_rows()))
+
+        def summary(entry):
+            return [entry["count"], f"{entry['sum'] / entry['count']:.2f}", entry["min"], entry["max"]] + [entry["grades"][grade] for grade in GRADES]
 
-        report_data = [["First Name", "Last Name", "Course", "Grade", "Marks"]]
+        course_names = {row[0]: row[1] for row in cls.iter_csv(COURSE_FILE) if row}
+        course_report = [["Course", "Course Name", "Students", "Average", "Min", "Max"] + GRADES]
+        for course_id in sorted(course_totals):
+            course_report.append([course_id, course_names.get(course_id, "")] + summary(course_totals[course_id]))
+        cls.write_csv(COURSE_REPORT_FILE, course_report)
 
-        for row in students[1:]:  
-            report_data.append([row[1], row[2], row[3], row[5], row[6]])
+        professors = {row[0]: row for row in cls.iter_csv(PROFESSOR_FILE) if row}
+        professor_report = [["Professor Email", "Name", "Rank", "Courses", "Students", "Average", "Min", "Max"] + GRADES]
+        for email in sorted(professor_totals):
+            entry = professor_totals[email]
+            professor = professors.get(email, [email, "", ""])
+            professor_report.append([email, professor[1], professor[2], " ".join(sorted(entry["courses"]))] + summary(entry))
+        cls.write_csv(PROFESSOR_REPORT_FILE, professor_report)
 
-        cls.write_csv(REPORT_FILE, report_data)
         print(f"Grade report saved to {REPORT_FILE}")
+        print(f"Course report saved to {COURSE_REPORT_FILE}")
+        print(f"Professor report saved to {PROFESSOR_REPORT_FILE}")
+        return REPORT_FILE, COURSE_REPORT_FILE, PROFESSOR_REPORT_FILE
+
+    @classmethod
+    def course_statistics(cls, recompute=False):
+        """Returns a DataFrame of marks statistics and grade counts for every course.
+
+        The table is served from aggregates maintained on every mutation;
+        recompute=True rebuilds it from every row instead.
+        """
+        course_ids = [course[0] for course in Course.read_csv(COURSE_FILE)[1:] if course]
+        enrollments = cls.enrollment_repository()
+        if not recompute:
+            aggregates = cls.repository().course_aggregates()
+            if len(enrollments):
+                aggregates = CourseAggregates.merge(aggregates, enrollments.course_aggregates())
+            return aggregates.frame(course_ids)
+
+        marks = cls.repository().marks_frame()
+        if len(enrollments):
+            marks = pd.concat([marks, enrollments.marks_frame()], ignore_index=True)
+        return course_statistics_frame(marks, course_ids)
+
+    @classmethod
+    def verify_course_statistics(cls):
+        """Checks the maintained statistics against a full recompute, returning True if they agree"""
+        maintained = cls.course_statistics()
+        recomputed = cls.course_statistics(recompute=True)
+        if list(maintained.index) != list(recomputed.index) or list(maintained.columns) != list(recomputed.columns):
+            return False
+        return bool(np.allclose(maintained.to_numpy(dtype=float), recomputed.to_numpy(dtype=float), equal_nan=True))
 
     @classmethod
     def get_all_courses_statistics(cls):
-        """Calculate average, median, and mode marks for all courses"""
-        students = cls.read_csv(STUDENT_FILE)
+        """Calculate average, median, and mode marks for all courses and return them as a DataFrame"""
         courses = Course.read_csv(COURSE_FILE)
 
-        if len(students) <= 1 or len(courses) <= 1:
+        if not len(cls.repository()) or len(courses) <= 1:
             print("\nNo sufficient data available for course statistics.")
             return
 
         print("\n--- Generating Statistics for All Courses ---")
 
-        for course in courses[1:]:  
+        stats = cls.course_statistics()
+        for course in courses[1:]:
             course_id = course[0]
-            marks = [int(row[6]) for row in students[1:] if row[3] == course_id]
-
-            if marks:
-                avg = mean(marks)
-                med = median(marks)
-                mode_value = max(set(marks), key=marks.count)
-                print(f"Course {course_id}: Average = {avg:.2f}, Median = {med:.2f}, Mode = {mode_value}")
+            if stats.at[course_id, "count"]:
+                course_stats = stats.loc[course_id]
+                print(f"Course {course_id}: Average = {course_stats['mean']:.2f}, Median = {course_stats['median']:.2f}, Mode = {int(course_stats['mode'])}")
             else:
                 print(f"Course {course_id}: No student data available.")
-                
-    @classmethod
-    def sort_students_by_email(cls, ascending=True):
-        """Sort students by email"""
-        students = cls.read_csv(STUDENT_FILE)
-        if len(students) > 1:
-            header = students[0]
-            sorted_students = sorted(students[1:], key=lambda x: x[0], reverse=not ascending)
-            cls.write_csv(STUDENT_FILE, [header] + sorted_students)
-            return [header] + sorted_students
-        return students
-
-    @classmethod
-    def sort_students_by_name(cls, ascending=True):
-        """Sort students by first name"""
-        students = cls.read_csv(STUDENT_FILE)
-        if len(students) > 1:
-            header = students[0]
-            sorted_students = sorted(students[1:], key=lambda x: x[1], reverse=not ascending)
-            cls.write_csv(STUDENT_FILE, [header] + sorted_students)
-            return [header] + sorted_students
-        return students
+        return stats
+
+    @classmethod
+    def sort_students_by_email(cls, ascending=True, persist=False):
+        """Sort students by email, saving the new order to students.csv only if persist is True"""
+        return cls._sort_students("email", ascending, persist)
+
+    @classmethod
+    def sort_students_by_name(cls, ascending=True, persist=False):
+        """Sort students by first name, saving the new order to students.csv only if persist is True"""
+        return cls._sort_students("first_name", ascending, persist)
 
 class Course(Base):
-    """Handles course operations"""
+    """Handles course operations.
+
+    Course ids are unique. Students, enrollments and professor assignments
+    that point at a course are counted from in-memory indexes, so a delete
+    can refuse, cascade or reassign without scanning students.csv.
+    """
+
+    @staticmethod
+    def index():
+        """Returns the courses grouped by course_id"""
+        return TableIndex.for_file(COURSE_FILE, 0)
+
+    @classmethod
+    def exists(cls, course_id):
+        return course_id in cls.index()
+
+    @classmethod
+    def references(cls, course_id):
+        """Counts the students, enrollments and professor assignments that point at a course"""
+        return {
+            "students": Student.repository().reference_count(3, course_id),
+            "enrollments": Student.enrollment_repository().course_count(course_id),
+            "professors": len(TableIndex.for_file(PROFESSOR_FILE, 3).get(course_id)),
+        }
 
     @classmethod
     def add_course(cls, course_id, course_name, description):
-        """Adds a new course"""
-        courses = cls.read_csv(COURSE_FILE)
-        courses.append([course_id, course_name, description])
-        cls.write_csv(COURSE_FILE, courses)
+        """Adds a new course, raising IntegrityError if the course_id is taken"""
+        with cls.locked(COURSE_FILE):
+            if cls.exists(course_id):
+                raise IntegrityError(f"Course {course_id} already exists")
+            cls.append_csv(COURSE_FILE, [[course_id, course_name, description]], COURSE_HEADER)
+
+    @classmethod
+    def delete_course(cls, course_id, on_delete="restrict", reassign_to=None):
+        """Deletes a course, returning what referenced it, or None if there is no such course.
+
+        With on_delete="restrict" a referenced course raises IntegrityError.
+        "cascade" also deletes its enrollments and professor assignments;
+        a student whose primary course it was takes their first other
+        enrollment as primary course instead, and is deleted only without
+        one. "reassign" moves them all to the reassign_to course.
+        """
+        _check_on_delete(on_delete, reassign_to, course_id)
+        with cls.locked(COURSE_FILE), cls.locked(PROFESSOR_FILE):
+            if not cls.exists(course_id):
+                return None
+            if on_delete == "reassign" and not cls.exists(reassign_to):
+                raise IntegrityError(f"Course {reassign_to} does not exist")
+            references = cls.references(course_id)
+            if any(references.values()):
+                if on_delete == "restrict":
+                    raise IntegrityError(
+                        f"Course {course_id} is referenced by {references['students']} students, "
+                        f"{references['enrollments']} enrollments and {references['professors']} professors"
+                    )
+                if on_delete == "cascade":
+                    cls._cascade(course_id)
+                else:
+                    cls._reassign(course_id, reassign_to)
+            cls.write_csv(COURSE_FILE, [row for row in cls.read_csv(COURSE_FILE) if row and row[0] != course_id])
+        return references
 
     @classmethod
-    def delete_course(cls, course_id):
-        """Deletes a course"""
-        courses = cls.read_csv(COURSE_FILE)
-        courses = [row for row in courses if row and row[0] != course_id]
-        cls.write_csv(COURSE_FILE, courses)
+    def _cascade(cls, course_id):
+        enrollments = Student.enrollment_repository()
+        teachers = TableIndex.for_file(PROFESSOR_FILE, 3)
+        promoted, deleted = [], []
+        for row in Student.repository().course_rows(course_id):
+            others = [other for other in enrollments.student_rows(row[0]) if other[1] != course_id]
+            if others:
+                promoted.append(others[0])
+            else:
+                deleted.append(row[0])
+        Student.bulk_update_marks([
+            (email, {"new_course": new_course_id, "new_grade": grade, "new_marks": marks,
+                     "new_professor": teachers.get(new_course_id)[0][0] if teachers.get(new_course_id) else None})
+            for email, new_course_id, grade, marks in promoted
+        ])
+        Student.bulk_delete(deleted)
+        enrollments.remove_many([(row[0], row[1]) for row in promoted + enrollments.course_rows(course_id)])
+        if TableIndex.for_file(PROFESSOR_FILE, 3).get(course_id):
+            cls.write_csv(PROFESSOR_FILE, [row for row in cls.read_csv(PROFESSOR_FILE) if row and row[3] != course_id])
+
+    @classmethod
+    def _reassign(cls, course_id, new_course_id):
+        repo = Student.repository()
+        teachers = TableIndex.for_file(PROFESSOR_FILE, 3).get(new_course_id)
+        Student.bulk_update_marks([
+            (row[0], {"new_course": new_course_id, "new_professor": teachers[0][0] if teachers else None})
+            for row in repo.course_rows(course_id)
+        ])
+        # An enrollment in the new course would duplicate a student's primary course there
+        Student.enrollment_repository().move_course(course_id, new_course_id, keep=lambda email: repo.get(email)[3] != new_course_id)
+
+        if TableIndex.for_file(PROFESSOR_FILE, 3).get(course_id):
+            taught = {row[0] for row in teachers}
+            professors = []
+            for row in cls.read_csv(PROFESSOR_FILE):
+                if row and row[3] == course_id:
+                    if row[0] in taught:
+                        continue
+                    row = [row[0], row[1], row[2], new_course_id]
+                    taught.add(row[0])
+                professors.append(row)
+            cls.write_csv(PROFESSOR_FILE, professors)
 
 
 class Professor(Base):
-    """Handles professor operations"""
+    """Handles professor operations.
+
+    A professor has one row per course taught; (email, course_id) is unique
+    and the course must exist. Students point at professors by email.
+    """
+
+    @staticmethod
+    def index():
+        """Returns the professor rows grouped by email"""
+        return TableIndex.for_file(PROFESSOR_FILE, 0)
+
+    @classmethod
+    def exists(cls, email):
+        return email in cls.index()
+
+    @classmethod
+    def references(cls, email):
+        """Counts the students taught by a professor and the courses assigned to them"""
+        return {
+            "students": Student.repository().reference_count(4, email),
+            "courses": len(cls.index().get(email)),
+        }
 
     @classmethod
     def add_professor(cls, email, name, rank, course_id):
-        """Adds a professor"""
-        professors = cls.read_csv(PROFESSOR_FILE)
-        professors.append([email, name, rank, course_id])
-        cls.write_csv(PROFESSOR_FILE, professors)
+        """Adds a professor to a course, raising IntegrityError for a duplicate or an unknown course"""
+        with cls.locked(COURSE_FILE, exclusive=False), cls.locked(PROFESSOR_FILE):  # Courses first, as delete_course does
+            if any(row[3] == course_id for row in cls.index().get(email)):
+                raise IntegrityError(f"Professor {email} already teaches {course_id}")
+            if not Course.exists(course_id):
+                raise IntegrityError(f"Course {course_id} does not exist")
+            cls.append_csv(PROFESSOR_FILE, [[email, name, rank, course_id]], PROFESSOR_HEADER)
 
     @classmethod
     def modify_professor(cls, email, new_rank=None):
         """Modifies professor details"""
-        professors = cls.read_csv(PROFESSOR_FILE)
-        for row in professors:
-            if row and row[0] == email and new_rank:
-                row[2] = new_rank  # Update rank
-        cls.write_csv(PROFESSOR_FILE, professors)
+        with cls.locked(PROFESSOR_FILE):
+            professors = cls.read_csv(PROFESSOR_FILE)
+            for row in professors:
+                if row and row[0] == email and new_rank:
+                    row[2] = new_rank  # Update rank
+            cls.write_csv(PROFESSOR_FILE, professors)
 
     @classmethod
-    def delete_professor(cls, email):
-        """Deletes a professor"""
-        professors = cls.read_csv(PROFESSOR_FILE)
-        professors = [row for row in professors if row and row[0] != email]
-        cls.write_csv(PROFESSOR_FILE, professors)
+    def delete_professor(cls, email, on_delete="restrict", reassign_to=None):
+        """Deletes a professor, returning what referenced them, or None if there is no such professor.
+
+        With on_delete="restrict" a professor who still has students raises
+        IntegrityError. "cascade" also deletes those students; "reassign"
+        hands the students and courses to the reassign_to professor.
+        """
+        _check_on_delete(on_delete, reassign_to, email)
+        with cls.locked(PROFESSOR_FILE):
+            if not cls.exists(email):
+                return None
+            if on_delete == "reassign" and not cls.exists(reassign_to):
+                raise IntegrityError(f"Professor {reassign_to} does not exist")
+            references = cls.references(email)
+            professors = [row for row in cls.read_csv(PROFESSOR_FILE) if row and row[0] != email]
+            if references["students"]:
+                if on_delete == "restrict":
+                    raise IntegrityError(f"Professor {email} still teaches {references['students']} students")
+                rows = Student.repository().professor_rows(email)
+                if on_delete == "cascade":
+                    Student.bulk_delete([row[0] for row in rows])
+                else:
+                    Student.bulk_update_marks([(row[0], {"new_professor": reassign_to}) for row in rows])
+            if on_delete == "reassign":
+                successor = cls.index().get(reassign_to)
+                taught = {row[3] for row in successor}
+                for row in cls.index().get(email):
+                    if row[3] not in taught:
+                        professors.append([reassign_to, successor[0][1], successor[0][2], row[3]])
+                        taught.add(row[3])
+            cls.write_csv(PROFESSOR_FILE, professors)
+        return references
+
+
+def _check_on_delete(on_delete, reassign_to, key):
+    if on_delete not in ON_DELETE:
+        raise ValueError(f"on_delete must be one of {', '.join(ON_DELETE)}")
+    if on_delete == "reassign" and (reassign_to is None or reassign_to == key):
+        raise ValueError("on_delete='reassign' needs a different reassign_to")
+
+
+def check_integrity():
+    """Validates the whole dataset in one pass over each table.
+
+    Returns (table, key, problem) tuples, empty when every key is unique,
+    every course and professor reference resolves and every student row is
+    well formed.
+    """
+    problems = []
+    course_ids = set()
+    for row in itertools.islice(Base.iter_csv(COURSE_FILE), 1, None):
+        if not row:
+            continue
+        if row[0] in course_ids:
+            problems.append(("courses", row[0], "duplicate course_id"))
+        course_ids.add(row[0])
+
+    assignments, professor_emails = set(), set()
+    for row in itertools.islice(Base.iter_csv(PROFESSOR_FILE), 1, None):
+        if len(row) < len(PROFESSOR_HEADER):
+            continue
+        if (row[0], row[3]) in assignments:
+            problems.append(("professors", f"{row[0]} {row[3]}", "duplicate course assignment"))
+        if row[3] not in course_ids:
+            problems.append(("professors", f"{row[0]} {row[3]}", f"unknown course {row[3]}"))
+        assignments.add((row[0], row[3]))
+        professor_emails.add(row[0])
+
+    # Students are checked per distinct value from the maintained reference counts
+    repo = Student.repository()
+    for row in getattr(repo, "malformed", ()):
+        if len(row) != len(STUDENT_HEADER):
+            problems.append(("students", row[0], f"expected {len(STUDENT_HEADER)} fields, found {len(row)}; row kept as is"))
+        elif not repo.columns._fits(row):
+            problems.append(("students", row[0], f"marks {row[MARKS_COLUMN]!r} are not an integer; row kept as is"))
+        else:
+            problems.append(("students", row[0], f"repeats the email of another row for course {row[3]}; row kept as is"))
+    for course_id, n in repo.reference_counts(3).items():
+        if course_id not in course_ids:
+            problems.append(("students", course_id, f"{n} students reference unknown course {course_id}"))
+    for email, n in repo.reference_counts(4).items():
+        if email not in professor_emails:
+            problems.append(("students", email, f"{n} students reference unknown professor {email}"))
+
+    for email, course_id, _, _ in list(Student.enrollment_repository().rows.values()):
+        student = repo.get(email)
+        if student is None:
+            problems.append(("enrollments", f"{email} {course_id}", f"unknown student {email}"))
+        elif student[3] == course_id:
+            problems.append(("enrollments", f"{email} {course_id}", "duplicates the primary course"))
+        if course_id not in course_ids:
+            problems.append(("enrollments", f"{email} {course_id}", f"unknown course {course_id}"))
+    return problems
+
+
+class LoginService:
+    """Authenticates against a login CSV file.
+
+    Credentials are held in an email-keyed index that is reloaded when the
+    file changes. A successful login issues a session token kept in a
+    TTL-bounded LRU cache, so later requests skip bcrypt entirely. Accounts
+    with too many recent failures are refused without running bcrypt, and
+    unknown emails still pay for one bcrypt check so timing does not tell
+    which accounts exist.
+    """
+
+    _instances = {}  # absolute path -> service
+
+    def __init__(self, file, ttl=SESSION_TTL, max_sessions=SESSION_CACHE_SIZE, clock=time.monotonic, max_failures=LOGIN_FAILURE_CACHE_SIZE):
+        self.file = file
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_failures = max_failures
+        self.clock = clock
+        self.credentials = {}  # email -> (hashed password, role)
+        self.sessions = OrderedDict()  # token -> (email, role, expiry), least recently used first
+        self.failures = OrderedDict()  # email -> timestamps of recent failed attempts, least recently tried first
+        self.dummy_hash = None  # Checked for unknown emails, at the cost of the file's hashes
+        self.signature = None
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_file(cls, file):
+        """Returns the shared service for a login file"""
+        key = os.path.abspath(file)
+        service = cls._instances.get(key)
+        if service is None:
+            service = cls._instances[key] = cls(file)
+        return service
+
+    def refresh(self):
+        """Reloads credentials if the file changed, ending sessions whose password or role changed"""
+        signature = Base.source_signature(self.file)
+        if self.loaded and signature == self.signature:
+            return
+        credentials = {row[0]: (row[1], row[2]) for row in Base.read_csv(self.file)[1:] if len(row) >= 3}
+        with self.lock:
+            for token, (email, role, _) in list(self.sessions.items()):
+                if self.credentials.get(email) != credentials.get(email):
+                    del self.sessions[token]
+            self.credentials = credentials
+            self.signature = signature
+            self.loaded = True
+            self.dummy_hash = None
+
+    def is_locked(self, email):
+        """Returns True if the account has reached the failed attempt limit"""
+        now = self.clock()
+        with self.lock:
+            attempts = self.failures.get(email)
+            if not attempts:
+                return False
+            while attempts and attempts[0] <= now - LOGIN_FAILURE_WINDOW:
+                attempts.popleft()
+            if not attempts:
+                del self.failures[email]
+            return len(attempts) >= LOGIN_MAX_FAILURES
+
+    def _attempt(self, email):
+        """Counts an attempt as failed before it is verified, returning False if the account is locked.
+
+        Counting first keeps parallel guesses within the limit; a
+        successful login clears the count again.
+        """
+        now = self.clock()
+        with self.lock:
+            while self.failures and next(iter(self.failures.values()))[-1] <= now - LOGIN_FAILURE_WINDOW:
+                self.failures.popitem(last=False)
+            attempts = self.failures.get(email)
+            if attempts is None:
+                attempts = self.failures[email] = deque()
+            while attempts and attempts[0] <= now - LOGIN_FAILURE_WINDOW:
+                attempts.popleft()
+            if len(attempts) >= LOGIN_MAX_FAILURES:
+                return False
+            attempts.append(now)
+            self.failures.move_to_end(email)
+            while len(self.failures) > self.max_failures:
+                self.failures.popitem(last=False)
+            return True
+
+    def _dummy_hash(self):
+        """Returns a hash of a random password with the same bcrypt cost as the stored ones"""
+        if self.dummy_hash is None:
+            rounds = cipher.rounds
+            for hashed, _ in self.credentials.values():
+                cost = hashed.split("$")
+                if len(cost) > 2 and cost[2].isdigit() and 4 <= int(cost[2]) <= 31:
+                    rounds = int(cost[2])
+                    break
+            self.dummy_hash = TextSecurity(cipher.shifter, rounds=rounds).hash_password(secrets.token_urlsafe(16))
+        return self.dummy_hash
+
+    def authenticate(self, email, password):
+        """Verifies a password and returns a new session token, or None"""
+        self.refresh()
+        if not self._attempt(email):
+            return None
+        credential = self.credentials.get(email)
+        if credential is None:
+            cipher.verify_password(password, self._dummy_hash())
+            return None
+        if not cipher.verify_password(password, credential[0]):
+            return None
+
+        token = secrets.token_urlsafe(32)
+        with self.lock:
+            self.failures.pop(email, None)
+            self.sessions[token] = (email, credential[1], self.clock() + self.ttl)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        return token
+
+    def session(self, token):
+        """Returns (email, role) for a live session token, or None"""
+        self.refresh()
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return None
+            if session[2] <= self.clock():
+                del self.sessions[token]
+                return None
+            self.sessions.move_to_end(token)
+            return session[0], session[1]
+
+    def logout(self, token):
+        """Ends a session"""
+        with self.lock:
+            self.sessions.pop(token, None)
+
+
+class Login(Base):
+    """Handles login operations"""
+
+    @classmethod
+    def service(cls):
+        """Returns the login service for the current login file"""
+        return LoginService.for_file(LOGIN_FILE)
+
+    @classmethod
+    def login(cls, email, password):
+        """Logs a user in and returns a session token, or None if refused"""
+        return cls.service().authenticate(email, password)
+
+    @classmethod
+    def validate_session(cls, token):
+        """Returns (email, role) for a valid session token, or None"""
+        return cls.service().session(token)
+
+    @classmethod
+    def logout(cls, token):
+        """Logs a session out"""
+        cls.service().logout(token)
+
 
+# CHECKMYGRADE_INSTRUMENT switches instrumentation on for every program that loads this module
+if os.environ.get("CHECKMYGRADE_INSTRUMENT"):
+    sys.modules.setdefault("check_my_grade", sys.modules[__name__])  # Run as a script this module is __main__; instrument this copy
+    import instrumentation
+    instrumentation.enable_from_environment()
 
 if __name__ == "__main__":
     print("Generating Reports...")
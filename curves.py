@@ -0,0 +1,263 @@
+import argparse
+import json
+import numpy as np
+import check_my_grade
+import generate_data
+
+MAX_MARKS = 100  # Curved marks are clipped to 0..MAX_MARKS
+DEFAULT_CUTOFFS = {grade: low for grade, (low, _) in generate_data.marks_range.items()}  # Lowest marks for each grade
+CURVES = {"shift": ["points"], "scale": ["factor", "top"], "percentile": ["shares"]}  # Curve -> options it takes
+
+
+def _ordered(cutoffs):
+    """Returns (ascending bounds, grades lowest first) for a cutoff table listed best grade first.
+
+    Of grades with equal cutoffs the one listed first sorts last, so it
+    wins the marks they share.
+    """
+    if not cutoffs:
+        raise ValueError("A cutoff table needs at least one grade")
+    table = sorted((int(low), -rank, grade) for rank, (grade, low) in enumerate(cutoffs.items()))
+    return np.array([low for low, _, _ in table[1:]], dtype=np.int64), np.array([grade for _, _, grade in table], dtype=object)
+
+
+def grades_for(marks, cutoffs=None):
+    """Returns the letter grade for every mark in an array.
+
+    cutoffs maps each grade, best first, to the lowest marks that earn it;
+    the lowest grade also takes every mark below its cutoff, and a mark
+    that meets several equal cutoffs gets the best of those grades.
+    """
+    bounds, grades = _ordered(cutoffs or DEFAULT_CUTOFFS)
+    return grades[np.searchsorted(bounds, marks, side="right")]
+
+
+def shifted(marks, points):
+    """Adds points to every mark"""
+    return np.clip(marks + int(points), 0, MAX_MARKS)
+
+
+def scaled(marks, factor=None, top=MAX_MARKS):
+    """Multiplies every mark by factor, by default the one that lifts the best mark to top"""
+    if factor is None:
+        best = int(marks.max()) if len(marks) else 0
+        factor = top / best if best > 0 else 1.0
+    return np.clip(np.rint(marks * float(factor)), 0, MAX_MARKS).astype(np.int64)
+
+
+def percentile_cutoffs(marks, shares):
+    """Returns a cutoff table giving each grade its percentage share of the marks.
+
+    shares lists grades best first, e.g. {"A": 20, "B": 30, "C": 30,
+    "D": 10, "F": 10}, and must add up to 100. Equal marks always get the
+    same grade, so a tie at a boundary lifts everyone on it.
+    """
+    if not shares or abs(sum(shares.values()) - 100) > 1e-6:
+        raise ValueError("Grade shares must add up to 100")
+    cutoffs, taken = {}, 0.0
+    grades = list(shares)
+    for grade in grades[:-1]:
+        taken += float(shares[grade])
+        cutoffs[grade] = int(np.quantile(marks, max(0.0, 1 - taken / 100), method="higher")) if len(marks) else MAX_MARKS
+    cutoffs[grades[-1]] = 0
+    return cutoffs
+
+
+def curve(marks, method=None, cutoffs=None, **options):
+    """Applies a curve to an array of marks, returning (new marks, new grades, cutoff table used).
+
+    method is "shift" (points=), "scale" (factor= or top=), "percentile"
+    (shares=) or None to keep the marks and only regrade with cutoffs.
+    """
+    if method is not None and method not in CURVES:
+        raise ValueError(f"Unknown curve: {method} (expected one of {', '.join(CURVES)})")
+    unknown = set(options) - set(CURVES.get(method, []))
+    if unknown:
+        raise ValueError(f"Unknown options for curve {method}: {', '.join(sorted(unknown))}")
+    marks = np.asarray(marks, dtype=np.int64)
+    if method == "shift":
+        marks = shifted(marks, options.get("points", 0))
+    elif method == "scale":
+        marks = scaled(marks, options.get("factor"), options.get("top", MAX_MARKS))
+    elif method == "percentile":
+        if cutoffs is not None:
+            raise ValueError("A percentile curve derives its own cutoffs")
+        cutoffs = percentile_cutoffs(marks, options.get("shares") or {})
+    cutoffs = dict(cutoffs or DEFAULT_CUTOFFS)
+    return marks, grades_for(marks, cutoffs), cutoffs
+
+
+def distribution(marks, grades):
+    """Summarizes marks and grades: count, mean, median, std, min, max and grade counts"""
+    grade_counts = dict.fromkeys(check_my_grade.GRADES, 0)
+    for grade, n in zip(*np.unique(np.asarray(grades, dtype=str), return_counts=True)):
+        grade_counts[str(grade)] = int(n)
+    if not len(marks):
+        return {"count": 0, "mean": None, "median": None, "std": None, "min": None, "max": None, "grades": grade_counts}
+    return {
+        "count": int(len(marks)),
+        "mean": round(float(marks.mean()), 2),
+        "median": float(np.median(marks)),
+        "std": round(float(marks.std(ddof=1)), 2) if len(marks) > 1 else None,
+        "min": int(marks.min()),
+        "max": int(marks.max()),
+        "grades": grade_counts,
+    }
+
+
+class CurvePlan:
+    """A curve worked out for one course's students and enrollments but not written yet.
+
+    summary() gives the before and after distributions for a dry run;
+    commit() writes every changed grade and mark.
+    """
+
+    def __init__(self, course_id, method, cutoffs, students, enrollments):
+        self.course_id = course_id
+        self.method = method
+        self.cutoffs = cutoffs
+        self.students = students  # (emails, grades, marks, new grades, new marks) for students.csv rows
+        self.enrollments = enrollments  # The same for additional enrollments
+
+    def _combined(self, position):
+        return np.concatenate([np.asarray(self.students[position]), np.asarray(self.enrollments[position])])
+
+    @staticmethod
+    def _changed(part):
+        _, grades, marks, new_grades, new_marks = part
+        return np.flatnonzero((grades != new_grades) | (marks != new_marks))
+
+    def summary(self):
+        grades, new_grades = self._combined(1).astype(str), self._combined(3).astype(str)
+        moves = grades != new_grades
+        transitions = np.char.add(np.char.add(grades[moves], "->"), new_grades[moves]) if moves.any() else []
+        return {
+            "course_id": self.course_id,
+            "method": self.method,
+            "cutoffs": self.cutoffs,
+            "changed": int(len(self._changed(self.students)) + len(self._changed(self.enrollments))),
+            "before": distribution(self._combined(2), grades),
+            "after": distribution(self._combined(4), new_grades),
+            "grade_changes": {str(change): int(n) for change, n in zip(*np.unique(transitions, return_counts=True))},
+        }
+
+    def _student_rows(self, repo):
+        """Returns the changed students.csv rows as they are now, raising StaleDataError if any moved on"""
+        emails, grades, marks, new_grades, new_marks = self.students
+        changed = self._changed(self.students).tolist()
+        wanted = [emails[i] for i in changed]
+        columns = getattr(repo, "columns", None)
+        if columns is not None:
+            slots = columns.slots_of(wanted)
+            rows = None if (slots < 0).any() else columns.rows(slots)
+        else:
+            rows = [repo.get(email) for email in wanted]
+            rows = None if None in rows else [list(row) for row in rows]
+        if rows is None or any(
+            (row[3], row[5], str(row[6])) != (self.course_id, grades[i], str(marks[i])) for row, i in zip(rows, changed)
+        ):
+            raise check_my_grade.StaleDataError(f"Students in {self.course_id} changed since the curve was planned")
+        for row, i in zip(rows, changed):
+            row[5], row[6] = str(new_grades[i]), str(new_marks[i])
+        return rows
+
+    def _enrollment_rows(self, enrollments):
+        emails, grades, marks, new_grades, new_marks = self.enrollments
+        rows = []
+        for i in self._changed(self.enrollments).tolist():
+            row = enrollments.get(emails[i], self.course_id)
+            if row is None or (row[2], row[3]) != (grades[i], str(marks[i])):
+                raise check_my_grade.StaleDataError(f"Enrollments in {self.course_id} changed since the curve was planned")
+            rows.append([emails[i], self.course_id, str(new_grades[i]), str(new_marks[i])])
+        return rows
+
+    def commit(self):
+        """Writes the changed rows with one write per file, returning how many changed.
+
+        Raises StaleDataError, writing nothing, if any affected student or
+        enrollment changed after the plan was made.
+        """
+        repo = check_my_grade.Student.repository()
+        enrollments = check_my_grade.Student.enrollment_repository()
+        with repo.writing(), enrollments.writing():
+            rows = self._student_rows(repo)
+            enrollment_rows = self._enrollment_rows(enrollments)
+            if rows:
+                repo.put_many(rows)
+                repo.record([["put"] + row for row in rows])
+            enrollments.put_many(enrollment_rows)
+        return len(rows) + len(enrollment_rows)
+
+
+def plan_curve(course_id, method=None, cutoffs=None, **options):
+    """Works out a curve over every mark in a course, returning a CurvePlan, or None if the course does not exist.
+
+    The course's students.csv rows and additional enrollments are curved
+    together in one vectorized pass, so a percentile curve ranks them all.
+    """
+    repo = check_my_grade.Student.repository()
+    columns = getattr(repo, "columns", None)
+    if columns is not None:
+        slots = columns.value_slots(3, course_id)
+        emails = list(map(bytes.decode, columns.emails[slots].tolist()))
+        grades = columns.dictionaries[5].decode(columns.codes[5][slots])
+        marks = columns.marks[slots].astype(np.int64)
+    else:
+        rows = repo._select("SELECT email, grade, marks FROM students WHERE course_id = ? ORDER BY rowid", (course_id,))
+        emails, grades = [row[0] for row in rows], [row[1] for row in rows]
+        marks = np.array([int(row[2]) for row in rows], dtype=np.int64)
+    enrolled = check_my_grade.Student.enrollment_repository().course_rows(course_id)
+    if not len(emails) and not enrolled and not check_my_grade.Course.exists(course_id):
+        return None
+
+    enrolled_marks = np.array([int(row[3]) for row in enrolled], dtype=np.int64)
+    new_marks, new_grades, cutoffs = curve(np.concatenate([marks, enrolled_marks]), method, cutoffs, **options)
+    split = len(emails)
+    students = (emails, np.array(grades, dtype=object), marks, new_grades[:split], new_marks[:split])
+    enrollments = (
+        [row[0] for row in enrolled], np.array([row[2] for row in enrolled], dtype=object),
+        enrolled_marks, new_grades[split:], new_marks[split:],
+    )
+    return CurvePlan(course_id, method, cutoffs, students, enrollments)
+
+
+def curve_course(course_id, method=None, cutoffs=None, dry_run=True, **options):
+    """Curves a course and returns the plan's summary, writing it only when dry_run is False.
+
+    Returns None if the course does not exist. The summary gains
+    "committed" and, after a write, "written" (rows changed).
+    """
+    plan = plan_curve(course_id, method, cutoffs, **options)
+    if plan is None:
+        return None
+    summary = plan.summary()
+    summary["committed"] = not dry_run
+    if not dry_run:
+        summary["written"] = plan.commit()
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Curve a course's marks or change its grade cutoffs, previewing by default")
+    parser.add_argument("course_id")
+    curves = parser.add_mutually_exclusive_group()
+    curves.add_argument("--shift", type=int, metavar="POINTS", help="add POINTS to every mark")
+    curves.add_argument("--scale", type=float, metavar="FACTOR", help="multiply every mark by FACTOR")
+    curves.add_argument("--scale-top", type=int, metavar="MARKS", help="scale so the best mark becomes MARKS")
+    curves.add_argument("--percentile", metavar="JSON", help='grade shares in percent, best first, e.g. \'{"A": 20, "B": 30, "C": 30, "D": 10, "F": 10}\'')
+    parser.add_argument("--cutoffs", metavar="JSON", help='lowest marks per grade, e.g. \'{"A": 85, "B": 75, "C": 65, "D": 55, "F": 0}\'')
+    parser.add_argument("--commit", action="store_true", help="write the result instead of only previewing it")
+    args = parser.parse_args()
+
+    method, options = None, {}
+    if args.shift is not None:
+        method, options = "shift", {"points": args.shift}
+    elif args.scale is not None or args.scale_top is not None:
+        method, options = "scale", {"factor": args.scale} if args.scale is not None else {"top": args.scale_top}
+    elif args.percentile is not None:
+        method, options = "percentile", {"shares": json.loads(args.percentile)}
+    cutoffs = json.loads(args.cutoffs) if args.cutoffs else None
+    summary = curve_course(args.course_id, method, cutoffs, dry_run=not args.commit, **options)
+    if summary is None:
+        parser.exit(1, f"Course {args.course_id} not found\n")
+    print(json.dumps(summary, indent=2))
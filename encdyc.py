@@ -1,27 +1,77 @@
+import os
 import string
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import bcrypt  # Ensure bcrypt is installed
 
+
+def _hash_password(password, rounds):
+    """Hashes one password; module level so process pools can pickle it"""
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _verify_password(password, hashed_password):
+    """Verifies one password; module level so process pools can pickle it"""
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
 class TextSecurity:
     """Class to encrypt and decrypt text using an improved Caesar cipher and bcrypt hashing."""
 
-    def __init__(self, shift):
-        """Constructor to initialize the shift value"""
+    _tables = {}  # shift -> str.translate table
+
+    def __init__(self, shift, rounds=12, workers=None):
+        """Constructor to initialize the shift value, bcrypt cost factor and batch worker count"""
         self.shifter = shift
         self.s = self.shifter % 26  # Ensures shift stays within bounds
+        self.rounds = rounds
+        self.workers = workers or os.cpu_count() or 1
+        self._table(shift)
+        self._table(-shift)
+
+    @classmethod
+    def _table(cls, shift):
+        """Returns the str.translate table for a shift, built once and shared by every instance"""
+        table = cls._tables.get(shift)
+        if table is None:
+            table = {}
+            for first, size in ((65, 26), (97, 26), (48, 10)):  # A-Z, a-z, 0-9
+                for code in range(first, first + size):
+                    table[code] = (code - first + shift) % size + first
+            table = cls._tables[shift] = str.maketrans(table)
+        return table
 
     def _convert(self, text, shift):
         """Encrypt or decrypt the input text while preserving special characters."""
-        result = ""
+        if text.isascii():
+            return text.translate(self._table(shift))
+        return self._convert_unicode(text, shift)
+
+    @staticmethod
+    def _convert_unicode(text, shift):
+        """Character by character conversion for non-ASCII text, where isupper/islower/isdigit also match other scripts"""
+        result = []
         for ch in text:
             if ch.isupper():
-                result += chr((ord(ch) - 65 + shift) % 26 + 65)  # Uppercase A-Z
+                result.append(chr((ord(ch) - 65 + shift) % 26 + 65))  # Uppercase A-Z
             elif ch.islower():
-                result += chr((ord(ch) - 97 + shift) % 26 + 97)  # Lowercase a-z
+                result.append(chr((ord(ch) - 97 + shift) % 26 + 97))  # Lowercase a-z
             elif ch.isdigit():
-                result += chr((ord(ch) - 48 + shift) % 10 + 48)  # Numbers 0-9
+                result.append(chr((ord(ch) - 48 + shift) % 10 + 48))  # Numbers 0-9
             else:
-                result += ch  # Keep special characters unchanged
-        return result
+                result.append(ch)  # Keep special characters unchanged
+        return "".join(result)
+
+    def _convert_many(self, texts, shift):
+        texts = list(texts)
+        if not texts:
+            return []
+        table = self._table(shift)
+
+        # Translate the whole batch as one string when it is ASCII and NUL can separate the items
+        joined = "\0".join(texts)
+        if joined.isascii() and joined.count("\0") == len(texts) - 1:
+            return joined.translate(table).split("\0")
+        return [text.translate(table) if text.isascii() else self._convert_unicode(text, shift) for text in texts]
 
     def encrypt(self, text):
         """Encrypts the text using the Caesar cipher"""
@@ -31,9 +81,32 @@ class TextSecurity:
         """Decrypts the text using the inverse shift"""
         return self._convert(text, -self.shifter)
 
+    def encrypt_many(self, texts):
+        """Encrypts every text in an iterable and returns a list"""
+        return self._convert_many(texts, self.shifter)
+
+    def decrypt_many(self, texts):
+        """Decrypts every text in an iterable and returns a list"""
+        return self._convert_many(texts, -self.shifter)
+
+    def encrypt_column(self, rows, column, header=True):
+        """Returns CSV rows with one column encrypted, leaving the header row as is"""
+        return self._convert_column(rows, column, self.shifter, header)
+
+    def decrypt_column(self, rows, column, header=True):
+        """Returns CSV rows with one column decrypted, leaving the header row as is"""
+        return self._convert_column(rows, column, -self.shifter, header)
+
+    def _convert_column(self, rows, column, shift, header):
+        rows = [list(row) for row in rows]
+        body = rows[1:] if header else rows
+        for row, value in zip(body, self._convert_many([row[column] for row in body], shift)):
+            row[column] = value
+        return rows
+
     def hash_password(self, password):
         """Hashes a password using bcrypt"""
-        salt = bcrypt.gensalt()  # Generate a random salt
+        salt = bcrypt.gensalt(self.rounds)  # Generate a random salt
         hashed = bcrypt.hashpw(password.encode('utf-8'), salt)  # Hash password
         return hashed.decode('utf-8')  # Return hashed password as string
 
@@ -41,6 +114,24 @@ class TextSecurity:
         """Verifies a password against a stored hash"""
         return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
 
+    def _pool(self, workers, processes):
+        """Creates the executor used by the batch methods"""
+        executor = ProcessPoolExecutor if processes else ThreadPoolExecutor  # bcrypt releases the GIL, so threads scale too
+        return executor(max_workers=workers or self.workers)
+
+    def hash_passwords(self, passwords, workers=None, processes=False):
+        """Hashes many passwords in parallel and returns the hashes in input order"""
+        passwords = list(passwords)
+        with self._pool(workers, processes) as pool:
+            return list(pool.map(_hash_password, passwords, [self.rounds] * len(passwords)))
+
+    def verify_passwords(self, pairs, workers=None, processes=False):
+        """Verifies many (password, hashed_password) pairs in parallel and returns a list of booleans"""
+        pairs = list(pairs)
+        passwords, hashes = zip(*pairs) if pairs else ((), ())
+        with self._pool(workers, processes) as pool:
+            return list(pool.map(_verify_password, passwords, hashes))
+
 # Example Usage
 if __name__ == "__main__":
     cipher = TextSecurity(4)
@@ -1,9 +1,12 @@
+import argparse
 import csv
+import os
 import random
 from encdyc import TextSecurity  # Import password hashing class
 
-# Initialize password security object
-security = TextSecurity(4)
+# bcrypt cost factor and number of parallel hashing workers (None uses every core)
+HASH_ROUNDS = 12
+HASH_WORKERS = None
 
 # File paths
 STUDENT_FILE = "students.csv"
@@ -45,70 +48,92 @@ professors = [
 ]
 ranks = ["Assistant", "Associate", "Senior", "Professor"]
 
-# Assign professors to courses uniquely
-professor_map = {}  # Maps course_id -> professor_email
-professor_list = []
-
-for i, (course_id, course_name, description) in enumerate(courses):
-    professor_email = f"professor{i+1}@university.edu"
-    professor_name = professors[i % len(professors)]
-    professor_rank = random.choice(ranks)
-    professor_list.append([professor_email, professor_name, professor_rank, course_id])
-    professor_map[course_id] = professor_email  # Assign professor to course
-
-# Overwrite and regenerate `courses.csv`
-with open(COURSE_FILE, mode="w", newline="") as f:
-    writer = csv.writer(f)
-    writer.writerow(["course_id", "course_name", "description"])  # Header
-    writer.writerows(courses)
-
-# Overwrite and regenerate `professors.csv`
-with open(PROFESSOR_FILE, mode="w", newline="") as f:
-    writer = csv.writer(f)
-    writer.writerow(["email", "name", "rank", "course_id"])  # Header
-    writer.writerows(professor_list)
-
-# Overwrite and regenerate `students.csv`
-with open(STUDENT_FILE, mode="w", newline="") as f:
-    writer = csv.writer(f)
-    writer.writerow(["email", "first_name", "last_name", "course_id", "professor_email", "grade", "marks"])  # Header
-
-    # Generate 1000 students
-    for i in range(1000):
-        first_name = random.choice(first_names)
-        last_name = random.choice(last_names)
-        email = f"student{i}@university.edu"
-        
-        # Randomly pick a course from the courses list
-        course_id = random.choice([c[0] for c in courses])  # Pick a valid course
-        
-        # Get the corresponding professor for the course
-        professor_email = professor_map.get(course_id, "unknown_professor@university.edu")
-        
-        # Randomly assign a grade and corresponding marks
-        grade = random.choice(grades)
-        marks = random.randint(*marks_range[grade])  # Assign marks based on grade
-
-        # Write student record to students.csv
-        writer.writerow([email, first_name, last_name, course_id, professor_email, grade, marks])
-
-# Overwrite and regenerate `login.csv`
-with open(LOGIN_FILE, mode="w", newline="") as f:
-    writer = csv.writer(f)
-    writer.writerow(["email", "password", "role"])  # Header
-
-    # Admin login (hashed)
-    admin_password = security.hash_password("AdminPass123")
-    writer.writerow(["admin@university.edu", admin_password, "admin"])
-
-    # Professor logins (hashed)
-    for professor in professor_list:
-        prof_password = security.hash_password(f"ProfPass{random.randint(1000, 9999)}")
-        writer.writerow([professor[0], prof_password, "professor"])
-
-    # Student logins (hashed)
-    for i in range(1000):
-        student_password = security.hash_password(f"StudentPass{random.randint(1000, 9999)}")
-        writer.writerow([f"student{i}@university.edu", student_password, "student"])
-
-print("Data generated successfully. All CSV files have been overwritten.")
+
+def generate(num_students=1000, seed=None, hash_passwords=True, out_dir=".", rounds=HASH_ROUNDS, workers=HASH_WORKERS):
+    """Overwrites the sample CSV files in out_dir.
+
+    The same seed always produces the same students, courses and professors.
+    With hash_passwords=False no bcrypt work is done and login.csv is not
+    written, which keeps large benchmark datasets fast to build.
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Assign professors to courses uniquely
+    professor_map = {}  # Maps course_id -> professor_email
+    professor_list = []
+
+    for i, (course_id, course_name, description) in enumerate(courses):
+        professor_email = f"professor{i+1}@university.edu"
+        professor_name = professors[i % len(professors)]
+        professor_rank = rng.choice(ranks)
+        professor_list.append([professor_email, professor_name, professor_rank, course_id])
+        professor_map[course_id] = professor_email  # Assign professor to course
+
+    # Overwrite and regenerate `courses.csv`
+    with open(os.path.join(out_dir, COURSE_FILE), mode="w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["course_id", "course_name", "description"])  # Header
+        writer.writerows(courses)
+
+    # Overwrite and regenerate `professors.csv`
+    with open(os.path.join(out_dir, PROFESSOR_FILE), mode="w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["email", "name", "rank", "course_id"])  # Header
+        writer.writerows(professor_list)
+
+    # Overwrite and regenerate `students.csv`
+    course_ids = [c[0] for c in courses]
+    with open(os.path.join(out_dir, STUDENT_FILE), mode="w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["email", "first_name", "last_name", "course_id", "professor_email", "grade", "marks"])  # Header
+
+        for i in range(num_students):
+            first_name = rng.choice(first_names)
+            last_name = rng.choice(last_names)
+            email = f"student{i}@university.edu"
+
+            # Randomly pick a course from the courses list
+            course_id = rng.choice(course_ids)  # Pick a valid course
+
+            # Get the corresponding professor for the course
+            professor_email = professor_map.get(course_id, "unknown_professor@university.edu")
+
+            # Randomly assign a grade and corresponding marks
+            grade = rng.choice(grades)
+            marks = rng.randint(*marks_range[grade])  # Assign marks based on grade
+
+            # Write student record to students.csv
+            writer.writerow([email, first_name, last_name, course_id, professor_email, grade, marks])
+
+    if not hash_passwords:
+        return
+
+    # Overwrite and regenerate `login.csv`
+    logins = [("admin@university.edu", "AdminPass123", "admin")]
+    logins += [(professor[0], f"ProfPass{rng.randint(1000, 9999)}", "professor") for professor in professor_list]
+    logins += [(f"student{i}@university.edu", f"StudentPass{rng.randint(1000, 9999)}", "student") for i in range(num_students)]
+
+    # Hash every password in one parallel batch
+    security = TextSecurity(4, rounds=rounds, workers=workers)
+    hashed_passwords = security.hash_passwords(password for _, password, _ in logins)
+
+    with open(os.path.join(out_dir, LOGIN_FILE), mode="w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["email", "password", "role"])  # Header
+        for (email, _, role), hashed_password in zip(logins, hashed_passwords):
+            writer.writerow([email, hashed_password, role])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate sample CheckMyGrade CSV files")
+    parser.add_argument("--students", type=int, default=1000, help="number of students to generate")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for reproducible data")
+    parser.add_argument("--no-hash", action="store_true", help="skip bcrypt and do not write login.csv")
+    parser.add_argument("--rounds", type=int, default=HASH_ROUNDS, help="bcrypt cost factor")
+    parser.add_argument("--workers", type=int, default=HASH_WORKERS, help="parallel hashing workers")
+    parser.add_argument("--out-dir", default=".", help="directory to write the CSV files to")
+    args = parser.parse_args()
+
+    generate(args.students, args.seed, not args.no_hash, args.out_dir, args.rounds, args.workers)
+    print("Data generated successfully. All CSV files have been overwritten.")
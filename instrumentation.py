@@ -0,0 +1,295 @@
+import bisect
+import cProfile
+import functools
+import json
+import os
+import pstats
+import threading
+import time
+import check_my_grade
+from encdyc import TextSecurity
+
+ENVIRONMENT_SWITCH = "CHECKMYGRADE_INSTRUMENT"  # "1" records metrics, "profile" also runs cProfile
+LATENCY_BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0]  # Seconds
+PROMETHEUS_PREFIX = "checkmygrade"
+
+# (owner, method names or None for every public classmethod/staticmethod, how the method touches files)
+TARGETS = [
+    (check_my_grade.Base, ["read_csv", "iter_csv", "write_csv", "append_csv"], None),
+    (check_my_grade.CSVStorage, ["read", "iter"], "read"),
+    (check_my_grade.CSVStorage, ["write"], "write"),
+    (check_my_grade.CSVStorage, ["append"], "append"),
+    (check_my_grade.SQLiteStorage, ["read", "iter", "write", "append"], None),
+    (check_my_grade.StudentRepository, ["load", "compact"], None),
+    (check_my_grade.Student, None, None),
+    (check_my_grade.Student, ["save"], None),  # The main write path, an instance method
+    (check_my_grade.Course, None, None),
+    (check_my_grade.Professor, None, None),
+    (TextSecurity, ["hash_password", "verify_password", "hash_passwords", "verify_passwords"], None),
+]
+
+
+class OperationMetrics:
+    """Call count, errors, latency histogram, rows and bytes for one instrumented method"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # Last bucket is +Inf
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def add(self, elapsed, error=False, rows=0, bytes_read=0, bytes_written=0):
+        with _lock:
+            self.calls += 1
+            self.errors += error
+            self.seconds += elapsed
+            self.buckets[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+            self.rows += rows
+            self.bytes_read += bytes_read
+            self.bytes_written += bytes_written
+
+    def summary(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "seconds_total": self.seconds,
+            "mean_ms": self.seconds / self.calls * 1000 if self.calls else 0.0,
+            "latency_buckets": dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], self.buckets)),
+            "rows": self.rows,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+        }
+
+
+_lock = threading.Lock()
+_metrics = {}  # "Owner.method" -> OperationMetrics
+_originals = []  # (owner, name, attribute) restored by disable()
+_profiling = False
+_profilers = {}  # thread id -> cProfile.Profile, so worker threads are profiled too
+_local = threading.local()
+
+
+def _file_size(file):
+    try:
+        return os.path.getsize(file)
+    except (OSError, TypeError):
+        return 0
+
+
+def _row_count(result):
+    """Counts the rows in a list-of-rows result; other results scan no rows"""
+    if isinstance(result, list) and result and isinstance(result[0], (list, tuple, dict)):
+        return len(result)
+    return 0
+
+
+def _counted(rows, count):
+    """Passes rows through, counting them in count[0] as they are consumed"""
+    for row in rows:
+        count[0] += 1
+        yield row
+
+
+def _timed(metrics, function, args, kwargs, io):
+    size = _file_size(args[0]) if io == "append" else 0
+    count = None
+    if io in ("write", "append"):
+        data = args[1] if len(args) > 1 else kwargs.get("data", kwargs.get("rows", ()))
+        if not hasattr(data, "__len__"):  # A generator, e.g. from compact(): count the rows as they are written
+            count = [0]
+            if len(args) > 1:
+                args = (args[0], _counted(data, count)) + tuple(args[2:])
+            else:
+                kwargs = dict(kwargs, **{"data" if "data" in kwargs else "rows": _counted(data, count)})
+    start = time.perf_counter()
+    try:
+        result = function(*args, **kwargs)
+    except BaseException:
+        metrics.add(time.perf_counter() - start, error=True)
+        raise
+    elapsed = time.perf_counter() - start
+    if io in ("write", "append"):
+        rows = count[0] if count is not None else len(data)
+        metrics.add(elapsed, rows=rows, bytes_written=max(0, _file_size(args[0]) - size))
+    elif io == "read":
+        metrics.add(elapsed, rows=len(result), bytes_read=_file_size(args[0]))
+    elif isinstance(result, list) and function.__name__.endswith("_passwords"):
+        metrics.add(elapsed, rows=len(result))
+    elif isinstance(result, check_my_grade.StudentRepository):
+        metrics.add(elapsed, rows=len(result))
+    else:
+        metrics.add(elapsed, rows=_row_count(result))
+    return result
+
+
+def _profiled(metrics, function, args, kwargs, io):
+    """Profiles the outermost instrumented call on this thread"""
+    profiler = _profilers.get(threading.get_ident())
+    if profiler is None:
+        profiler = _profilers.setdefault(threading.get_ident(), cProfile.Profile())
+    try:
+        profiler.enable()
+    except ValueError:  # Another profiler is already running
+        return _timed(metrics, function, args, kwargs, io)
+    _local.profiling = True
+    try:
+        return _timed(metrics, function, args, kwargs, io)
+    finally:
+        profiler.disable()
+        _local.profiling = False
+
+
+def _timed_rows(metrics, rows, file):
+    """Wraps a row generator, timing only the time spent producing rows"""
+    count = 0
+    elapsed = 0.0
+    error = False
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                row = next(rows)
+            except StopIteration:
+                break
+            except BaseException:
+                error = True
+                raise
+            finally:
+                elapsed += time.perf_counter() - start
+            count += 1
+            yield row
+    finally:
+        metrics.add(elapsed, error=error, rows=count, bytes_read=_file_size(file))
+
+
+def _wrap(name, function, io):
+    metrics = _metrics.setdefault(name, OperationMetrics())
+
+    if io == "read" and function.__name__ == "iter":
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return _timed_rows(metrics, function(*args, **kwargs), args[0])
+    else:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiling and not getattr(_local, "profiling", False):
+                return _profiled(metrics, function, args, kwargs, io)
+            return _timed(metrics, function, args, kwargs, io)
+    return wrapper
+
+
+def _methods(owner, names):
+    if names is not None:
+        return names
+    return [
+        name for name, attribute in vars(owner).items()
+        if not name.startswith("_") and isinstance(attribute, (classmethod, staticmethod))
+    ]
+
+
+def enabled():
+    return bool(_originals)
+
+
+def enable(profile=False):
+    """Starts recording every target method; with profile=True each call is also captured with cProfile"""
+    global _profiling
+    if not _originals:
+        for owner, names, io in TARGETS:
+            for name in _methods(owner, names):
+                attribute = vars(owner)[name]
+                _originals.append((owner, name, attribute))
+                label = f"{owner.__name__}.{name}"
+                if isinstance(attribute, (classmethod, staticmethod)):
+                    wrapped = type(attribute)(_wrap(label, attribute.__func__, io))
+                else:
+                    wrapped = _wrap(label, attribute, io)
+                setattr(owner, name, wrapped)
+    _profiling = _profiling or profile
+
+
+def disable():
+    """Restores the original methods, leaving no overhead; recorded metrics are kept until reset()"""
+    global _profiling
+    _profiling = False
+    while _originals:
+        owner, name, attribute = _originals.pop()
+        setattr(owner, name, attribute)
+
+
+def enable_from_environment():
+    """Applies the CHECKMYGRADE_INSTRUMENT switch, returning whether instrumentation is on.
+
+    check_my_grade calls this when it is imported with the switch set, so
+    every entry point honours it.
+    """
+    setting = os.environ.get(ENVIRONMENT_SWITCH, "").strip().lower()
+    if setting in ("", "0", "off", "false", "no"):
+        return False
+    enable(profile=setting == "profile")
+    return True
+
+
+def reset():
+    """Clears the recorded metrics and the captured profile"""
+    with _lock:
+        for metric in _metrics.values():  # Wrappers keep their metric objects, so zero them in place
+            metric.__init__()
+    _profilers.clear()
+
+
+def metrics():
+    """Returns {"Owner.method": summary} for every method called since the last reset"""
+    return {name: metric.summary() for name, metric in sorted(_metrics.items()) if metric.calls}
+
+
+def to_json(indent=None):
+    return json.dumps(metrics(), indent=indent)
+
+
+def to_prometheus():
+    """Returns the metrics in the Prometheus text exposition format"""
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} {kind}")
+
+    operations = [(name, metric) for name, metric in sorted(_metrics.items()) if metric.calls]
+    family("call_seconds", "histogram", "Latency of instrumented CheckMyGrade methods.")
+    for name, metric in operations:
+        cumulative = 0
+        for bound, count in zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], metric.buckets):
+            cumulative += count
+            lines.append(f'{PROMETHEUS_PREFIX}_call_seconds_bucket{{operation="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'{PROMETHEUS_PREFIX}_call_seconds_sum{{operation="{name}"}} {metric.seconds!r}')
+        lines.append(f'{PROMETHEUS_PREFIX}_call_seconds_count{{operation="{name}"}} {metric.calls}')
+    for field, help_text in (
+        ("errors", "Calls that raised an exception."),
+        ("rows", "Rows read, written or returned."),
+        ("bytes_read", "Bytes read from data files."),
+        ("bytes_written", "Bytes written to data files."),
+    ):
+        family(f"{field}_total", "counter", help_text)
+        for name, metric in operations:
+            lines.append(f'{PROMETHEUS_PREFIX}_{field}_total{{operation="{name}"}} {getattr(metric, field)}')
+    return "\n".join(lines) + "\n"
+
+
+def profile_stats(sort="cumulative"):
+    """Returns the cProfile data captured on every thread as pstats.Stats, or None if nothing was profiled"""
+    profilers = list(_profilers.values())
+    if not profilers:
+        return None
+    return pstats.Stats(*profilers).sort_stats(sort)
+
+
+def dump_profile(file):
+    """Writes the captured cProfile data for snakeviz, pstats or gprof2dot"""
+    stats = profile_stats()
+    if stats is None:
+        raise ValueError("No profile has been captured; enable(profile=True) first")
+    stats.dump_stats(file)
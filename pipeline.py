@@ -0,0 +1,305 @@
+import argparse
+import csv
+import itertools
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import check_my_grade
+import generate_data
+
+IMPORT_CHUNK_SIZE = 10000  # Input rows validated and merged at a time
+REJECTS_SUFFIX = ".rejects.csv"  # Rejected rows go next to the input file unless told otherwise
+
+STUDENT_HEADER = check_my_grade.STUDENT_HEADER
+_WHITESPACE = re.compile(r"\s")
+
+
+def read_rows(file):
+    """Parse stage: returns the input's column positions and a generator of (line number, fields).
+
+    With a header, columns are matched by name, so a file may hold them in
+    any order or only some of them (at least email). Without one the
+    columns are taken to be in students.csv order.
+    """
+    f = open(file, mode="r", newline="")
+    reader = csv.reader(f)
+    first = next(reader, None) or []
+    names = [name.strip().lower() for name in first]
+    if "email" in names:
+        positions = [names.index(name) if name in names else None for name in STUDENT_HEADER]
+        width, start = len(names), []
+    else:
+        positions, width, start = list(range(len(STUDENT_HEADER))), len(STUDENT_HEADER), [(1, first)] if first else []
+
+    def rows():
+        with f:
+            yield from start
+            for fields in reader:
+                if fields:
+                    yield reader.line_num, fields
+
+    return positions, width, rows()
+
+
+def chunked(iterable, size):
+    """Yields lists of up to size items"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def check_row(row, courses=None, professors=None):
+    """Returns why a row in students.csv order is invalid, or None; absent (None) fields are not checked"""
+    email, first_name, last_name, course_id, professor_email, grade, marks = row
+    if not email or "@" not in email or _WHITESPACE.search(email):
+        return f"invalid email {email!r}"
+    if "" in (first_name, last_name):
+        return "missing name"
+    if course_id == "" or (courses is not None and course_id is not None and course_id not in courses):
+        return f"unknown course {course_id!r}"
+    if professor_email == "" or (professors is not None and professor_email is not None and professor_email not in professors):
+        return f"unknown professor {professor_email!r}"
+    if grade is not None and grade not in generate_data.marks_range:
+        return f"invalid grade {grade!r}"
+    if marks is not None:
+        try:
+            value = int(marks)
+        except ValueError:
+            return f"invalid marks {marks!r}"
+        if grade is not None:
+            low, high = generate_data.marks_range[grade]
+            if not low <= value <= high:
+                return f"marks {value} outside {low}-{high} for grade {grade}"
+    return None
+
+
+def validate_chunk(chunk, positions, width, courses=None, professors=None):
+    """Validate stage for one chunk: returns ([(line, row, fields)], [(line, fields, reason)]).
+
+    Rows come back in students.csv order with None for columns the input
+    does not have. Module level so a process pool can run it.
+    """
+    valid, rejected = [], []
+    for line, fields in chunk:
+        if len(fields) != width:
+            rejected.append((line, fields, f"expected {width} fields, found {len(fields)}"))
+            continue
+        row = [None if position is None else fields[position].strip() for position in positions]
+        reason = check_row(row, courses, professors)
+        if reason is None:
+            valid.append((line, row, fields))
+        else:
+            rejected.append((line, fields, reason))
+    return valid, rejected
+
+
+def validated(chunks, positions, width, courses=None, professors=None, workers=None):
+    """Runs validate_chunk over the chunks in order, on a process pool when workers is set.
+
+    At most two chunks per worker are in flight, so memory stays bounded
+    however long the input is.
+    """
+    if not workers:
+        for chunk in chunks:
+            yield validate_chunk(chunk, positions, width, courses, professors)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(validate_chunk, chunk, positions, width, courses, professors))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class _SeenEmails:
+    """Remembers which students an import already wrote, with one byte per repository slot when possible"""
+
+    def __init__(self, repo):
+        self.columns = getattr(repo, "columns", None)
+        self.slots = np.zeros(0, dtype=bool)
+        self.emails = set()
+
+    def add(self, emails):
+        """Marks emails as imported, returning how many already were or repeat within emails"""
+        if self.columns is None:
+            duplicates = 0
+            for email in emails:
+                duplicates += email in self.emails
+                self.emails.add(email)
+            return duplicates
+        slots = self.columns.slots_of(emails)
+        if len(slots) and slots.max() >= len(self.slots):
+            grown = np.zeros(max(2 * len(self.slots), int(slots.max()) + 1, 1024), dtype=bool)
+            grown[:len(self.slots)] = self.slots
+            self.slots = grown
+        first = np.unique(slots)
+        first = first[~self.slots[first]]
+        self.slots[first] = True
+        return len(slots) - len(first)
+
+
+def import_students(file, chunk_size=IMPORT_CHUNK_SIZE, workers=None, rejects_file=None, check_references=True):
+    """Streams a roster or grade file into the students data, returning a summary of what happened.
+
+    Each chunk_size chunk of rows is validated (grade and marks consistent
+    with generate_data.marks_range, and course and professor known when
+    check_references is set) and merged in memory. Rows for an existing
+    student may leave out columns, which keep their current values. For an
+    email that appears more than once, the last row wins: each email counts
+    once as inserted or updated and every further row for it as a
+    duplicate. The whole import is written with one compaction at the end,
+    skipped when no row was applied, so it is all or nothing.
+    Rejected rows go to rejects_file (input + REJECTS_SUFFIX by default)
+    with their line number and reason.
+    """
+    rejects_file = rejects_file or file + REJECTS_SUFFIX
+    positions, width, rows = read_rows(file)
+    courses = professors = None
+    if check_references:
+        courses = frozenset(check_my_grade.Course.index().groups)
+        professors = frozenset(check_my_grade.Professor.index().groups)
+
+    summary = {"read": 0, "inserted": 0, "updated": 0, "duplicates": 0, "rejected": 0, "rejects_file": None}
+    repo = check_my_grade.Student.repository()
+    seen = _SeenEmails(repo)
+    rejects = None
+    try:
+        with repo.writing():
+            before, applied = len(repo), 0
+            for valid, rejected in validated(chunked(rows, chunk_size), positions, width, courses, professors, workers):
+                summary["read"] += len(valid) + len(rejected)
+                merged = []
+                for line, row, fields in valid:
+                    if None in row:  # Merge stage: absent columns keep the student's current values
+                        current = repo.get(row[0])
+                        if current is None:
+                            rejected.append((line, fields, "unknown student for a row without every column"))
+                            continue
+                        row = [value if value is not None else current[position] for position, value in enumerate(row)]
+                        reason = check_row(row)
+                        if reason is not None:
+                            rejected.append((line, fields, reason))
+                            continue
+                    merged.append(row)
+                repo.put_many(merged, recount=False)
+                applied += len(merged)
+                # Dedupe stage: the last row for an email has won; count the ones it replaced
+                summary["duplicates"] += seen.add([row[0] for row in merged])
+                if rejected:
+                    if rejects is None:
+                        rejects = open(rejects_file, mode="w", newline="")
+                        writer = csv.writer(rejects)
+                        writer.writerow(["line", "reason", "fields"])
+                    writer.writerows([line, reason, *fields] for line, fields, reason in sorted(rejected, key=lambda entry: entry[0]))
+                    summary["rejected"] += len(rejected)
+            # Imports only add or replace rows, so the growth is the number of new students
+            summary["inserted"] = len(repo) - before
+            summary["updated"] = applied - summary["duplicates"] - summary["inserted"]
+            if applied:
+                repo.recount()
+                repo.compact()
+    except BaseException:
+        repo.loaded = False  # The in-memory rows hold changes that were never written
+        raise
+    finally:
+        if rejects is not None:
+            rejects.close()
+    if rejects is not None:
+        summary["rejects_file"] = rejects_file
+    elif os.path.exists(rejects_file):
+        os.remove(rejects_file)  # Left by an earlier run of the same file
+    return summary
+
+
+def matching_rows(filters=(), min_marks=None, max_marks=None, chunk_size=IMPORT_CHUNK_SIZE):
+    """Yields lists of student rows matching (position, value) filters and a marks range, chunk_size slots at a time"""
+    repo = check_my_grade.Student.repository()
+    columns = getattr(repo, "columns", None)
+    if columns is None:
+        def keep(row):
+            marks = int(row[check_my_grade.MARKS_COLUMN])
+            return (all(str(row[position]) == str(value) for position, value in filters)
+                    and (min_marks is None or marks >= min_marks) and (max_marks is None or marks <= max_marks))
+        rows = itertools.islice(check_my_grade.Base.iter_csv(check_my_grade.STUDENT_FILE), 1, None)
+        yield from chunked(filter(keep, rows), chunk_size)
+        return
+
+    for start in range(0, columns.size, chunk_size):
+        slots = np.arange(start, min(start + chunk_size, columns.size))
+        slots = slots[columns.alive[slots]]
+        for position, value in filters:
+            slots = columns.matching(slots, position, value)
+        if min_marks is not None:
+            slots = slots[columns.marks[slots] >= min_marks]
+        if max_marks is not None:
+            slots = slots[columns.marks[slots] <= max_marks]
+        if len(slots):
+            yield columns.rows(slots)
+
+
+def export_students(file, columns=None, min_marks=None, max_marks=None, chunk_size=IMPORT_CHUNK_SIZE, **filters):
+    """Streams the students matching exact column filters and a marks range to a CSV, returning the row count.
+
+    columns picks and orders the output columns (all by default). The file
+    is written to a temp file and renamed into place.
+    """
+    columns = list(columns or STUDENT_HEADER)
+    for column in list(filters) + columns:
+        if column not in check_my_grade.STUDENT_COLUMNS:
+            raise ValueError(f"Unknown student column: {column}")
+    positions = [check_my_grade.STUDENT_COLUMNS[column] for column in columns]
+    filters = [(check_my_grade.STUDENT_COLUMNS[column], value) for column, value in filters.items()]
+
+    count = 0
+    fd, temp_file = check_my_grade._temp_file(file)
+    try:
+        with os.fdopen(fd, mode="w", newline="") as f, check_my_grade.Base.locked(check_my_grade.STUDENT_FILE, exclusive=False):
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for rows in matching_rows(filters, min_marks, max_marks, chunk_size):
+                writer.writerows([row[position] for position in positions] for row in rows)
+                count += len(rows)
+        os.replace(temp_file, file)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream large roster and grade files into or out of CheckMyGrade")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    importer = commands.add_parser("import", help="validate and merge a roster or grade CSV")
+    importer.add_argument("file")
+    importer.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    importer.add_argument("--workers", type=int, default=None, help="validate chunks on this many processes")
+    importer.add_argument("--rejects", default=None, help=f"where rejected rows go (default FILE{REJECTS_SUFFIX})")
+    importer.add_argument("--no-reference-check", action="store_true", help="accept unknown courses and professors")
+
+    exporter = commands.add_parser("export", help="write a filtered subset of students")
+    exporter.add_argument("file")
+    exporter.add_argument("--columns", nargs="+", default=None)
+    exporter.add_argument("--min-marks", type=int, default=None)
+    exporter.add_argument("--max-marks", type=int, default=None)
+    for column in STUDENT_HEADER:
+        exporter.add_argument(f"--{column.replace('_', '-')}", dest=column, default=None, help=f"only students with this {column}")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        summary = import_students(args.file, args.chunk_size, args.workers, args.rejects, not args.no_reference_check)
+        print(", ".join(f"{key} {value}" for key, value in summary.items() if key != "rejects_file"))
+        if summary["rejects_file"]:
+            print(f"Rejected rows written to {summary['rejects_file']}")
+    else:
+        filters = {column: getattr(args, column) for column in STUDENT_HEADER if getattr(args, column) is not None}
+        count = export_students(args.file, args.columns, args.min_marks, args.max_marks, **filters)
+        print(f"Exported {count} students to {args.file}")
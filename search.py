@@ -0,0 +1,217 @@
+import bisect
+import difflib
+import math
+import os
+import re
+import numpy as np
+import check_my_grade
+
+SEARCH_LIMIT = 20  # Results returned when no limit is given
+FUZZY_CUTOFF = 0.75  # difflib similarity a misspelt word needs to count as a match
+FUZZY_MATCHES = 5  # Closest values considered per misspelt word
+
+EXACT, PREFIX, FUZZY = 3, 2, 1  # Score of a word matching a value exactly, as a prefix, or only fuzzily
+NAME_COLUMNS = [1, 2]  # first_name, last_name
+
+
+def tokens(text):
+    """Splits text into casefolded words"""
+    return re.findall(r"[\w@.'-]+", text.casefold())
+
+
+def _prefix_range(values, prefix):
+    """Returns the [start, end) range of sorted values that start with prefix"""
+    start = bisect.bisect_left(values, prefix)
+    return start, bisect.bisect_left(values, prefix + "\U0010ffff", start)
+
+
+def _match_scores(values, codes, token, fuzzy):
+    """Returns {code: score} for the sorted, casefolded values that token matches"""
+    start, end = _prefix_range(values, token)
+    scores = {codes[i]: EXACT if values[i] == token else PREFIX for i in range(start, end)}
+    if fuzzy:
+        for value in difflib.get_close_matches(token, list(dict.fromkeys(values)), FUZZY_MATCHES, FUZZY_CUTOFF):
+            for i in range(*_prefix_range(values, value)):
+                if values[i] == value:
+                    scores.setdefault(codes[i], FUZZY)
+    return scores
+
+
+def search_students(query, limit=SEARCH_LIMIT, fuzzy=False):
+    """Returns up to limit student rows whose first or last names match every word of query, best first.
+
+    A word scores 3 for a whole name, 2 for a name prefix and, with
+    fuzzy=True, 1 for a close misspelling; a row's score is the sum over
+    the words. Equal scores list first-name matches before last-name ones,
+    then file order within a name (recently changed rows last). A query
+    that is an email returns that student.
+    """
+    words = tokens(query)
+    repo = check_my_grade.Student.repository()
+    if len(words) == 1 and "@" in words[0]:
+        row = repo.get(query.strip()) or repo.get(words[0])
+        return [list(row)] if row is not None else []
+    if not words or limit <= 0:
+        return []
+    columns = getattr(repo, "columns", None)
+    if columns is None:
+        return _search_sql(repo, words, limit)
+
+    # Per word and column, an array scoring every code of the column's dictionary
+    lookups = []
+    for word in words:
+        lookup = {}
+        for position in NAME_COLUMNS:
+            dictionary = columns.dictionaries[position]
+            scores = _match_scores(*dictionary.folded(), word, fuzzy)
+            lookup[position] = np.zeros(len(dictionary.values) + 1, dtype=np.int64)
+            lookup[position][list(scores)] = list(scores.values())
+        if not any(lookup[position].any() for position in NAME_COLUMNS):
+            return []
+        lookups.append(lookup)
+
+    def candidates(lookup):
+        """(score, position, code) for every code a word matches, best first"""
+        return sorted(
+            ((int(lookup[position][code]), position, int(code)) for position in NAME_COLUMNS for code in np.flatnonzero(lookup[position])),
+            key=lambda entry: (-entry[0], entry[1], entry[2]),
+        )
+
+    # Walk the word with the fewest matching rows; the others only filter and score its rows
+    def matching_rows(lookup):
+        total = 0
+        for _, position, code in candidates(lookup):
+            starts = columns.postings(position)[1]
+            if code + 1 < len(starts):
+                total += int(starts[code + 1] - starts[code])
+        return total
+
+    lead = min(range(len(lookups)), key=lambda i: matching_rows(lookups[i]))
+    best_rest = sum(int(max(lookup[position].max() for position in NAME_COLUMNS)) for i, lookup in enumerate(lookups) if i != lead)
+
+    found = {}  # slot -> score, in the order found
+    for lead_score, position, code in candidates(lookups[lead]):
+        bound = lead_score + best_rest  # No row found from here on can score more
+        if sum(score >= bound for score in found.values()) >= limit:
+            break
+        for chunk in columns.code_slots(position, code, max(limit, 64)):
+            total = np.zeros(len(chunk), dtype=np.int64)
+            matched = np.ones(len(chunk), dtype=bool)
+            for lookup in lookups:
+                score = np.maximum(*(lookup[position][columns.codes[position][chunk]] for position in NAME_COLUMNS))
+                matched &= score > 0
+                total += score
+            for slot, score in zip(chunk[matched].tolist(), total[matched].tolist()):
+                found.setdefault(slot, score)
+            if sum(score >= bound for score in found.values()) >= limit:
+                break
+
+    ranked = sorted(found, key=lambda slot: -found[slot])[:limit]  # sorted() is stable, keeping the found order
+    return columns.rows(np.array(ranked, dtype=np.int64))
+
+
+def _search_sql(repo, words, limit):
+    """The same name search for the SQLite backend, as one query"""
+    conditions, scores, params, score_params = [], [], [], []
+    for word in words:
+        pattern = word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        conditions.append("(lower(first_name) LIKE ? ESCAPE '\\' OR lower(last_name) LIKE ? ESCAPE '\\')")
+        params += [pattern, pattern]
+        scores.append(f"MAX(CASE WHEN lower(first_name) = ? THEN {EXACT} ELSE {PREFIX} END, CASE WHEN lower(last_name) = ? THEN {EXACT} ELSE {PREFIX} END)")
+        score_params += [word, word]
+    sql = (
+        f"SELECT * FROM students WHERE {' AND '.join(conditions)} "
+        f"ORDER BY {' + '.join(scores)} DESC, rowid LIMIT ?"
+    )
+    return [list(row) for row in repo._select(sql, params + score_params + [limit])]
+
+
+class TextIndex:
+    """Inverted word index over a small table such as courses.csv, rebuilt when its data changes.
+
+    Every word of the weighted columns points at the rows containing it.
+    Rows are ranked by how many query words they match, then by tf-idf,
+    with prefix and fuzzy matches counting for less than whole words.
+    """
+
+    _instances = {}  # (absolute path, weights) -> index
+
+    def __init__(self, file, weights):
+        self.file = file
+        self.weights = dict(weights)  # column -> weight of a word found there
+        self.rows = []
+        self.postings = {}  # word -> {row number: weighted count}
+        self.words = []  # Sorted vocabulary for prefix and fuzzy matching
+        self.signature = None
+        self.loaded = False
+
+    @classmethod
+    def for_file(cls, file, weights):
+        key = (os.path.abspath(file), tuple(sorted(weights.items())))
+        index = cls._instances.get(key)
+        if index is None:
+            index = cls._instances[key] = cls(file, weights)
+        index.refresh()
+        return index
+
+    def refresh(self):
+        signature = check_my_grade.Base.source_signature(self.file)
+        if self.loaded and signature == self.signature:
+            return
+        self.rows = [row for row in check_my_grade.Base.read_csv(self.file)[1:] if row]
+        self.postings = {}
+        for number, row in enumerate(self.rows):
+            for column, weight in self.weights.items():
+                for word in tokens(row[column]) if column < len(row) else ():
+                    counts = self.postings.setdefault(word, {})
+                    counts[number] = counts.get(number, 0) + weight
+        self.words = sorted(self.postings)
+        self.signature = signature
+        self.loaded = True
+
+    def _matches(self, word, fuzzy):
+        """Returns [(vocabulary word, match weight)] for a query word"""
+        start, end = _prefix_range(self.words, word)
+        matches = [(self.words[i], 1.0 if self.words[i] == word else 0.5) for i in range(start, end)]
+        if fuzzy and not matches:
+            matches = [(match, 0.25) for match in difflib.get_close_matches(word, self.words, FUZZY_MATCHES, FUZZY_CUTOFF)]
+        return matches
+
+    def search(self, query, limit=SEARCH_LIMIT, fuzzy=False):
+        """Returns up to limit rows matching words of query, best first"""
+        hits, scores = {}, {}  # row number -> query words matched, tf-idf score
+        for word in dict.fromkeys(tokens(query)):
+            matched = set()
+            for term, weight in self._matches(word, fuzzy):
+                rows = self.postings[term]
+                idf = math.log(1 + len(self.rows) / len(rows))
+                for number, count in rows.items():
+                    scores[number] = scores.get(number, 0.0) + weight * count * idf
+                    matched.add(number)
+            for number in matched:
+                hits[number] = hits.get(number, 0) + 1
+        ranked = sorted(hits, key=lambda number: (-hits[number], -scores[number], number))
+        return [list(self.rows[number]) for number in ranked[:limit]]
+
+
+COURSE_WEIGHTS = {0: 3, 1: 2, 2: 1}  # course_id, course_name, description
+PROFESSOR_WEIGHTS = {0: 3, 1: 2, 2: 1, 3: 1}  # email, name, rank, course_id
+
+
+def search_courses(query, limit=SEARCH_LIMIT, fuzzy=False):
+    """Returns courses.csv rows whose id, name or description match query, best first"""
+    return TextIndex.for_file(check_my_grade.COURSE_FILE, COURSE_WEIGHTS).search(query, limit, fuzzy)
+
+
+def search_professors(query, limit=SEARCH_LIMIT, fuzzy=False):
+    """Returns professors.csv rows whose email, name, rank or course match query, best first"""
+    return TextIndex.for_file(check_my_grade.PROFESSOR_FILE, PROFESSOR_WEIGHTS).search(query, limit, fuzzy)
+
+
+def search(query, limit=SEARCH_LIMIT, fuzzy=False):
+    """Searches students, courses and professors at once"""
+    return {
+        "students": search_students(query, limit, fuzzy),
+        "courses": search_courses(query, limit, fuzzy),
+        "professors": search_professors(query, limit, fuzzy),
+    }
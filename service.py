@@ -0,0 +1,537 @@
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import re
+import statistics
+import time
+from collections import deque
+from http import HTTPStatus
+from urllib.parse import parse_qsl, unquote, urlsplit
+import check_my_grade
+import curves
+import instrumentation
+import search
+
+LATENCY_SAMPLES = 1000  # Recent request durations kept per route for the percentiles
+MAX_BODY_BYTES = 1 << 20
+PASSWORD_WORKERS = 4  # Threads verifying bcrypt passwords; bcrypt releases the GIL
+
+# Who may call a route when login is required: PUBLIC needs no session, SIGNED_IN any session,
+# otherwise one of the listed roles, or "self" for the student named in the path
+PUBLIC = None
+SIGNED_IN = frozenset(["admin", "professor", "student"])
+STAFF = frozenset(["admin", "professor"])
+ADMIN = frozenset(["admin"])
+STAFF_OR_SELF = STAFF | {"self"}
+
+
+class HTTPError(Exception):
+    """Ends a request with an HTTP status and a JSON error message"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class RouteMetrics:
+    """Request count, error count and recent latencies for one route"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def add(self, seconds, status):
+        self.count += 1
+        if status >= 400:
+            self.errors += 1
+        self.latencies.append(seconds)
+
+    def summary(self):
+        samples = sorted(self.latencies)
+        if not samples:
+            return {"count": self.count, "errors": self.errors}
+
+        def percentile(fraction):
+            return samples[min(len(samples) - 1, round(fraction * (len(samples) - 1)))]
+
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": statistics.fmean(samples) * 1000,
+            "p50_ms": percentile(0.5) * 1000,
+            "p95_ms": percentile(0.95) * 1000,
+            "p99_ms": percentile(0.99) * 1000,
+            "max_ms": samples[-1] * 1000,
+        }
+
+
+class CheckMyGradeService:
+    """Serves CheckMyGrade operations as JSON over HTTP from one long-running process.
+
+    The data stays loaded in the shared repositories between requests. Data
+    operations run one at a time on a single worker thread, so the event loop
+    never blocks on file I/O and the in-memory indexes are never read while
+    being changed. Password checks run on their own thread pool.
+    """
+
+    def __init__(self, require_login=True, password_workers=PASSWORD_WORKERS):
+        self.require_login = require_login
+        self.data_executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="checkmygrade-data")
+        self.password_executor = concurrent.futures.ThreadPoolExecutor(password_workers, thread_name_prefix="checkmygrade-login")
+        self.metrics = {}  # "METHOD /route" -> RouteMetrics
+        self.started = time.time()
+        self.server = None
+        self.routes = [
+            ("GET", "/students", self.list_students, STAFF),
+            ("POST", "/students", self.add_student, STAFF),
+            ("POST", "/students/bulk", self.bulk_upsert, STAFF),
+            ("GET", "/students/{email}", self.get_student, STAFF_OR_SELF),
+            ("PATCH", "/students/{email}", self.update_student, STAFF),
+            ("DELETE", "/students/{email}", self.delete_student, STAFF),
+            ("GET", "/students/{email}/enrollments", self.student_enrollments, STAFF_OR_SELF),
+            ("POST", "/students/{email}/enrollments", self.enroll, STAFF),
+            ("DELETE", "/students/{email}/enrollments/{course_id}", self.drop_enrollment, STAFF),
+            ("GET", "/courses", self.list_courses, SIGNED_IN),
+            ("POST", "/courses", self.add_course, ADMIN),
+            ("DELETE", "/courses/{course_id}", self.delete_course, ADMIN),
+            ("GET", "/courses/{course_id}/students", self.course_enrollments, STAFF),
+            ("POST", "/courses/{course_id}/curve", self.curve_course, STAFF),
+            ("GET", "/professors", self.list_professors, SIGNED_IN),
+            ("POST", "/professors", self.add_professor, ADMIN),
+            ("PATCH", "/professors/{email}", self.modify_professor, ADMIN),
+            ("DELETE", "/professors/{email}", self.delete_professor, ADMIN),
+            ("GET", "/professors/{email}/students", self.professor_enrollments, STAFF),
+            ("GET", "/statistics", self.statistics, SIGNED_IN),
+            ("GET", "/integrity", self.integrity, STAFF),
+            ("GET", "/search", self.search, STAFF),
+            ("POST", "/reports", self.reports, STAFF),
+            ("POST", "/login", self.login, PUBLIC),
+            ("POST", "/logout", self.logout, PUBLIC),
+            ("GET", "/metrics", self.metrics_summary, ADMIN),
+        ]
+        # "/students/{email}" matches one path segment, passed to the handler as params["email"]
+        self.routes = [
+            (method, re.compile(re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", route) + r"/?\Z"), route, handler, roles)
+            for method, route, handler, roles in self.routes
+        ]
+
+    async def run(self, function, *args, **kwargs):
+        """Runs a data operation on the data worker thread"""
+        return await asyncio.get_running_loop().run_in_executor(self.data_executor, lambda: function(*args, **kwargs))
+
+    async def start(self, host="127.0.0.1", port=8000):
+        """Loads the data and starts listening; returns the asyncio server"""
+        await self.run(check_my_grade.Student.repository)  # Warm the indexes before the first request
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.data_executor.shutdown()
+        self.password_executor.shutdown()
+
+    # HTTP
+
+    async def handle_connection(self, reader, writer):
+        """Serves requests on one connection until the client closes it"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY_BYTES:
+                    await self.respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "Request body too large"}, 0.0, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version.strip() == "HTTP/1.1"
+                start = time.perf_counter()
+                status, payload, route = await self.dispatch(method, target, headers, body)
+                elapsed = time.perf_counter() - start
+                self.metrics.setdefault(route, RouteMetrics()).add(elapsed, status)
+                await self.respond(writer, status, payload, elapsed, close=not keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target, headers, body):
+        """Routes a request, returning (status, payload, route name)"""
+        url = urlsplit(target)
+        path = unquote(url.path)
+        allowed = False
+        for route_method, pattern, name, handler, roles in self.routes:
+            match = pattern.match(path)
+            if match is None:
+                continue
+            allowed = True
+            if route_method != method:
+                continue
+            route = f"{method} {name}"
+            try:
+                if self.require_login and roles is not PUBLIC:
+                    await self.authorize(headers, roles, match.groupdict())
+                request = {
+                    "params": match.groupdict(),
+                    "query": dict(parse_qsl(url.query)),
+                    "json": self.body_json(body),
+                    "headers": headers,
+                }
+                result = await handler(request)
+                status, payload = result if isinstance(result, tuple) else (HTTPStatus.OK, result)
+                return status, payload, route
+            except HTTPError as error:
+                return error.status, {"error": error.message}, route
+            except (check_my_grade.StaleDataError, check_my_grade.IntegrityError) as error:
+                return HTTPStatus.CONFLICT, {"error": str(error)}, route
+            except Exception as error:
+                return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": repr(error)}, route
+        if allowed:
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": f"{method} not allowed on {path}"}, f"{method} (not allowed)"
+        return HTTPStatus.NOT_FOUND, {"error": f"No route for {path}"}, f"{method} (not found)"
+
+    @staticmethod
+    async def respond(writer, status, payload, elapsed, close=False):
+        status = HTTPStatus(status)
+        if isinstance(payload, str):
+            data, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            data, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Server-Timing: app;dur={elapsed * 1000:.3f}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + data)
+        await writer.drain()
+
+    async def authorize(self, headers, roles, params):
+        """Raises 401 without a live session and 403 when its role may not call the route"""
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        session = await self.run(check_my_grade.Login.validate_session, token) if scheme.lower() == "bearer" else None
+        if session is None:
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, "A valid session token is required")
+        email, role = session
+        if role not in roles and not ("self" in roles and params.get("email", "").lower() == email.lower()):
+            raise HTTPError(HTTPStatus.FORBIDDEN, f"A {role} session may not do this")
+
+    @staticmethod
+    def body_json(body):
+        """Parses a request body, raising a 400 unless it is a JSON object"""
+        if not body:
+            return {}
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "The body is not valid JSON") from None
+        if not isinstance(data, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "The body must be a JSON object")
+        return data
+
+    @staticmethod
+    def integer(value, name, minimum=None):
+        """Returns a request value as an int, raising a 400 if it is not one"""
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"{name} must be an integer") from None
+        if minimum is not None and number < minimum:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"{name} must be at least {minimum}")
+        return number
+
+    @staticmethod
+    def text(value, name):
+        """Returns a request value that must be a string, raising a 400 otherwise"""
+        if not isinstance(value, str):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"{name} must be a string")
+        return value
+
+    @staticmethod
+    def columns(names):
+        """Checks student column names from a request, raising a 400 for unknown ones"""
+        unknown = [name for name in names if name not in check_my_grade.STUDENT_COLUMNS]
+        if unknown:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Unknown student columns: {', '.join(unknown)}")
+
+    def student_row(self, data):
+        """Returns a students.csv row from a JSON student, raising a 400 if a field is missing or the marks are not an integer"""
+        if not isinstance(data, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Each student must be a JSON object")
+        row = self.fields({"json": data}, *check_my_grade.STUDENT_HEADER)
+        row[check_my_grade.MARKS_COLUMN] = self.integer(row[check_my_grade.MARKS_COLUMN], "marks")
+        return [str(value) for value in row]
+
+    @staticmethod
+    def on_delete(query, key):
+        """Returns the on_delete and reassign_to query options, raising a 400 if they do not go together"""
+        on_delete, reassign_to = query.get("on_delete", "restrict"), query.get("reassign_to")
+        try:
+            check_my_grade._check_on_delete(on_delete, reassign_to, key)
+        except ValueError as error:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(error)) from None
+        return on_delete, reassign_to
+
+    @staticmethod
+    def fields(request, *names):
+        """Returns required JSON body fields, raising a 400 if any is missing"""
+        data = request["json"]
+        missing = [name for name in names if name not in data]
+        if missing:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Missing fields: {', '.join(missing)}")
+        return [data[name] for name in names]
+
+    @staticmethod
+    def student_json(row):
+        return dict(zip(check_my_grade.STUDENT_HEADER, row))
+
+    @staticmethod
+    def enrollment_json(rows):
+        return [dict(zip(check_my_grade.ENROLLMENT_HEADER, row)) for row in rows]
+
+    # Students
+
+    async def list_students(self, request):
+        """Sorted, filtered and paginated students, e.g. /students?sort_by=-marks,email&limit=20&course_id=CS101"""
+        query = dict(request["query"])
+        sort_by = [(key[1:], False) if key.startswith("-") else key for key in query.pop("sort_by", "").split(",") if key]
+        ascending = query.pop("ascending", "true").lower() != "false"
+        limit = self.integer(query.pop("limit"), "limit", 0) if "limit" in query else None
+        offset = self.integer(query.pop("offset", 0), "offset", 0)
+        self.columns([key[0] if isinstance(key, tuple) else key for key in sort_by] + list(query))
+        rows = await self.run(check_my_grade.Student.query, sort_by or None, ascending, limit, offset, **query)
+        return {"students": [self.student_json(row) for row in rows]}
+
+    async def get_student(self, request):
+        row = await self.run(check_my_grade.Student.search_student, request["params"]["email"])
+        if row is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Student not found")
+        return self.student_json(row)
+
+    async def add_student(self, request):
+        values = self.student_row(request["json"])
+        await self.run(check_my_grade.Student(*values).save)
+        return HTTPStatus.CREATED, self.student_json(await self.run(check_my_grade.Student.search_student, values[0]))
+
+    async def bulk_upsert(self, request):
+        """Upserts {"students": [{...}, ...]} in one write"""
+        students = request["json"].get("students", [])
+        if not isinstance(students, list):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "students must be a list")
+        records = [self.student_row(student) for student in students]
+        results = await self.run(check_my_grade.Student.bulk_upsert, records)
+        return {"results": [{"email": email, "status": status} for email, status in results]}
+
+    async def update_student(self, request):
+        """Changes course_id, grade or marks; an expected object makes the update fail with 409 if the student changed"""
+        email, data = request["params"]["email"], request["json"]
+        expected = data.get("expected")
+        expected_row = self.student_row(expected) if expected else None
+        for name in ("course_id", "grade"):
+            if data.get(name) is not None:
+                self.text(data[name], name)
+        if data.get("marks") is not None:
+            self.integer(data["marks"], "marks")
+
+        def update():
+            if check_my_grade.Student.search_student(email) is None:
+                return None
+            check_my_grade.Student.update_student(email, data.get("course_id"), data.get("grade"), data.get("marks"), expected_row=expected_row)
+            return check_my_grade.Student.search_student(email)
+
+        row = await self.run(update)
+        if row is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Student not found")
+        return self.student_json(row)
+
+    async def delete_student(self, request):
+        email = request["params"]["email"]
+
+        def delete():
+            if check_my_grade.Student.search_student(email) is None:
+                return False
+            check_my_grade.Student.delete_student(email)
+            return True
+
+        if not await self.run(delete):
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Student not found")
+        return {"deleted": email}
+
+    async def student_enrollments(self, request):
+        return {"enrollments": self.enrollment_json(await self.run(check_my_grade.Student.student_enrollments, request["params"]["email"]))}
+
+    async def enroll(self, request):
+        course_id, grade, marks = self.fields(request, "course_id", "grade", "marks")
+        course_id, grade, marks = self.text(course_id, "course_id"), self.text(grade, "grade"), self.integer(marks, "marks")
+        if not await self.run(check_my_grade.Student.enroll, request["params"]["email"], course_id, grade, marks):
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Student not found")
+        return HTTPStatus.CREATED, await self.student_enrollments(request)
+
+    async def drop_enrollment(self, request):
+        if not await self.run(check_my_grade.Student.drop_enrollment, request["params"]["email"], request["params"]["course_id"]):
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Enrollment not found")
+        return await self.student_enrollments(request)
+
+    # Courses and professors
+
+    async def list_courses(self, request):
+        rows = await self.run(check_my_grade.Base.read_csv, check_my_grade.COURSE_FILE)
+        return {"courses": [dict(zip(rows[0], row)) for row in rows[1:] if row]}
+
+    async def add_course(self, request):
+        await self.run(check_my_grade.Course.add_course, *self.fields(request, "course_id", "course_name", "description"))
+        return HTTPStatus.CREATED, request["json"]
+
+    async def delete_course(self, request):
+        """?on_delete=cascade or ?on_delete=reassign&reassign_to=ID for a course that is still referenced"""
+        on_delete, reassign_to = self.on_delete(request["query"], request["params"]["course_id"])
+        references = await self.run(check_my_grade.Course.delete_course, request["params"]["course_id"], on_delete, reassign_to)
+        if references is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Course not found")
+        return {"deleted": request["params"]["course_id"], "references": references}
+
+    async def course_enrollments(self, request):
+        return {"enrollments": self.enrollment_json(await self.run(check_my_grade.Student.course_enrollments, request["params"]["course_id"]))}
+
+    async def curve_course(self, request):
+        """Previews a curve, e.g. {"method": "shift", "points": 5}; "dry_run": false writes it"""
+        options = dict(request["json"])
+        method, cutoffs, dry_run = options.pop("method", None), options.pop("cutoffs", None), options.pop("dry_run", True)
+        try:
+            curves.curve([], method, cutoffs, **options)  # Checks the method, options and cutoffs on no marks
+        except (ValueError, TypeError, AttributeError) as error:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Invalid curve: {error}") from None
+        summary = await self.run(curves.curve_course, request["params"]["course_id"], method, cutoffs, bool(dry_run), **options)
+        if summary is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Course not found")
+        return summary
+
+    async def list_professors(self, request):
+        rows = await self.run(check_my_grade.Base.read_csv, check_my_grade.PROFESSOR_FILE)
+        return {"professors": [dict(zip(rows[0], row)) for row in rows[1:] if row]}
+
+    async def add_professor(self, request):
+        await self.run(check_my_grade.Professor.add_professor, *self.fields(request, "email", "name", "rank", "course_id"))
+        return HTTPStatus.CREATED, request["json"]
+
+    async def modify_professor(self, request):
+        (rank,) = self.fields(request, "rank")
+        await self.run(check_my_grade.Professor.modify_professor, request["params"]["email"], rank)
+        return {"email": request["params"]["email"], "rank": rank}
+
+    async def delete_professor(self, request):
+        """?on_delete=cascade or ?on_delete=reassign&reassign_to=EMAIL for a professor who still has students"""
+        on_delete, reassign_to = self.on_delete(request["query"], request["params"]["email"])
+        references = await self.run(check_my_grade.Professor.delete_professor, request["params"]["email"], on_delete, reassign_to)
+        if references is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Professor not found")
+        return {"deleted": request["params"]["email"], "references": references}
+
+    async def professor_enrollments(self, request):
+        return {"enrollments": self.enrollment_json(await self.run(check_my_grade.Student.professor_enrollments, request["params"]["email"]))}
+
+    # Reports, statistics and sessions
+
+    async def search(self, request):
+        """Ranked name, course and professor matches, e.g. /search?q=smi&limit=10&fuzzy=true"""
+        query = request["query"]
+        limit = self.integer(query.get("limit", search.SEARCH_LIMIT), "limit", 0)
+        results = await self.run(search.search, query.get("q", ""), limit, query.get("fuzzy", "false").lower() == "true")
+        return {
+            "students": [self.student_json(row) for row in results["students"]],
+            "courses": [dict(zip(check_my_grade.COURSE_HEADER, row)) for row in results["courses"]],
+            "professors": [dict(zip(check_my_grade.PROFESSOR_HEADER, row)) for row in results["professors"]],
+        }
+
+    async def integrity(self, request):
+        problems = await self.run(check_my_grade.check_integrity)
+        return {"problems": [{"table": table, "key": key, "problem": problem} for table, key, problem in problems]}
+
+    async def statistics(self, request):
+        recompute = request["query"].get("recompute", "false").lower() == "true"
+        stats = await self.run(check_my_grade.Student.course_statistics, recompute)
+        return {"courses": json.loads(stats.to_json(orient="index"))}
+
+    async def reports(self, request):
+        paths = await self.run(check_my_grade.Student.generate_grade_report)
+        return dict(zip(["students", "courses", "professors"], paths))
+
+    async def login(self, request):
+        email, password = (self.text(value, name) for value, name in zip(self.fields(request, "email", "password"), ("email", "password")))
+        service = await self.run(check_my_grade.Login.service)
+        loop = asyncio.get_running_loop()
+        token = await loop.run_in_executor(self.password_executor, service.authenticate, email, password)
+        if token is None:
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, "Invalid credentials or account locked")
+        return {"token": token}
+
+    async def logout(self, request):
+        (token,) = self.fields(request, "token")
+        await self.run(check_my_grade.Login.logout, token)
+        return {"logged_out": True}
+
+    async def metrics_summary(self, request):
+        """Route latencies, plus per-method metrics when instrumentation is on; ?format=prometheus for text"""
+        if request["query"].get("format") == "prometheus":
+            return instrumentation.to_prometheus()
+        summary = {
+            "uptime_seconds": time.time() - self.started,
+            "routes": {route: metrics.summary() for route, metrics in sorted(self.metrics.items())},
+        }
+        if instrumentation.enabled():
+            summary["operations"] = instrumentation.metrics()
+        return summary
+
+
+async def serve(host, port, require_login=True):
+    service = CheckMyGradeService(require_login)
+    server = await service.start(host, port)
+    print(f"CheckMyGrade service listening on http://{host}:{server.sockets[0].getsockname()[1]}")
+    try:
+        await server.serve_forever()
+    finally:
+        await service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve CheckMyGrade operations as JSON over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--storage", choices=["csv", "sqlite"], default="csv", help="storage backend")
+    parser.add_argument("--no-auth", action="store_true", help="serve every route without a session token; for local use only")
+    parser.add_argument("--instrument", choices=["on", "profile"], help="record per-method metrics (profile also runs cProfile); defaults to $CHECKMYGRADE_INSTRUMENT")
+    parser.add_argument("--profile-output", default="checkmygrade.prof", help="where profile mode writes the cProfile data on exit")
+    args = parser.parse_args()
+
+    if args.instrument:
+        instrumentation.enable(profile=args.instrument == "profile")
+    else:
+        instrumentation.enable_from_environment()
+
+    if args.storage != "csv":
+        check_my_grade.Base.set_storage_backend(args.storage)
+    try:
+        asyncio.run(serve(args.host, args.port, not args.no_auth))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if instrumentation.profile_stats() is not None:
+            instrumentation.dump_profile(args.profile_output)
@@ -1,6 +1,36 @@
+import asyncio
+import http.client
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
+import threading
 import time
+import numpy
 import check_my_grade  # Import the main application module
+import curves
+import instrumentation
+import pipeline
+import search
+import service
+
+def _increment_marks(student_file, course_file, professor_file, login_file, email, times):
+    """Worker for the concurrency test: adds one mark at a time, retrying when another process got there first"""
+    check_my_grade.Base.set_file_paths(student_file, course_file, professor_file, login_file)
+    check_my_grade.JOURNAL_COMPACT_ENTRIES = 10  # Mix journal appends with compactions
+    for _ in range(times):
+        while True:
+            row = check_my_grade.Student.search_student(email)
+            try:
+                check_my_grade.Student.update_student(email, new_marks=int(row[6]) + 1, expected_row=row)
+                break
+            except check_my_grade.StaleDataError:
+                continue
+
 
 class TestCheckMyGrade(unittest.TestCase):
 
@@ -137,6 +167,37 @@ class TestCheckMyGrade(unittest.TestCase):
         self.assertEqual(plain_text_password, decrypted_password)
         print("Password encryption and decryption successful.")
 
+    def test_batch_password_hashing(self):
+        """Test parallel password hashing and verification."""
+        print("\n--- Test: Batch Password Hashing ---")
+
+        security = check_my_grade.TextSecurity(4, rounds=4, workers=2)
+        passwords = [f"StudentPass{i}" for i in range(6)]
+
+        start_time = time.time()
+        hashed_passwords = security.hash_passwords(passwords)
+        end_time = time.time()
+
+        self.assertEqual(len(hashed_passwords), len(passwords))
+        self.assertTrue(all(hashed.startswith("$2b$04$") for hashed in hashed_passwords))
+        self.assertEqual(security.verify_passwords(zip(passwords, hashed_passwords)), [True] * len(passwords))
+        self.assertEqual(security.verify_passwords([("wrong", hashed_passwords[0])]), [False])
+        print(f"Batch Hashing Execution Time: {end_time - start_time:.6f} seconds")
+
+    def test_batch_encryption(self):
+        """Test table-driven batch encryption against known cipher output."""
+        print("\n--- Test: Batch Encryption ---")
+
+        texts = ["SecureMessage123!", "student0@university.edu", "Éa٣", ""]
+        expected = ["WigyviQiwweki567!", "wxyhirx4@yrmzivwmxc.ihy", "Ke1", ""]
+
+        self.assertEqual([check_my_grade.cipher.encrypt(text) for text in texts], expected)
+        self.assertEqual(check_my_grade.cipher.encrypt_many(texts), expected)
+        self.assertEqual(check_my_grade.cipher.decrypt_many(expected[:2]), texts[:2])
+
+        rows = check_my_grade.cipher.encrypt_column([["email", "role"], ["admin@university.edu", "admin"]], 0)
+        self.assertEqual(rows, [["email", "role"], ["ehqmr@yrmzivwmxc.ihy", "admin"]])
+
     def test_csv_integrity(self):
         """Test CSV file integrity after multiple modifications."""
         print("\n--- Test: CSV File Integrity ---")
@@ -151,5 +212,874 @@ class TestCheckMyGrade(unittest.TestCase):
 
         print("CSV file integrity verified.")
 
+
+class TestStudentRepository(unittest.TestCase):
+    """Tests that run against a small throwaway copy of the data files"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.student_file = os.path.join(self.tmp_dir, "students.csv")
+        self.course_file = os.path.join(self.tmp_dir, "courses.csv")
+        self.professor_file = os.path.join(self.tmp_dir, "professors.csv")
+        self.login_file = os.path.join(self.tmp_dir, "login.csv")
+
+        check_my_grade.Base.write_csv(self.student_file, [
+            check_my_grade.STUDENT_HEADER,
+            ["a@example.com", "Ann", "Lee", "CS101", "prof1@example.com", "A", "95"],
+            ["b@example.com", "Bob", "Kim", "CS101", "prof1@example.com", "C", "72"],
+            ["c@example.com", "Cal", "Ray", "MATH101", "prof2@example.com", "B", "85"],
+        ])
+        check_my_grade.Base.write_csv(self.course_file, [
+            ["course_id", "course_name", "description"],
+            ["CS101", "Programming", "Introduces Python programming and basic algorithms"],
+            ["MATH101", "Calculus I", "Covers differentiation and integration principles"],
+        ])
+        check_my_grade.Base.write_csv(self.professor_file, [
+            ["email", "name", "rank", "course_id"],
+            ["prof1@example.com", "Dr. John Smith", "Senior", "CS101"],
+            ["prof2@example.com", "Dr. Alice Green", "Assistant", "MATH101"],
+        ])
+        check_my_grade.Base.set_file_paths(
+            self.student_file, self.course_file, self.professor_file, self.login_file,
+            report_file=os.path.join(self.tmp_dir, "grade_reports.csv"),
+            course_report_file=os.path.join(self.tmp_dir, "course_reports.csv"),
+            professor_report_file=os.path.join(self.tmp_dir, "professor_reports.csv"),
+        )
+
+    def tearDown(self):
+        check_my_grade.Base.set_file_paths("students.csv", "courses.csv", "professors.csv", "login.csv")
+        shutil.rmtree(self.tmp_dir)
+
+    def test_indexed_lookups(self):
+        """Test email, course and professor lookups served from the in-memory indexes."""
+        repo = check_my_grade.Student.repository()
+
+        self.assertEqual(repo.get("b@example.com")[1], "Bob")
+        self.assertEqual(sorted(row[0] for row in repo.course_rows("CS101")), ["a@example.com", "b@example.com"])
+        self.assertEqual([row[0] for row in repo.professor_rows("prof2@example.com")], ["c@example.com"])
+
+        check_my_grade.Student.update_student("b@example.com", new_course="MATH101")
+        self.assertEqual([row[0] for row in repo.course_rows("CS101")], ["a@example.com"])
+
+    def test_reload_when_file_changes(self):
+        """Test that the repository is reused until the file on disk changes."""
+        repo = check_my_grade.Student.repository()
+        self.assertIs(repo, check_my_grade.Student.repository())
+
+        rows = check_my_grade.Base.read_csv(self.student_file)
+        rows.append(["d@example.com", "Dee", "Fox", "CS101", "prof1@example.com", "D", "64"])
+        check_my_grade.Base.write_csv(self.student_file, rows)
+
+        self.assertIsNotNone(check_my_grade.Student.search_student("d@example.com"))
+
+    def test_journal_replay_and_compaction(self):
+        """Test that mutations go to the journal, survive a reload and are folded in by compaction."""
+        check_my_grade.Student.update_student("a@example.com", new_marks="91")
+        check_my_grade.Student.delete_student("c@example.com")
+        check_my_grade.Student("d@example.com", "Dee", "Fox", "CS101", "prof1@example.com", "D", 64).save()
+
+        self.assertEqual(check_my_grade.Base.read_csv(self.student_file)[1][6], "95", "CSV was rewritten for a single update.")
+        self.assertTrue(os.path.exists(self.student_file + check_my_grade.JOURNAL_SUFFIX))
+
+        fresh = check_my_grade.StudentRepository(self.student_file)
+        fresh.load()
+        self.assertEqual([row[0] for row in fresh.all_rows()], ["a@example.com", "b@example.com", "d@example.com"])
+        self.assertEqual(fresh.get("a@example.com")[6], "91")
+
+        check_my_grade.Student.compact()
+        self.assertFalse(os.path.exists(self.student_file + check_my_grade.JOURNAL_SUFFIX))
+        rows = check_my_grade.Base.read_csv(self.student_file)
+        self.assertEqual([row[0] for row in rows[1:]], ["a@example.com", "b@example.com", "d@example.com"])
+        self.assertEqual(rows[1][6], "91")
+
+    def test_torn_journal_entry_is_skipped(self):
+        """Test that a half-written journal line from a crash is ignored and not glued to the next entry."""
+        with open(self.student_file + check_my_grade.JOURNAL_SUFFIX, "w", newline="") as f:
+            f.write("put,a@example.com,Ann,Lee,CS1")
+
+        check_my_grade.Student.update_student("b@example.com", new_grade="B", new_marks="81")
+        fresh = check_my_grade.StudentRepository(self.student_file)
+        fresh.load()
+
+        self.assertEqual(fresh.get("a@example.com")[3], "CS101")
+        self.assertEqual(fresh.get("b@example.com")[5:], ["B", "81"])
+
+    def test_bulk_mutations(self):
+        """Test batch upsert, mark updates and deletes with their per-row results."""
+        Student = check_my_grade.Student
+
+        results = Student.bulk_upsert([
+            Student("d@example.com", "Dee", "Fox", "CS101", "prof1@example.com", "D", 64),
+            ["a@example.com", "Ann", "Lee", "CS101", "prof1@example.com", "A", 97],
+        ])
+        self.assertEqual(results, [("d@example.com", "inserted"), ("a@example.com", "updated")])
+
+        results = Student.bulk_update_marks([("b@example.com", 75), ("c@example.com", {"new_grade": "A", "new_marks": 92}), ("x@example.com", 50)])
+        self.assertEqual(results, [("b@example.com", "updated"), ("c@example.com", "updated"), ("x@example.com", "not found")])
+
+        results = Student.bulk_delete(["d@example.com", "x@example.com"])
+        self.assertEqual(results, [("d@example.com", "deleted"), ("x@example.com", "not found")])
+
+        fresh = check_my_grade.StudentRepository(self.student_file)
+        fresh.load()
+        self.assertEqual([row[6] for row in fresh.all_rows()], ["97", "75", "92"])
+        self.assertEqual(fresh.get("c@example.com")[5], "A")
+
+    def test_failed_batch_leaves_no_trace(self):
+        """Test that a batch with a bad row in the middle changes nothing, and that 0 marks are applied."""
+        Student = check_my_grade.Student
+        with self.assertRaises(ValueError):
+            Student.bulk_upsert([
+                ["d@example.com", "Dee", "Fox", "CS101", "prof1@example.com", "D", 64],
+                ["e@example.com", "Eve", "Moe", "CS101", "prof1@example.com", "A", "ninety"],
+                ["f@example.com", "Fay", "Orr", "CS101", "prof1@example.com", "B", 81],
+            ])
+        with self.assertRaises(ValueError):
+            Student.bulk_update_marks([("a@example.com", 60), ("b@example.com", "lots"), ("c@example.com", 61)])
+        self.assertIsNone(Student.search_student("d@example.com"))
+        self.assertEqual(Student.search_student("a@example.com")[6], "95")
+        Student.compact()
+        self.assertEqual([row[6] for row in check_my_grade.Base.read_csv(self.student_file)[1:]], ["95", "72", "85"])
+
+        self.assertEqual(Student.bulk_update_marks([("b@example.com", 0)]), [("b@example.com", "updated")])
+        self.assertEqual(Student.search_student("b@example.com")[6], "0")
+
+    def test_large_batch_is_written_once(self):
+        """Test that a batch past the compaction threshold goes straight into the CSV."""
+        changes = [("a@example.com", 60 + i % 40) for i in range(check_my_grade.JOURNAL_COMPACT_ENTRIES)]
+        check_my_grade.Student.bulk_update_marks(changes)
+
+        self.assertFalse(os.path.exists(self.student_file + check_my_grade.JOURNAL_SUFFIX))
+        self.assertEqual(check_my_grade.Base.read_csv(self.student_file)[1][6], str(changes[-1][1]))
+
+    def test_course_statistics(self):
+        """Test the vectorized per-course statistics against the statistics module."""
+        import statistics
+
+        check_my_grade.Student.bulk_upsert([
+            ["d@example.com", "Dee", "Fox", "CS101", "prof1@example.com", "C", "72"],
+            ["e@example.com", "Eve", "Ng", "CS101", "prof1@example.com", "F", "55"],
+        ])
+        stats = check_my_grade.Student.get_all_courses_statistics()
+        cs_marks = [95, 72, 72, 55]
+
+        self.assertEqual(stats.at["CS101", "count"], 4)
+        self.assertAlmostEqual(stats.at["CS101", "mean"], statistics.mean(cs_marks))
+        self.assertAlmostEqual(stats.at["CS101", "median"], statistics.median(cs_marks))
+        self.assertAlmostEqual(stats.at["CS101", "std"], statistics.stdev(cs_marks))
+        self.assertEqual(stats.at["CS101", "mode"], 72)
+        self.assertEqual((stats.at["CS101", "min"], stats.at["CS101", "max"]), (55, 95))
+        self.assertEqual(stats.loc["CS101", ["grade_A", "grade_C", "grade_F"]].tolist(), [1, 2, 1])
+        self.assertEqual(stats.at["MATH101", "p90"], 85)
+
+    def test_query_views_do_not_write(self):
+        """Test sorted, filtered and paginated queries, and that sorting only persists on request."""
+        Student = check_my_grade.Student
+        Student.bulk_upsert([["d@example.com", "Dee", "Fox", "CS101", "prof1@example.com", "A", "95"]])
+        Student.compact()
+        before = check_my_grade.Base.read_csv(self.student_file)
+
+        top = Student.query("marks", ascending=False, limit=2, course_id="CS101")
+        self.assertEqual([row[0] for row in top], ["a@example.com", "d@example.com"])
+        page = Student.query([("marks", False), ("email", False)], limit=2, offset=1)
+        self.assertEqual([row[0] for row in page], ["a@example.com", "c@example.com"])
+        self.assertEqual([row[0] for row in Student.query(grade="A")], ["a@example.com", "d@example.com"])
+
+        sorted_students = Student.sort_students_by_marks(ascending=True)
+        self.assertEqual([row[6] for row in sorted_students[1:]], ["72", "85", "95", "95"])
+        self.assertEqual(check_my_grade.Base.read_csv(self.student_file), before)
+
+        Student.sort_students_by_name(ascending=False, persist=True)
+        self.assertEqual([row[1] for row in check_my_grade.Base.read_csv(self.student_file)[1:]], ["Dee", "Cal", "Bob", "Ann"])
+
+    def test_streaming_reports(self):
+        """Test that one pass writes the student, course-wise and professor-wise reports."""
+        check_my_grade.Student.update_student("b@example.com", new_grade="B", new_marks="81")
+        journal = self.student_file + check_my_grade.JOURNAL_SUFFIX
+        self.assertTrue(os.path.exists(journal))
+        report_file, course_report_file, professor_report_file = check_my_grade.Student.generate_grade_report()
+        self.assertTrue(os.path.exists(journal), "Reports compacted the journal.")
+        self.assertEqual(check_my_grade.Base.read_csv(self.student_file)[2][6], "72", "Reports rewrote students.csv.")
+
+        students = check_my_grade.Base.read_csv(report_file)
+        self.assertEqual(students[0], ["First Name", "Last Name", "Course", "Grade", "Marks"])
+        self.assertEqual(students[2], ["Bob", "Kim", "CS101", "B", "81"])
+        self.assertEqual(len(students), 4)
+
+        courses = check_my_grade.Base.read_csv(course_report_file)
+        self.assertEqual(courses[1], ["CS101", "Programming", "2", "88.00", "81", "95", "1", "1", "0", "0", "0"])
+        professors = check_my_grade.Base.read_csv(professor_report_file)
+        self.assertEqual(professors[2][:6], ["prof2@example.com", "Dr. Alice Green", "Assistant", "MATH101", "1", "85.00"])
+
+    def test_login_sessions_and_rate_limit(self):
+        """Test session tokens, lockout after repeated failures and reload when login.csv changes."""
+        security = check_my_grade.TextSecurity(4, rounds=4)
+        check_my_grade.Base.write_csv(self.login_file, [
+            ["email", "password", "role"],
+            ["a@example.com", security.hash_password("StudentPass1234"), "student"],
+            ["prof1@example.com", security.hash_password("ProfPass1234"), "professor"],
+        ])
+        Login = check_my_grade.Login
+
+        token = Login.login("a@example.com", "StudentPass1234")
+        self.assertIsNotNone(token)
+        self.assertEqual(Login.validate_session(token), ("a@example.com", "student"))
+        Login.logout(token)
+        self.assertIsNone(Login.validate_session(token))
+
+        for _ in range(check_my_grade.LOGIN_MAX_FAILURES):
+            self.assertIsNone(Login.login("prof1@example.com", "wrong"))
+        self.assertIsNone(Login.login("prof1@example.com", "ProfPass1234"), "Locked account was allowed in.")
+
+        token = Login.login("a@example.com", "StudentPass1234")
+        check_my_grade.Base.write_csv(self.login_file, [
+            ["email", "password", "role"],
+            ["a@example.com", security.hash_password("NewPass5678"), "student"],
+        ])
+        self.assertIsNone(Login.validate_session(token), "Session survived a password change.")
+        self.assertIsNotNone(Login.login("a@example.com", "NewPass5678"))
+
+    def test_login_rate_limit_holds_under_load(self):
+        """Test that parallel guesses stay within the limit, failures are bounded and unknown emails still run bcrypt."""
+        security = check_my_grade.TextSecurity(4, rounds=4)
+        check_my_grade.Base.write_csv(self.login_file, [
+            ["email", "password", "role"],
+            ["prof1@example.com", security.hash_password("ProfPass1234"), "professor"],
+        ])
+        now = [1000.0]
+        logins = check_my_grade.LoginService(self.login_file, clock=lambda: now[0], max_failures=3)
+        checked = []
+        verify = check_my_grade.cipher.verify_password
+        check_my_grade.cipher.verify_password = lambda password, hashed: checked.append(hashed) or verify(password, hashed)
+        try:
+            start = threading.Barrier(20)
+
+            def guess():
+                start.wait()
+                logins.authenticate("prof1@example.com", "wrong")
+
+            threads = [threading.Thread(target=guess) for _ in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(checked), check_my_grade.LOGIN_MAX_FAILURES, "Parallel guesses ran past the limit.")
+            self.assertIsNone(logins.authenticate("prof1@example.com", "ProfPass1234"))
+
+            del checked[:]
+            for i in range(10):
+                self.assertIsNone(logins.authenticate(f"nobody{i}@example.com", "guess"))
+            self.assertEqual(len(checked), 10, "Unknown emails skipped bcrypt.")
+            self.assertTrue(all(hashed.startswith("$2b$04$") for hashed in checked))
+            self.assertEqual(list(logins.failures), [f"nobody{i}@example.com" for i in (7, 8, 9)])
+
+            now[0] += check_my_grade.LOGIN_FAILURE_WINDOW + 1
+            self.assertIsNotNone(logins.authenticate("prof1@example.com", "ProfPass1234"))
+            self.assertEqual(len(logins.failures), 0)
+        finally:
+            del check_my_grade.cipher.verify_password
+
+    def test_sqlite_backend(self):
+        """Test that the same operations run against the SQLite backend after importing the CSVs."""
+        Student = check_my_grade.Student
+        Student.update_student("a@example.com", new_marks="91")  # Still in the CSV journal when imported
+        database = os.path.join(self.tmp_dir, "checkmygrade.db")
+        check_my_grade.Base.set_storage_backend("sqlite", database=database, import_csv=True)
+        try:
+            self.assertEqual(Student.search_student("a@example.com"), ["a@example.com", "Ann", "Lee", "CS101", "prof1@example.com", "A", "91"])
+
+            Student("d@example.com", "Dee", "Fox", "CS101", "prof1@example.com", "D", 64).save()
+            Student.update_student("b@example.com", new_grade="B", new_marks="81")
+            Student.delete_student("c@example.com")
+            self.assertEqual(Student.bulk_update_marks([("d@example.com", 66), ("c@example.com", 70)]), [("d@example.com", "updated"), ("c@example.com", "not found")])
+
+            self.assertEqual([row[0] for row in Student.query("marks", ascending=False, course_id="CS101")], ["a@example.com", "b@example.com", "d@example.com"])
+            self.assertEqual([row[0] for row in Student.query("marks", ascending=False, limit=1, offset=1, course_id="CS101")], ["b@example.com"])
+            stats = Student.course_statistics()
+            self.assertEqual(stats.at["CS101", "count"], 3)
+            self.assertEqual(stats.at["MATH101", "count"], 0)
+
+            check_my_grade.Course.add_course("BIO101", "Biology", "Covers genetics")
+            self.assertEqual(check_my_grade.Course.read_csv(self.course_file)[-1][0], "BIO101")
+            self.assertEqual(len(check_my_grade.CSVStorage.read(self.course_file)), 3, "Course CSV was written instead of the table.")
+        finally:
+            check_my_grade.Base.set_storage_backend("csv")
+
+        check_my_grade.Base.set_storage_backend("sqlite", database=database)
+        try:
+            self.assertEqual(Student.search_student("d@example.com")[6], "66")
+        finally:
+            check_my_grade.Base.set_storage_backend("csv")
+
+    def test_seeded_data_and_benchmark(self):
+        """Test that generated data is reproducible and the benchmark reports every operation."""
+        import benchmark
+        import generate_data
+
+        first, second = os.path.join(self.tmp_dir, "first"), os.path.join(self.tmp_dir, "second")
+        generate_data.generate(50, seed=7, hash_passwords=False, out_dir=first)
+        generate_data.generate(50, seed=7, hash_passwords=False, out_dir=second)
+        self.assertEqual(check_my_grade.CSVStorage.read(os.path.join(first, "students.csv")), check_my_grade.CSVStorage.read(os.path.join(second, "students.csv")))
+        self.assertFalse(os.path.exists(os.path.join(first, "login.csv")))
+
+        results = benchmark.run(sizes=[50], repeat=2, seed=7)
+        operations = results["results"]["50"]
+        self.assertIn("statistics", operations)
+        self.assertTrue(all(result["runs"] == 2 and result["p95"] >= result["median"] for result in operations.values()))
+        lines, regressed = benchmark.compare(results, results)
+        self.assertFalse(regressed)
+
+    def test_multiple_enrollments(self):
+        """Test that a student can hold several courses, looked up by student, course and professor."""
+        Student = check_my_grade.Student
+        Student("a@example.com", "Ann", "Lee", "MATH101", "prof2@example.com", "B", 88).save()
+        self.assertTrue(Student.enroll("b@example.com", "MATH101", "C", 75))
+        self.assertFalse(Student.enroll("x@example.com", "MATH101", "C", 75))
+        Student.enroll("b@example.com", "CS101", "B", 80)  # Primary course goes to students.csv
+
+        self.assertEqual(Student.student_enrollments("a@example.com"), [["a@example.com", "CS101", "A", "95"], ["a@example.com", "MATH101", "B", "88"]])
+        self.assertEqual(Student.search_student("b@example.com")[5:], ["B", "80"])
+        self.assertEqual(sorted(row[0] for row in Student.course_enrollments("MATH101")), ["a@example.com", "b@example.com", "c@example.com"])
+        self.assertEqual(sorted(row[0] for row in Student.professor_enrollments("prof2@example.com")), ["a@example.com", "b@example.com", "c@example.com"])
+        self.assertEqual(Student.course_statistics().at["MATH101", "count"], 3)
+
+        fresh = check_my_grade.EnrollmentRepository(check_my_grade.ENROLLMENT_FILE)
+        fresh.refresh()
+        self.assertEqual(len(fresh), 2)
+
+        self.assertTrue(Student.drop_enrollment("b@example.com", "MATH101"))
+        Student.delete_student("a@example.com")
+        self.assertEqual(Student.course_enrollments("MATH101"), [["c@example.com", "MATH101", "B", "85"]])
+        self.assertEqual(check_my_grade.Base.read_csv(check_my_grade.ENROLLMENT_FILE), [check_my_grade.ENROLLMENT_HEADER])
+
+    def test_maintained_course_statistics(self):
+        """Test that statistics kept up to date by each mutation match a full recompute and are saved."""
+        Student = check_my_grade.Student
+        Student("d@example.com", "Dee", "Fox", "CS101", "prof1@example.com", "C", 72).save()
+        Student.update_student("a@example.com", new_grade="B", new_marks="88")
+        Student.update_student("c@example.com", new_course="CS101")
+        Student.enroll("b@example.com", "MATH101", "F", 55)
+        Student.delete_student("d@example.com")
+
+        stats = Student.course_statistics()
+        self.assertEqual(stats.at["CS101", "count"], 3)
+        self.assertEqual(stats.at["MATH101", "count"], 1)
+        self.assertEqual(stats.at["CS101", "median"], 85)
+        self.assertTrue(Student.verify_course_statistics())
+
+        Student.compact()
+        signature = check_my_grade.Base.file_signature(self.student_file)
+        saved = check_my_grade.CourseAggregates.read(self.student_file + check_my_grade.AGGREGATES_SUFFIX, signature)
+        self.assertIsNotNone(saved)
+        self.assertEqual(saved.courses, Student.repository().course_aggregates().courses)
+
+    def test_concurrent_updates_are_not_lost(self):
+        """Test that processes updating the same student through the lock never lose an update."""
+        Student = check_my_grade.Student
+        Student.update_student("b@example.com", new_marks=1)
+
+        paths = (self.student_file, self.course_file, self.professor_file, self.login_file)
+        context = multiprocessing.get_context("spawn")
+        workers = [context.Process(target=_increment_marks, args=paths + ("b@example.com", 25)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+
+        self.assertEqual(Student.search_student("b@example.com")[6], "101")
+        self.assertEqual(Student.search_student("a@example.com")[6], "95")
+
+        row = Student.search_student("c@example.com")
+        Student.update_student("c@example.com", new_marks=90)
+        with self.assertRaises(check_my_grade.StaleDataError):
+            Student.update_student("c@example.com", new_marks=70, expected_row=row)
+        with self.assertRaises(check_my_grade.StaleDataError):
+            Student.delete_student("c@example.com", expected_row=row)
+        self.assertEqual(Student.search_student("c@example.com")[6], "90")
+
+
+    def test_columnar_store(self):
+        """Test that the columnar roster keeps typed columns and answers like the row lists it replaces."""
+        Student = check_my_grade.Student
+        with open(self.student_file, "a", newline="") as f:
+            f.write("a@example.com,Ann,Lee,MATH101,prof2@example.com,F,50\n")  # A second course listed the old way
+            f.write("b@example.com,Bob,Kim,CS101,prof1@example.com,B,80\n")  # Repeats the primary course
+            f.write("d@example.com,Dee,Fox,MATH101,prof2@example.com,A,95\n")
+        repo = Student.repository()
+        columns = repo.columns
+
+        self.assertEqual(len(repo), 4)
+        self.assertEqual(repo.get("a@example.com")[1], "Ann")
+        self.assertEqual(Student.student_enrollments("a@example.com")[1], ["a@example.com", "MATH101", "F", "50"])
+        self.assertEqual(check_my_grade.check_integrity(), [("students", "b@example.com", "repeats the email of another row for course CS101; row kept as is")])
+        Student.update_student("c@example.com", new_marks=86)
+        Student.compact()
+        on_disk = check_my_grade.Base.read_csv(self.student_file)
+        self.assertEqual([row[0] for row in on_disk[1:]], ["a@example.com", "b@example.com", "c@example.com", "d@example.com", "b@example.com"])
+        self.assertEqual(len(check_my_grade.Student.enrollment_repository()), 1)
+        self.assertEqual(columns.marks.dtype, "int32")
+        self.assertEqual(columns.dictionaries[3].values, ["CS101", "MATH101"])
+        self.assertFalse(hasattr(repo.student("b@example.com"), "__dict__"))
+        self.assertEqual(repo.student("b@example.com").marks, 72)
+
+        rows = [row for row in repo.all_rows()]
+        expected = sorted(rows, key=lambda row: (-int(row[6]), row[2]))
+        self.assertEqual(Student.query([("marks", False), "last_name"]), expected)
+        self.assertEqual(Student.query([("marks", False), "last_name"], limit=2, offset=1), expected[1:3])
+        self.assertEqual(Student.query("email", False, course_id="MATH101"), [rows[3], rows[2]])
+        self.assertEqual(Student.query(marks=95), [rows[0], rows[3]])
+
+        Student.delete_student("a@example.com")
+        Student.update_student("d@example.com", new_marks=99)
+        self.assertNotIn("a@example.com", repo)
+        self.assertEqual([row[0] for row in repo.all_rows()], ["b@example.com", "c@example.com", "d@example.com"])
+        self.assertTrue(Student.verify_course_statistics())
+
+        # Course lookups come from the postings: a row added after they were built, then changed, is listed once
+        Student("e@example.com", "Eve", "Moe", "MATH101", "prof2@example.com", "B", 80).save()
+        Student.update_student("e@example.com", new_marks=85)
+        self.assertEqual([row[0] for row in repo.course_rows("MATH101")], ["c@example.com", "d@example.com", "e@example.com"])
+        self.assertEqual([row[0] for row in repo.professor_rows("prof1@example.com")], ["b@example.com"])
+
+    def test_binary_snapshot(self):
+        """Test that the roster snapshot is reused while the CSV is unchanged and ignored once it changes."""
+        Student = check_my_grade.Student
+        snapshot_file = self.student_file + check_my_grade.SNAPSHOT_SUFFIX
+        Student.repository()
+        self.assertTrue(os.path.exists(snapshot_file))
+
+        def fresh():
+            repo = check_my_grade.StudentRepository(self.student_file)
+            repo.load()
+            return repo
+
+        repo = fresh()
+        self.assertIsInstance(repo.columns.marks.base, numpy.memmap)
+        self.assertEqual(repo.get("c@example.com"), ["c@example.com", "Cal", "Ray", "MATH101", "prof2@example.com", "B", "85"])
+        self.assertEqual(repo.course_aggregates().courses, Student.repository().course_aggregates().courses)
+        repo.put(["e@example.com", "Eve", "Moe", "MATH101", "prof2@example.com", "A", "99"])  # Copy-on-write: the file is untouched
+        self.assertIsNone(fresh().get("e@example.com"))
+
+        stat = os.stat(self.student_file)
+        os.utime(self.student_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsInstance(fresh().columns.marks.base, numpy.memmap, "Snapshot dropped although only the mtime changed.")
+
+        with open(self.student_file, "r+") as f:
+            content = f.read().replace("Ann,Lee,CS101,prof1@example.com,A,95", "Ann,Lee,CS101,prof1@example.com,A,96")
+            f.seek(0)
+            f.write(content)
+        os.utime(self.student_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10 ** 9))
+        self.assertEqual(fresh().get("a@example.com")[6], "96")
+        self.assertEqual(fresh().get("a@example.com")[6], "96")  # Now from the rebuilt snapshot
+
+        Student.update_student("b@example.com", new_marks=60)
+        Student.compact()
+        repo = fresh()
+        self.assertIsInstance(repo.columns.marks.base, numpy.memmap)
+        self.assertEqual(repo.get("b@example.com")[6], "60")
+
+    def test_http_service(self):
+        """Test the JSON service end to end over a real socket."""
+        loop = asyncio.new_event_loop()
+        app = service.CheckMyGradeService(require_login=False)
+        server = loop.run_until_complete(app.start("127.0.0.1", 0))
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        connection = http.client.HTTPConnection("127.0.0.1", server.sockets[0].getsockname()[1], timeout=10)
+
+        def request(method, path, body=None):
+            connection.request(method, path, json.dumps(body) if body is not None else None, {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+
+        try:
+            status, student = request("GET", "/students/b@example.com")
+            self.assertEqual((status, student["first_name"]), (200, "Bob"))
+            self.assertEqual(request("GET", "/students/x@example.com")[0], 404)
+
+            status, listing = request("GET", "/students?sort_by=-marks&limit=2")
+            self.assertEqual([row["email"] for row in listing["students"]], ["a@example.com", "c@example.com"])
+            status, listing = request("GET", "/students?course_id=CS101&sort_by=email")
+            self.assertEqual([row["email"] for row in listing["students"]], ["a@example.com", "b@example.com"])
+            self.assertEqual(request("GET", "/students?colour=red")[0], 400)
+
+            new = {"email": "d@example.com", "first_name": "Dee", "last_name": "Fox", "course_id": "MATH101",
+                   "professor_email": "prof2@example.com", "grade": "A", "marks": 91}
+            self.assertEqual(request("POST", "/students", new)[0], 201)
+            status, updated = request("PATCH", "/students/d@example.com", {"marks": 93, "expected": student})
+            self.assertEqual(status, 409)
+            status, updated = request("PATCH", "/students/d@example.com", {"marks": 93})
+            self.assertEqual((status, updated["marks"]), (200, "93"))
+            self.assertEqual(request("POST", "/students/d@example.com/enrollments", {"course_id": "CS101", "grade": "B", "marks": 84})[0], 201)
+            status, enrolled = request("GET", "/courses/CS101/students")
+            self.assertIn("d@example.com", [row["email"] for row in enrolled["enrollments"]])
+
+            status, stats = request("GET", "/statistics")
+            self.assertEqual(stats["courses"]["MATH101"]["count"], 2)
+            status, reports = request("POST", "/reports")
+            self.assertTrue(os.path.exists(reports["courses"]))
+
+            self.assertEqual(request("DELETE", "/students/d@example.com")[0], 200)
+            self.assertIsNone(check_my_grade.Student.search_student("d@example.com"))
+            self.assertEqual(request("PUT", "/students/a@example.com")[0], 405)
+
+            status, metrics = request("GET", "/metrics")
+            self.assertEqual(metrics["routes"]["GET /students/{email}"]["count"], 2)
+            self.assertIn("p95_ms", metrics["routes"]["GET /students"])
+        finally:
+            connection.close()
+            asyncio.run_coroutine_threadsafe(app.close(), loop).result(10)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(10)
+            loop.close()
+
+    def test_service_roles(self):
+        """Test that with login required every route checks the session's role, reads included."""
+        security = check_my_grade.TextSecurity(4, rounds=4)
+        check_my_grade.Base.write_csv(self.login_file, [
+            ["email", "password", "role"],
+            ["a@example.com", security.hash_password("StudentPass1234"), "student"],
+            ["prof1@example.com", security.hash_password("ProfPass1234"), "professor"],
+        ])
+        app = service.CheckMyGradeService()  # Login is required unless switched off
+
+        async def call(method, path, token=None, body=None):
+            headers = {"authorization": f"Bearer {token}"} if token else {}
+            status, payload, _ = await app.dispatch(method, path, headers, json.dumps(body).encode() if body else b"")
+            return status
+
+        async def scenario():
+            student = (await app.login({"json": {"email": "a@example.com", "password": "StudentPass1234"}}))["token"]
+            professor = (await app.login({"json": {"email": "prof1@example.com", "password": "ProfPass1234"}}))["token"]
+            bad_body = await app.dispatch("PATCH", "/students/a@example.com", {"authorization": f"Bearer {professor}"}, b"{not json")
+            bad_marks = await call("PATCH", "/students/a@example.com", professor, {"marks": "lots"})
+            integrity = check_my_grade.check_integrity
+            check_my_grade.check_integrity = lambda: {}["bug"]
+            try:
+                bug = await call("GET", "/integrity", professor)
+            finally:
+                check_my_grade.check_integrity = integrity
+            self.assertEqual((bad_body[0], bad_marks, bug), (400, 400, 500))
+            return [
+                await call("GET", "/students"),
+                await call("GET", "/students/a@example.com"),
+                await call("GET", "/students", student),
+                await call("GET", "/students/a@example.com", student),
+                await call("GET", "/students/b@example.com", student),
+                await call("PATCH", "/students/a@example.com", student, {"marks": 100}),
+                await call("DELETE", "/courses/CS101", student),
+                await call("GET", "/courses", student),
+                await call("PATCH", "/students/b@example.com", professor, {"marks": 73}),
+                await call("DELETE", "/professors/prof2@example.com", professor),
+            ]
+
+        try:
+            statuses = asyncio.run(scenario())
+        finally:
+            app.data_executor.shutdown()
+            app.password_executor.shutdown()
+        self.assertEqual(statuses, [401, 401, 403, 200, 403, 403, 403, 200, 200, 403])
+        self.assertEqual(check_my_grade.Student.search_student("a@example.com")[6], "95")
+        self.assertEqual(check_my_grade.Student.search_student("b@example.com")[6], "73")
+
+    def test_referential_integrity(self):
+        """Test unique keys, restricted deletes, cascade and reassign, and the bulk integrity check."""
+        Student, Course, Professor = check_my_grade.Student, check_my_grade.Course, check_my_grade.Professor
+        IntegrityError = check_my_grade.IntegrityError
+        self.assertEqual(check_my_grade.check_integrity(), [])
+        with self.assertRaises(IntegrityError):
+            Course.add_course("CS101", "Programming", "Duplicate")
+        with self.assertRaises(IntegrityError):
+            Professor.add_professor("prof1@example.com", "Dr. John Smith", "Senior", "CS101")
+        with self.assertRaises(IntegrityError):
+            Professor.add_professor("prof3@example.com", "Dr. Mark Brown", "Senior", "ART100")
+
+        self.assertEqual(Course.references("MATH101"), {"students": 1, "enrollments": 0, "professors": 1})
+        with self.assertRaises(IntegrityError):
+            Course.delete_course("MATH101")
+        with self.assertRaises(ValueError):
+            Course.delete_course("MATH101", on_delete="reassign")
+        self.assertIsNone(Course.delete_course("GEO100"))
+
+        Student.enroll("a@example.com", "MATH101", "B", 81)
+        Course.delete_course("MATH101", on_delete="reassign", reassign_to="CS101")
+        self.assertEqual(Student.search_student("c@example.com")[3:5], ["CS101", "prof1@example.com"])
+        self.assertEqual(Student.student_enrollments("a@example.com"), [["a@example.com", "CS101", "A", "95"]])
+        self.assertEqual([row[3] for row in Professor.index().get("prof2@example.com")], ["CS101"])
+        self.assertEqual(check_my_grade.check_integrity(), [])
+
+        Course.add_course("ART100", "Art", "Drawing")
+        Professor.add_professor("prof3@example.com", "Dr. Mark Brown", "Senior", "ART100")
+        Student("d@example.com", "Dee", "Fox", "ART100", "prof3@example.com", "A", 91).save()
+        Student.enroll("b@example.com", "ART100", "C", 75)
+        Student("f@example.com", "Fay", "Orr", "ART100", "prof3@example.com", "B", 82).save()
+        Student.enroll("f@example.com", "CS101", "C", 74)  # Two courses: losing ART100 must not delete f
+        self.assertEqual(Course.delete_course("ART100", on_delete="cascade"), {"students": 2, "enrollments": 1, "professors": 1})
+        self.assertIsNone(Student.search_student("d@example.com"))
+        self.assertEqual(Student.search_student("f@example.com"), ["f@example.com", "Fay", "Orr", "CS101", "prof1@example.com", "C", "74"])
+        self.assertEqual(Student.student_enrollments("f@example.com"), [["f@example.com", "CS101", "C", "74"]])
+        self.assertEqual(Student.course_enrollments("ART100"), [])
+        self.assertFalse(Professor.exists("prof3@example.com"))
+        self.assertEqual(check_my_grade.check_integrity(), [])
+
+        with self.assertRaises(IntegrityError):
+            Professor.delete_professor("prof1@example.com")
+        Professor.delete_professor("prof1@example.com", on_delete="reassign", reassign_to="prof2@example.com")
+        self.assertEqual(Student.repository().reference_count(4, "prof2@example.com"), 4)
+        self.assertEqual(Professor.delete_professor("prof2@example.com", on_delete="cascade"), {"students": 4, "courses": 1})
+        self.assertEqual(len(Student.repository()), 0)
+
+        Student("e@example.com", "Eve", "Moe", "GEO100", "nobody@example.com", "B", 80).save()
+        self.assertEqual(sorted(problem[1] for problem in check_my_grade.check_integrity()), ["GEO100", "nobody@example.com"])
+
+    def test_malformed_rows_are_kept(self):
+        """Test that rows that do not fit the columns survive loads, snapshots and compaction."""
+        Student = check_my_grade.Student
+        odd_rows = [
+            ["x@example.com", "Xia", "Ng", "CS101", "prof1@example.com", "A", "95", "extra"],
+            ["y@example.com", "Yul", "Oh", "CS101", "prof1@example.com", "A", "ninety"],
+        ]
+        check_my_grade.Base.append_csv(self.student_file, odd_rows)
+        self.assertEqual(len(Student.repository()), 3)
+        self.assertIsNone(Student.search_student("y@example.com"))
+        self.assertEqual([problem[0:2] for problem in check_my_grade.check_integrity()], [("students", "x@example.com"), ("students", "y@example.com")])
+
+        check_my_grade.StudentRepository._instances.clear()  # Reload from the snapshot
+        Student.update_student("a@example.com", new_marks=91)
+        Student.compact()
+        self.assertEqual(check_my_grade.Base.read_csv(self.student_file)[-2:], odd_rows)
+        with self.assertRaises(ValueError):
+            Student.repository().put(["z@example.com", "Zed", "Ray", "CS101", "prof1@example.com", "A", "lots"])
+        self.assertEqual(Student.query(sort_by="marks")[-1][0], "a@example.com")
+
+    def test_rewrites_keep_file_modes(self):
+        """Test that atomic rewrites keep each file's permissions instead of mkstemp's 0600."""
+        os.chmod(self.student_file, 0o640)
+        os.chmod(self.course_file, 0o644)
+        check_my_grade.Student.update_student("a@example.com", new_marks=91)
+        check_my_grade.Student.compact()
+        check_my_grade.Course.add_course("ART100", "Art", "Drawing")
+        check_my_grade.Course.delete_course("ART100")
+        self.assertEqual(os.stat(self.student_file).st_mode & 0o777, 0o640)
+        self.assertEqual(os.stat(self.course_file).st_mode & 0o777, 0o644)
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(os.stat(self.student_file + check_my_grade.SNAPSHOT_SUFFIX).st_mode & 0o777, 0o666 & ~umask)
+
+    def test_course_and_professor_locks_do_not_deadlock(self):
+        """Test that course and professor writers in parallel threads take their locks in the same order."""
+        Course, Professor = check_my_grade.Course, check_my_grade.Professor
+
+        def churn_courses():
+            for i in range(200):
+                Course.add_course(f"TMP{i}", "Temporary", "Created and deleted again")
+                Course.delete_course(f"TMP{i}")
+
+        def add_professors():
+            for i in range(200):
+                Professor.add_professor(f"prof{i + 10}@example.com", "Dr. Temp", "Adjunct", "CS101")
+
+        threads = [threading.Thread(target=target, daemon=True) for target in (churn_courses, add_professors)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=20)
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        self.assertEqual(len(Professor.index().get("prof209@example.com")), 1)
+
+    def test_shared_lock_is_never_upgraded(self):
+        """Test that an exclusive hold inside a shared one is refused, and that a read under a shared hold does not write."""
+        lock = check_my_grade.FileLock.for_file(self.student_file)
+        with lock.hold(exclusive=False):
+            self.assertTrue(lock.held_shared())
+            with self.assertRaises(RuntimeError):
+                with lock.hold():
+                    pass
+            with lock.hold(exclusive=False):
+                pass
+        with lock.hold():
+            with lock.hold(exclusive=False):  # Already exclusive, so a nested shared hold is fine
+                self.assertFalse(lock.held_shared())
+
+        # A repeated row is moved to enrollments on the first access that may write, not during an export
+        with open(self.student_file, "a", newline="") as f:
+            f.write("a@example.com,Ann,Lee,MATH101,prof2@example.com,B,81\n")
+        export = os.path.join(self.tmp_dir, "export.csv")
+        self.assertEqual(pipeline.export_students(export, ["email"]), 3)
+        self.assertEqual(check_my_grade.Student.student_enrollments("a@example.com")[1], ["a@example.com", "MATH101", "B", "81"])
+
+    def test_search(self):
+        """Test ranked prefix, fuzzy and course description search, kept current across mutations."""
+        Student = check_my_grade.Student
+        Student.bulk_upsert([
+            ["d@example.com", "Leo", "Kimball", "CS101", "prof1@example.com", "B", "88"],
+            ["e@example.com", "Kim", "Lee", "MATH101", "prof2@example.com", "A", "93"],
+        ])
+        emails = lambda rows: [row[0] for row in rows]
+        self.assertEqual(emails(search.search_students("kim")), ["e@example.com", "b@example.com", "d@example.com"])
+        self.assertEqual(emails(search.search_students("kim", limit=1)), ["e@example.com"])
+        self.assertEqual(emails(search.search_students("Lee kim")), ["e@example.com"])
+        self.assertEqual(search.search_students("kimbal lee"), [])
+        self.assertEqual(emails(search.search_students("kimbal"))[:1], ["d@example.com"])
+        self.assertEqual(emails(search.search_students("kimbel", fuzzy=True)), ["d@example.com"])
+        self.assertEqual(emails(search.search_students("c@example.com")), ["c@example.com"])
+
+        Student.update_student("a@example.com", new_marks=90)
+        Student.repository().put(["a@example.com", "Ann", "Kimura", "CS101", "prof1@example.com", "A", "90"])
+        Student.delete_student("b@example.com")
+        Student("f@example.com", "Kimi", "Ray", "CS101", "prof1@example.com", "C", "71").save()
+        self.assertEqual(emails(search.search_students("kim")), ["e@example.com", "f@example.com", "d@example.com", "a@example.com"])
+
+        self.assertEqual([row[0] for row in search.search_courses("python algorithms")], ["CS101"])
+        self.assertEqual([row[0] for row in search.search_courses("integration")], ["MATH101"])
+        self.assertEqual([row[0] for row in search.search_courses("integrashun", fuzzy=True)], [])
+        self.assertEqual([row[0] for row in search.search_courses("integraton", fuzzy=True)], ["MATH101"])
+        check_my_grade.Course.add_course("ART100", "Art", "Drawing and painting")
+        self.assertEqual([row[0] for row in search.search("paint")["courses"]], ["ART100"])
+        self.assertEqual([row[0] for row in search.search_professors("green")], ["prof2@example.com"])
+
+    def test_instrumentation(self):
+        """Test that instrumentation records metrics only while enabled and restores the original methods."""
+        Student = check_my_grade.Student
+        query = vars(Student)["query"]
+        instrumentation.reset()
+        instrumentation.enable(profile=True)
+        try:
+            self.assertIsNot(vars(Student)["query"], query)
+            check_my_grade.StudentRepository._instances.clear()
+            Student.query("marks", limit=2)
+            Student.update_student("b@example.com", new_marks=70)
+            check_my_grade.Course.add_course("ART100", "Art", "Drawing")
+            size = os.path.getsize(self.student_file)
+            Student("d@example.com", "Dee", "Fox", "CS101", "prof1@example.com", "D", 64).save()
+            Student.compact()
+            with self.assertRaises(ValueError):
+                Student.query("colour")
+        finally:
+            instrumentation.disable()
+        self.assertIs(vars(Student)["query"], query)
+        Student.query("marks")  # Not recorded once disabled
+
+        metrics = instrumentation.metrics()
+        self.assertEqual((metrics["Student.query"]["calls"], metrics["Student.query"]["errors"]), (2, 1))
+        self.assertEqual(metrics["Student.query"]["rows"], 2)
+        self.assertEqual(sum(metrics["Student.query"]["latency_buckets"].values()), 2)
+        self.assertEqual(metrics["CSVStorage.iter"]["bytes_read"], size)
+        self.assertGreater(metrics["CSVStorage.append"]["bytes_written"], 0)
+        self.assertEqual(metrics["Student.save"]["calls"], 1)
+        self.assertEqual(metrics["CSVStorage.write"]["rows"], 5, "Rows streamed by compact() were not counted.")
+        self.assertEqual(json.loads(instrumentation.to_json()), metrics)
+        prometheus = instrumentation.to_prometheus()
+        self.assertIn('checkmygrade_call_seconds_count{operation="Student.query"} 2', prometheus)
+        self.assertIn('checkmygrade_call_seconds_bucket{operation="Student.query",le="+Inf"} 2', prometheus)
+        self.assertIn("query", {function for _, _, function in instrumentation.profile_stats().stats})
+        instrumentation.reset()
+        self.assertEqual(instrumentation.metrics(), {})
+
+        # The environment switch applies to any program that imports check_my_grade, not only the service
+        switched = subprocess.run(
+            [sys.executable, "-c", "import pipeline, instrumentation; print(instrumentation.enabled())"],
+            env=dict(os.environ, CHECKMYGRADE_INSTRUMENT="1"), cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        )
+        self.assertEqual(switched.stdout.strip(), "True")
+
+    def test_streaming_import_export(self):
+        """Test that imports validate, merge and dedupe rows, report rejects, and that exports filter."""
+        Student = check_my_grade.Student
+        roster = os.path.join(self.tmp_dir, "roster.csv")
+        check_my_grade.Base.write_csv(roster, [
+            check_my_grade.STUDENT_HEADER,
+            ["d@example.com", "Dee", "Fox", "CS101", "prof1@example.com", "B", "81"],
+            ["e@example.com", "Eve", "Moe", "CS101", "prof1@example.com", "A", "70"],
+            ["f@example.com", "Fay", "Orr", "GEO100", "prof1@example.com", "A", "91"],
+            ["g@example.com", "Gus"],
+            ["d@example.com", "Dee", "Fox", "CS101", "prof1@example.com", "A", "94"],
+            ["a@example.com", "Ann", "Lee", "MATH101", "prof2@example.com", "B", "88"],
+        ])
+        counts = []
+        for workers in (None, 2):
+            summary = pipeline.import_students(roster, chunk_size=2, workers=workers)
+            self.assertEqual((summary["read"], summary["rejected"], summary["duplicates"]), (6, 3, 1))
+            counts.append((summary["inserted"], summary["updated"]))
+        self.assertEqual(counts, [(1, 1), (0, 2)])
+        self.assertEqual(Student.search_student("d@example.com")[5:], ["A", "94"])
+        self.assertEqual(Student.search_student("a@example.com")[3], "MATH101")
+        self.assertIsNone(Student.search_student("e@example.com"))
+        rejects = check_my_grade.Base.read_csv(summary["rejects_file"])
+        self.assertEqual([row[0] for row in rejects[1:]], ["3", "4", "5"])
+        self.assertIn("outside 90-100", rejects[1][1])
+        self.assertEqual(rejects[2][1], "unknown course 'GEO100'")
+
+        grades = os.path.join(self.tmp_dir, "grades.csv")
+        check_my_grade.Base.write_csv(grades, [["email", "marks", "grade"], ["b@example.com", "99", "A"], ["c@example.com", "99", "C"], ["z@example.com", "90", "A"]])
+        summary = pipeline.import_students(grades)
+        self.assertEqual((summary["updated"], summary["rejected"]), (1, 2))
+        self.assertEqual(Student.search_student("b@example.com"), ["b@example.com", "Bob", "Kim", "CS101", "prof1@example.com", "A", "99"])
+        reasons = [row[1] for row in check_my_grade.Base.read_csv(summary["rejects_file"])[1:]]
+        self.assertEqual(reasons, ["marks 99 outside 70-79 for grade C", "unknown student for a row without every column"])
+        self.assertTrue(Student.verify_course_statistics())
+        self.assertEqual(check_my_grade.check_integrity(), [])
+
+        repeats = os.path.join(self.tmp_dir, "repeats.csv")
+        check_my_grade.Base.write_csv(repeats, [["email", "marks", "grade"]] + [["b@example.com", "99", "A"]] * 3 + [["d@example.com", "94", "A"]])
+        summary = pipeline.import_students(repeats, chunk_size=2)
+        self.assertEqual((summary["inserted"], summary["updated"], summary["duplicates"]), (0, 2, 2))
+
+        Student.update_student("c@example.com", new_marks="73")
+        unknown = os.path.join(self.tmp_dir, "unknown.csv")
+        check_my_grade.Base.write_csv(unknown, [["email", "marks", "grade"], ["z@example.com", "90", "A"]])
+        summary = pipeline.import_students(unknown)
+        self.assertEqual((summary["read"], summary["rejected"], summary["inserted"], summary["updated"]), (1, 1, 0, 0))
+        self.assertTrue(os.path.exists(self.student_file + check_my_grade.JOURNAL_SUFFIX), "An import that applied nothing compacted.")
+
+        export = os.path.join(self.tmp_dir, "export.csv")
+        self.assertEqual(pipeline.export_students(export, ["email", "marks"], min_marks=90, course_id="CS101"), 2)
+        self.assertEqual(check_my_grade.Base.read_csv(export), [["email", "marks"], ["b@example.com", "99"], ["d@example.com", "94"]])
+        with self.assertRaises(ValueError):
+            pipeline.export_students(export, ["colour"])
+
+    def test_grade_curves(self):
+        """Test curve previews, cutoff tables, percentile curves and a single committed write."""
+        Student = check_my_grade.Student
+        Student.enroll("c@example.com", "CS101", "B", 81)
+        before = check_my_grade.Base.read_csv(self.student_file)
+
+        preview = curves.curve_course("CS101", "shift", points=5)
+        self.assertEqual((preview["changed"], preview["committed"], preview["grade_changes"]), (3, False, {}))
+        self.assertEqual((preview["before"]["max"], preview["after"]["max"], preview["after"]["min"]), (95, 100, 77))
+        self.assertEqual(check_my_grade.Base.read_csv(self.student_file), before)
+
+        cutoffs = {"A": 90, "B": 76, "C": 70, "D": 60, "F": 0}
+        self.assertEqual(curves.curve_course("CS101", "shift", cutoffs, points=5)["grade_changes"], {"C->B": 1})
+        ranked = curves.curve_course("CS101", "percentile", shares={"A": 50, "B": 50})
+        self.assertEqual((ranked["cutoffs"], ranked["grade_changes"]), ({"A": 81, "B": 0}, {"B->A": 1, "C->B": 1}))
+        self.assertEqual(curves.curve_course("CS101", "scale", factor=1.1)["after"]["max"], 100)
+        shares = {"A": 20, "B": 30, "C": 30, "D": 10, "F": 10}
+        uniform = numpy.array([80] * 10)
+        self.assertEqual(set(curves.grades_for(uniform, curves.percentile_cutoffs(uniform, shares))), {"A"})
+        tied = numpy.array([60, 70, 80] + [90] * 6 + [95])
+        self.assertEqual(list(curves.curve(tied, "percentile", shares=shares)[1]), ["F", "D", "C"] + ["A"] * 7)
+
+        committed = curves.curve_course("CS101", "shift", cutoffs, dry_run=False, points=5)
+        self.assertEqual((committed["committed"], committed["written"]), (True, 3))
+        self.assertEqual(Student.search_student("b@example.com")[5:], ["B", "77"])
+        self.assertEqual(Student.enrollment_repository().get("c@example.com", "CS101"), ["c@example.com", "CS101", "B", "86"])
+        self.assertEqual(Student.search_student("c@example.com")[5:], ["B", "85"])
+        self.assertTrue(Student.verify_course_statistics())
+
+        plan = curves.plan_curve("CS101", "shift", points=-10)
+        Student.update_student("b@example.com", new_marks=79)
+        with self.assertRaises(check_my_grade.StaleDataError):
+            plan.commit()
+        self.assertEqual(Student.search_student("a@example.com")[6], "100")
+        self.assertIsNone(curves.curve_course("GEO100", "shift", points=5))
+        with self.assertRaises(ValueError):
+            curves.curve_course("CS101", "bell")
+        with self.assertRaises(ValueError):
+            curves.curve_course("CS101", "percentile", shares={"A": 50})
+
+
 if __name__ == "__main__":
     unittest.main()